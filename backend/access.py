@@ -0,0 +1,45 @@
+"""
+Token checks for the endpoints that expose payment data or take uploads.
+
+None of them are used by the frontend - they are for operators and scripts. An
+endpoint behind a token answers 404 while its token isn't set, so it is off by
+default, and 401 to a request without the right token:
+
+    Authorization: Bearer <token>
+
+    @app.route('/api/ledger/payments')
+    @access.admin_only
+    def get_ledger_payments():
+"""
+import functools, hmac, os
+
+from flask import jsonify, request
+
+# Key to the ledger and bulk job endpoints - they are off until it is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+
+def matches(value, token):
+    """ Constant-time check of a client-supplied value against a configured token """
+    return value is not None and bool(token) and hmac.compare_digest(value.encode(), token.encode())
+
+
+def _bearer():
+    authorization = request.headers.get('Authorization', '')
+    return authorization[7:] if authorization.startswith('Bearer ') else None
+
+
+def refuse(token, *headers):
+    """ None when the request carries `token` - as a bearer token or in one of `headers` - else the error response """
+    if not token:
+        return jsonify({"error": "Not found"}), 404
+    if matches(_bearer(), token) or any(matches(request.headers.get(header), token) for header in headers):
+        return None
+    return jsonify({"error": "Unauthorized"}), 401
+
+
+def admin_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return refuse(ADMIN_TOKEN) or view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,183 @@
+"""
+Admission control - decide whether to take a request on before any work is done.
+
+init_app() adds a before_request check, run ahead of every route:
+1. a token bucket per client IP, so one client (say a frontend stuck in a loop)
+   can only use its own share - over it gets a 429
+2. a token bucket per route for the routes in ADMISSION_ROUTE_LIMITS, so a burst
+   on one route can't crowd out Apple Pay and card payments - also a 429
+3. a cap on requests in progress per process, with a short bounded queue in
+   front of it - when the queue is full or the wait too long, a 503
+
+Every rejection carries Retry-After. Buckets live in this process unless
+ADMISSION_STORE_URL points at Redis, which shares them between instances; if
+the shared store fails, requests are let through.
+"""
+import logging, math, os, threading
+
+from flask import g, jsonify, request
+
+import metrics
+from logging_config import fields
+from ratelimit import buckets_from_url
+
+log = logging.getLogger('app.admission')
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+# Requests per second per client IP, and the burst allowed on top
+ADMISSION_IP_RATE = float(os.environ.get('ADMISSION_IP_RATE', 10))
+ADMISSION_IP_BURST = float(os.environ.get('ADMISSION_IP_BURST', 30))
+# endpoint=rate:burst, comma-separated - requests per second to the route from all clients
+ADMISSION_ROUTE_LIMITS = os.environ.get(
+    'ADMISSION_ROUTE_LIMITS',
+    'create_payment_session=20:40,paymentLink=10:20,create_hosted_payments_page_session=10:20',
+)
+# Requests in progress per process, and how many may wait (and for how long) for a slot
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 100))
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', 50))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2))
+ADMISSION_STORE_URL = os.environ.get('ADMISSION_STORE_URL')
+# Proxies in front of the app that append to X-Forwarded-For (Render has one) - 0 uses the socket address
+ADMISSION_PROXY_HOPS = int(os.environ.get('ADMISSION_PROXY_HOPS', 1))
+
+# Never limited: health checks, metrics and admin, Apple's domain check
+EXEMPT_ENDPOINTS = {'get_data', 'get_metrics', 'serve_apple_pay_verification', 'static'}
+EXEMPT_PREFIXES = ('/api/admin/',)
+# Rate limited but outside the concurrency cap - long-lived, or retried by Checkout.com when refused
+UNCAPPED_ENDPOINTS = {'stream_payment_status', 'receive_checkout_webhook'}
+# Checkout.com delivers webhooks from a few addresses - don't hold them to a browser's limit
+NO_IP_LIMIT_ENDPOINTS = {'receive_checkout_webhook'}
+
+REJECTIONS = metrics.Counter('admission_rejections_total', 'Requests refused by admission control',
+                             ('route', 'reason'))
+QUEUE_WAITING = metrics.Gauge('admission_queue_waiting', 'Requests waiting for a concurrency slot')
+
+
+def parse_route_limits(spec):
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        endpoint, _, values = entry.partition('=')
+        rate, _, burst = values.partition(':')
+        limits[endpoint.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class ConcurrencyLimiter:
+    """ At most `limit` holders, and at most `queue_size` waiting behind them """
+
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_use = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """ 'ok', or why not: 'queue_full' / 'queue_timeout' """
+        with self._condition:
+            if self.in_use < self.limit and not self.waiting:
+                self.in_use += 1
+                return 'ok'
+            if self.waiting >= self.queue_size:
+                return 'queue_full'
+            self.waiting += 1
+            QUEUE_WAITING.inc()
+            try:
+                admitted = self._condition.wait_for(lambda: self.in_use < self.limit, timeout=self.timeout)
+                if not admitted:
+                    return 'queue_timeout'
+                self.in_use += 1
+                return 'ok'
+            finally:
+                self.waiting -= 1
+                QUEUE_WAITING.dec()
+
+    def release(self):
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+
+class AdmissionController:
+    def __init__(self, buckets, route_limits, limiter):
+        self.buckets = buckets
+        self.route_limits = route_limits
+        self.limiter = limiter
+
+    def client_ip(self):
+        if ADMISSION_PROXY_HOPS > 0:
+            forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+            if forwarded:
+                # The rightmost entries were added by our own proxies - anything left of them is client-supplied
+                return forwarded[max(0, len(forwarded) - ADMISSION_PROXY_HOPS)]
+        return request.remote_addr or 'unknown'
+
+    def _take(self, key, rate, burst):
+        try:
+            return self.buckets.take(key, rate, burst)
+        except Exception as e:
+            # Shared store trouble shouldn't take the payment routes down with it
+            log.warning("Rate limit store unavailable, admitting request", extra=fields(error=str(e)))
+            return 0.0
+
+    def before_request(self):
+        endpoint = request.endpoint
+        if (endpoint is None or endpoint in EXEMPT_ENDPOINTS or request.method == 'OPTIONS'
+                or request.path.startswith(EXEMPT_PREFIXES)):
+            return None
+
+        if endpoint not in NO_IP_LIMIT_ENDPOINTS:
+            client_ip = self.client_ip()
+            wait = self._take(f"ip:{client_ip}", ADMISSION_IP_RATE, ADMISSION_IP_BURST)
+            if wait:
+                return self._reject(endpoint, 'client_rate', 429, wait, client_ip=client_ip)
+
+        if endpoint in self.route_limits:
+            wait = self._take(f"route:{endpoint}", *self.route_limits[endpoint])
+            if wait:
+                return self._reject(endpoint, 'route_rate', 429, wait)
+
+        if endpoint not in UNCAPPED_ENDPOINTS:
+            outcome = self.limiter.acquire()
+            if outcome != 'ok':
+                return self._reject(endpoint, outcome, 503, 1)
+            g.admission_slot = True
+        return None
+
+    def teardown_request(self, exc=None):
+        if g.pop('admission_slot', False):
+            self.limiter.release()
+
+    def _reject(self, endpoint, reason, status, retry_after, **extra):
+        REJECTIONS.inc(endpoint, reason)
+        log.warning("Request refused by admission control", extra=fields(
+            route=endpoint, reason=reason, retry_after=retry_after, sampled=True, **extra))
+        error = "Too many requests" if status == 429 else "Server busy"
+        response = jsonify({"error": error, "reason": reason})
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response, status
+
+    def stats(self):
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "in_progress": self.limiter.in_use,
+            "waiting": self.limiter.waiting,
+            "max_concurrent": self.limiter.limit,
+            "queue_size": self.limiter.queue_size,
+            "route_limits": self.route_limits,
+            "shared_store": ADMISSION_STORE_URL is not None,
+        }
+
+
+controller = AdmissionController(
+    buckets_from_url(ADMISSION_STORE_URL),
+    parse_route_limits(ADMISSION_ROUTE_LIMITS),
+    ConcurrencyLimiter(ADMISSION_MAX_CONCURRENT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT),
+)
+
+
+def init_app(app):
+    if ADMISSION_ENABLED:
+        app.before_request(controller.before_request)
+        app.teardown_request(controller.teardown_request)
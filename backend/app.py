@@ -1,31 +1,52 @@
 from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
-from checkout_sdk.checkout_sdk import CheckoutSdk
-from checkout_sdk.environment import Environment
-import json, datetime, traceback, os, requests, uuid, traceback
+import os, requests, time, uuid
+import http_client, pipeline, idempotency, metrics, upstream, apple_pay, batch, webhooks, streams, schemas, bulk_jobs, http_cache, admission, profiling, access
+from ledger import ledger
+from clients import checkout_api, payments_client, CHECKOUT_SECRET_KEY, CHECKOUT_API_URL # The Checkout SDK is built on first use
+from resilience import UpstreamUnavailable
+from cache import payment_details_cache
+from serializer import make_json_serializable, json_response, dumps as json_dumps
+from logging_config import setup_logging, fields, log_payload
 
 
 app = Flask(__name__)
+log = setup_logging()
+metrics.init_app(app)
+profiling.init_app(app) # Before admission control, so time spent queued shows up in profiles
+admission.init_app(app) # Rate limits and the concurrency cap run before any route code
+http_client.response_hooks.append(metrics.record_upstream_response)
 app.config["DEBUG"] = True
 CORS(app, origins=["https://react-frontend-elpl.onrender.com", "https://react-flask-project-kpyi.onrender.com"]) #Frontend is running on https://
 
-# These will be loaded from your .env file locally, or from Render's environment settings in production
-CHECKOUT_SECRET_KEY = os.environ.get('CHECKOUT_SECRET_KEY')
-CHECKOUT_PUBLIC_KEY = os.environ.get('CHECKOUT_PUBLIC_KEY')
-
 # Path to your Apple Pay merchant certificate and key
 APPLE_PAY_CERT = './certificate_sandbox.pem'
 APPLE_PAY_KEY = './certificate_sandbox.key'
 MERCHANT_ID = 'merchant.com.reactFlask.sandbox'
 
-# Initialise Checkout SDK
-checkout_api = CheckoutSdk.builder() \
-    .secret_key(CHECKOUT_SECRET_KEY) \
-    .public_key(CHECKOUT_PUBLIC_KEY)\
-    .environment(Environment.sandbox()) \
-    .build() 
-
-payments_client = checkout_api.payments    
+# Loads the merchant certificate on first use, or up front in startup.prewarm()
+merchant_validator = apple_pay.MerchantValidator(APPLE_PAY_CERT, APPLE_PAY_KEY)
+
+# Batch payment-details lookups
+BATCH_MAX_IDS = int(os.environ.get('BATCH_MAX_IDS', 5000))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8)) # in-flight lookups per batch
+BATCH_ID_TIMEOUT = float(os.environ.get('BATCH_ID_TIMEOUT', 10)) # seconds per payment id
+# Seconds per batch, 0 for no limit - a sync worker can't heartbeat while it streams, so the
+# batch has to end before gunicorn's worker timeout (gunicorn.conf.py sets this from it)
+BATCH_MAX_DURATION = float(os.environ.get('BATCH_MAX_DURATION', 15))
+
+# Apple Pay tokenize-and-pay latency budget, in seconds
+APPLE_PAY_DEADLINE = float(os.environ.get('APPLE_PAY_DEADLINE', 8))
+APPLE_PAY_TOKENIZE_TIMEOUT = float(os.environ.get('APPLE_PAY_TOKENIZE_TIMEOUT', 3))
+APPLE_PAY_PAYMENT_TIMEOUT = float(os.environ.get('APPLE_PAY_PAYMENT_TIMEOUT', 6))
+
+# An upstream's circuit is open or its concurrency limit is reached - fail fast
+@app.errorhandler(UpstreamUnavailable)
+def handle_upstream_unavailable(e):
+    log.warning("Upstream unavailable", extra=fields(upstream=e.upstream, reason=e.reason))
+    response = jsonify({"error": "Upstream service unavailable", "upstream": e.upstream, "details": e.reason})
+    response.headers['Retry-After'] = str(max(1, int(round(e.retry_after))))
+    return response, 503
 
 # Test to show FE and BE communicating ff
 @app.route('/')
@@ -38,55 +59,281 @@ def serve_apple_pay_verification():
     well_known_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.well-known')
     return send_from_directory(well_known_dir, 'apple-developer-merchantid-domain-association.txt')
 
-# Recursively convert the payment details to a JSON-serializable structure
-def make_json_serializable(data):
-    """ Recursively make data JSON serializable """
-    if isinstance(data, dict):
-        return {key: make_json_serializable(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        return [make_json_serializable(item) for item in data]
-    elif hasattr(data, '__dict__'):
-        return make_json_serializable(vars(data))
-    elif isinstance(data, (str, int, float, bool, type(None))):
-        return data
-    elif hasattr(data, 'href'):  # Specific handling for ResponseWrapper links
-        return data.href  # Assuming href holds the URL link
-    else:
-        return str(data)
+# Outbound connection pool hit/miss counters, per upstream host
+@app.route('/api/admin/http-pools')
+def get_http_pool_stats():
+    return jsonify(http_client.pool_stats())
+
+# Payment details cache hit/miss/coalesce counters
+@app.route('/api/admin/payment-cache')
+def get_payment_cache_stats():
+    return jsonify(payment_details_cache.stats())
+
+# Prometheus metrics - route and upstream latency histograms, in-flight gauges, status counters
+@app.route('/metrics')
+def get_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@metrics.register_collector
+def collect_http_pool_stats():
+    lines = ['# HELP http_pool_requests_total Upstream requests by connection pool result',
+             '# TYPE http_pool_requests_total counter']
+    for host, stats in http_client.pool_stats().items():
+        lines.append(f'http_pool_requests_total{{host="{host}",result="hit"}} {stats["hits"]}')
+        lines.append(f'http_pool_requests_total{{host="{host}",result="miss"}} {stats["misses"]}')
+    return lines
+
+@metrics.register_collector
+def collect_payment_cache_stats():
+    stats = payment_details_cache.stats()
+    lines = ['# HELP payment_cache_lookups_total Payment details cache lookups by result',
+             '# TYPE payment_cache_lookups_total counter']
+    for result in ("hits", "store_hits", "misses", "coalesced"):
+        lines.append(f'payment_cache_lookups_total{{result="{result}"}} {stats[result]}')
+    lines += ['# TYPE payment_cache_entries gauge', f'payment_cache_entries {stats["size"]}']
+    return lines
+
+# Circuit breaker state and bulkhead usage per upstream
+@app.route('/api/admin/upstreams')
+def get_upstream_status():
+    return jsonify(upstream.status())
+
+@metrics.register_collector
+def collect_upstream_status():
+    lines = ['# HELP upstream_circuit_open 1 while the upstream circuit breaker is open or half-open',
+             '# TYPE upstream_circuit_open gauge']
+    for name, status in upstream.status().items():
+        lines.append(f'upstream_circuit_open{{upstream="{name}"}} {int(status["circuit"] != "closed")}')
+    return lines
+
+# Admission control - requests in progress and waiting, configured limits
+@app.route('/api/admin/admission')
+def get_admission_stats():
+    return jsonify(admission.controller.stats())
+
+@metrics.register_collector
+def collect_admission_stats():
+    return ['# TYPE admission_in_progress gauge', f'admission_in_progress {admission.controller.limiter.in_use}']
+
+# Idempotency store size and in-flight duplicates
+@app.route('/api/admin/idempotency')
+def get_idempotency_stats():
+    return jsonify(idempotency.stats())
+
+# Webhook queue depth and payments tracked from webhook events
+@app.route('/api/admin/webhooks')
+def get_webhook_stats():
+    return jsonify(webhooks.processor.stats())
+
+@metrics.register_collector
+def collect_webhook_stats():
+    stats = webhooks.processor.stats()
+    return ['# TYPE webhook_queue_depth gauge', f'webhook_queue_depth {stats["queued"]}',
+            '# TYPE webhook_payments_tracked gauge', f'webhook_payments_tracked {stats["payments_tracked"]}']
+
+# Captured request profiles, newest last (see profiling.py) - ?download=1 to save them as a file
+# Needs PROFILE_TOKEN, see profiling.protected()
+@app.route('/api/admin/profiles')
+@profiling.protected
+def get_profiles():
+    captured = profiling.profiles.list(reason=request.args.get('reason'), route=request.args.get('route'))
+    response = jsonify({"stats": profiling.profiles.stats(), "profiles": captured})
+    if request.args.get('download'):
+        response.headers['Content-Disposition'] = f'attachment; filename="profiles-{int(time.time())}.json"'
+    return response
+
+@app.route('/api/admin/profiles/<profile_id>')
+@profiling.protected
+def get_profile(profile_id):
+    profile = profiling.profiles.get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(profile)
+
+# Payment ledger writer queue (see ledger.py)
+@app.route('/api/admin/ledger')
+def get_ledger_stats():
+    return jsonify(ledger.stats())
+
+@metrics.register_collector
+def collect_ledger_stats():
+    stats = ledger.stats()
+    return ['# TYPE ledger_queue_depth gauge', f'ledger_queue_depth {stats["queued"]}']
+
+# GET - payments recorded by this backend, newest first, without calling Checkout.com.
+# Filters: days (default 7, 0 for all), status, reference, payment_id, route. Pass next_cursor back as cursor for the next page.
+# Needs ADMIN_TOKEN - every payment's id, reference, amount and errors (see access.py)
+@app.route('/api/ledger/payments')
+@access.admin_only
+def get_ledger_payments():
+    args = request.args
+    try:
+        days = float(args.get('days', 7))
+        limit = int(args.get('limit', 100))
+        cursor = int(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        return jsonify({"error": "days, limit and cursor must be numbers"}), 400
+    payments, next_cursor = ledger.query(
+        since=time.time() - days * 86400 if days > 0 else None, status=args.get('status'),
+        reference=args.get('reference'), payment_id=args.get('payment_id'), route=args.get('route'),
+        limit=limit, cursor=cursor)
+    return jsonify({"payments": payments, "next_cursor": next_cursor})
+
+def fetch_payment_details(payment_id):
+    payment_details = upstream.call(upstream.CHECKOUT, 'get_payment_details', payments_client.get_payment_details, payment_id)
+    # Convert the SDK response to plain JSON data (see serializer.py)
+    with profiling.phase('serialize'):
+        return make_json_serializable(payment_details)
+
+def apply_webhook_status(payment_id, details):
+    """ details, with the status from this worker's webhook view when that is further along - no upstream call """
+    state = webhooks.payment_states.get(payment_id)
+    if state is None or state["status"] == details.get("status"):
+        return details
+    # Statuses only move forward - details fetched before the event arrived are behind it, not ahead
+    if webhooks.STATUS_ORDER.get(state["status"], 0) < webhooks.STATUS_ORDER.get(details.get("status"), 0):
+        return details
+    patched = dict(details, status=state["status"])
+    payment_details_cache.put(payment_id, patched)
+    return patched
 
 # GET - payment details
 @app.route('/api/payment-details/<payment_id>')
 def get_payment_details(payment_id):
     try:
-        payment_details = payments_client.get_payment_details(payment_id)
-        # Recursively convert the payment details to a JSON-serializable structure
-        response_data = make_json_serializable(vars(payment_details))
-        print("Extracted Payment Details:", response_data)
-        return jsonify(response_data)
+        # Served from cache when we can - concurrent polls for the same id share one upstream call
+        response_data = payment_details_cache.get(payment_id, fetch_payment_details)
+        # Status as of the latest webhook, even if the details were fetched before it
+        response_data = apply_webhook_status(payment_id, response_data)
+        log.info("Payment details served", extra=fields(payment_id=payment_id, status=response_data.get("status"), sampled=True))
+        log_payload(log, "Extracted payment details", response_data)
+        # ETag + compression - a client that already has this version gets a 304, and a cached
+        # payment is encoded and compressed once rather than on every poll
+        return http_cache.respond(http_cache.encoded_for(payment_id, response_data))
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        if hasattr(e, 'http_status_code'):
-            print(f"HTTP Status Code: {e.http_status_code}")
-        if hasattr(e, 'error_details'):
-            print(f"Error Details: {e.error_details}")
+        log.error("Failed to fetch payment details", extra=fields(
+            payment_id=payment_id, error=str(e),
+            http_status_code=getattr(e, 'http_status_code', None),
+            error_details=getattr(e, 'error_details', None)))
         return jsonify({"error": "Failed to fetch payment details", "details": str(e)}), 500
     
+# POST - Checkout.com webhook - verified and queued, processed in the background (see webhooks.py)
+@app.route('/api/webhooks/checkout', methods=['POST'])
+def receive_checkout_webhook():
+    status_code, body = webhooks.processor.receive(request.get_data(), request.headers)
+    return jsonify(body), status_code
+
+# A webhook changed a payment's status - patch its cached details in place rather than reloading them
+@webhooks.payment_states.subscribe
+def patch_cached_payment_details(payment_id, state, previous):
+    details = payment_details_cache.peek(payment_id)
+    if details is not None:
+        apply_webhook_status(payment_id, details)
+
+# GET - payment status, from webhook events when we have them, otherwise from the payment details
+@app.route('/api/payment-status/<payment_id>')
+def get_payment_status(payment_id):
+    state = webhooks.payment_states.get(payment_id)
+    if state is not None:
+        return jsonify(dict(state, source="webhook"))
+    try:
+        response_data = payment_details_cache.get(payment_id, fetch_payment_details)
+        return jsonify({"payment_id": payment_id, "status": response_data.get("status"), "source": "details"})
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        log.error("Failed to fetch payment status", extra=fields(payment_id=payment_id, error=str(e)))
+        return jsonify({"error": "Failed to fetch payment status", "details": str(e)}), 500
+
+# Push webhook status changes to any open status streams
+@webhooks.payment_states.subscribe
+def publish_payment_status(payment_id, state, previous):
+    streams.status_streams.publish(payment_id, dict(state, source="webhook"))
+
+# GET - Server-Sent Events stream of status changes for a payment id or payment session id (see streams.py)
+@app.route('/api/payment-status/<key>/stream')
+def stream_payment_status(key):
+    try:
+        subscription = streams.status_streams.subscribe(key)
+    except streams.TooManySubscribers as e:
+        log.warning("Payment status stream refused", extra=fields(key=key, error=str(e)))
+        response = jsonify({"error": "Too many open status streams, poll /api/payment-status instead"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    # Subscribed first, so a change that lands while we look up the current status isn't missed
+    initial_state = webhooks.payment_states.get(key)
+    if initial_state is not None:
+        initial_state = dict(initial_state, source="webhook")
+    elif key.startswith('pay_'):
+        try:
+            details = payment_details_cache.get(key, fetch_payment_details)
+            initial_state = {"payment_id": key, "status": details.get("status"), "source": "details"}
+        except Exception as e:
+            # Still worth streaming - the webhook may arrive before the upstream recovers
+            log.warning("Initial payment status lookup failed", extra=fields(key=key, error=str(e)))
+
+    response = app.response_class(streams.stream(subscription, initial_state), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let a proxy hold events back
+    response.call_on_close(lambda: streams.status_streams.unsubscribe(subscription))
+    return response
+
+# Open status streams
+@app.route('/api/admin/streams')
+def get_stream_stats():
+    return jsonify(streams.status_streams.stats())
+
+@metrics.register_collector
+def collect_stream_stats():
+    return ['# TYPE sse_streams_open gauge', f'sse_streams_open {streams.status_streams.stats()["open"]}']
+
+# POST - payment details for many ids, streamed back as NDJSON as each lookup completes
+@app.route('/api/payment-details/batch', methods=['POST'])
+def get_payment_details_batch():
+    data = request.get_json(silent=True) or {}
+    payment_ids = data.get("payment_ids")
+    if not isinstance(payment_ids, list) or not all(isinstance(pid, str) and pid for pid in payment_ids):
+        return jsonify({"error": "payment_ids must be a list of payment ids"}), 400
+    if len(payment_ids) > BATCH_MAX_IDS:
+        return jsonify({"error": f"At most {BATCH_MAX_IDS} payment ids per batch"}), 400
+
+    def lookup(payment_id):
+        # Same cache and serialization path as /api/payment-details/<payment_id>
+        return payment_details_cache.get(payment_id, fetch_payment_details)
+
+    # Ids not looked up in time get an "ok": false line to resend in another batch
+    deadline = time.monotonic() + BATCH_MAX_DURATION if BATCH_MAX_DURATION > 0 else None
+
+    def generate():
+        ok = failed = 0
+        for payment_id, details, error in batch.fan_out(dict.fromkeys(payment_ids), lookup, deadline=deadline,
+                                                        concurrency=BATCH_CONCURRENCY, timeout=BATCH_ID_TIMEOUT):
+            if error is None:
+                ok += 1
+                line = {"payment_id": payment_id, "ok": True, "details": details}
+            else:
+                failed += 1
+                line = {"payment_id": payment_id, "ok": False, "error": str(error)}
+                status_code = getattr(getattr(error, 'http_metadata', None), 'status_code', None)
+                if status_code is not None:
+                    line["http_status_code"] = status_code
+            yield json_dumps(line) + b"\n"
+        log.info("Payment details batch finished", extra=fields(ok=ok, failed=failed))
+
+    return app.response_class(generate(), mimetype='application/x-ndjson')
+
 # POST - Flow - Create payment session
 @app.route('/api/create-payment-session', methods=['POST'])
+@schemas.validate(schemas.PAYMENT_SESSION)
 def create_payment_session():
     response = None # Initialize response to None for error handling
     try:
-        # Step 1: Get the raw JSON from the frontend
-        data = request.json
-
-        # Only set the default channel ID if one is not provided by the frontend
-        if 'processing_channel_id' not in data:
-            data['processing_channel_id'] = "pc_pxk25jk2hvuenon5nyv3p6nf2i"
-        # Add success and failure URLs to the data received from the frontend.
-        # This ensures redirection still works.
-        data['success_url'] = "https://react-frontend-elpl.onrender.com/success"
-        data['failure_url'] = "https://react-frontend-elpl.onrender.com/failure"
-
+        # Step 1: Get the validated JSON from the frontend - the schema fills in the
+        # default channel ID and always sets our success and failure URLs so redirection still works
+        data = schemas.payload()
 
         # The block that manually built the `payment_request` has been removed.
         # We now pass the 'data' dictionary from the frontend directly.
@@ -94,25 +341,26 @@ def create_payment_session():
         payment_sessions_client = checkout_api.payment_sessions
         
         # Step 2: Pass the entire frontend payload directly to the SDK
-        response = payment_sessions_client.create_payment_sessions(data)
+        response = upstream.call(upstream.CHECKOUT, 'create_payment_sessions', payment_sessions_client.create_payment_sessions, data)
 
-        print(f"Payment Session created successfully with ID: {response.id}")
+        log.info("Payment session created", extra=fields(payment_session_id=response.id, sampled=True))
         return jsonify({
             "id": response.id,
             "payment_session_secret": response.payment_session_secret,
             "payment_session_token": response.payment_session_token
         }), 200
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception("Payment session creation failed")
         error_message = {"error": "Internal Server Error during payment session creation", "details": str(e)}
 
         if hasattr(e, 'http_metadata') and e.http_metadata and hasattr(e.http_metadata, 'status_code'):
              error_message["http_status_code"] = e.http_metadata.status_code
              if hasattr(e, 'error_details') and e.error_details:
                  error_message["api_errors"] = e.error_details
-             print(f"Checkout API Error: Status {e.http_metadata.status_code}, Details: {e.error_details}")
+             log.warning("Checkout API error", extra=fields(http_status_code=e.http_metadata.status_code, error_details=e.error_details))
         elif response and hasattr(response, 'error_type'):
             error_message["type"] = response.error_type
         return jsonify(error_message), 500
@@ -120,24 +368,25 @@ def create_payment_session():
 
 #Card Payment - Risk Data
 @app.route('/api/request-card-payment', methods=['POST'])
+@idempotency.idempotent
+@schemas.validate(schemas.CARD_PAYMENT)
 def request_card_payment():
     try:
-        payment_data = request.json
-
-        if 'processing_channel_id' not in payment_data:
-            payment_data['processing_channel_id'] = "pc_pxk25jk2hvuenon5nyv3p6nf2i" 
-        
-        response = payments_client.request_payment(payment_data)
+        payment_data = schemas.payload()
 
-        # Convert the response object to a JSON-serializable dictionary
-        response_data = make_json_serializable(vars(response))
+        response = upstream.call(upstream.CHECKOUT, 'request_payment', payments_client.request_payment,
+                                 payment_data, idempotency_key=idempotency.current_key())
 
-        print(f"Payment response received: {response_data}")
+        log.info("Card payment processed", extra=fields(payment_id=response.id, status=response.status, sampled=True))
+        ledger.record('request_card_payment', response, payment_data)
 
-        return jsonify(response_data)
+        # Encode the SDK response object straight to JSON
+        return json_response(response)
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        traceback.print_exc()
+        log.exception("Card payment failed")
         # Handle potential errors from the SDK
         error_details = str(e)
         status_code = 500
@@ -145,11 +394,14 @@ def request_card_payment():
             status_code = e.http_metadata.status_code
         if hasattr(e, 'error_details'):
             error_details = e.error_details
+        ledger.record('request_card_payment', request_data=schemas.payload(), status="Error", error=str(e),
+                      http_status_code=status_code)
         
         return jsonify({"error": "Failed to process card payment", "details": error_details}), status_code
 
 #Standard Payment
 @app.route('/api/payments', methods=['POST'])
+@idempotency.idempotent
 def regularPayment():
     try:
         data = request.json
@@ -166,31 +418,32 @@ def regularPayment():
             "processing_channel_id": processing_channel_id, 
             "capture": capture,
         }
-        response = checkout_api.payments.request_payment(payment_request)
+        response = upstream.call(upstream.CHECKOUT, 'request_payment', checkout_api.payments.request_payment,
+                                 payment_request, idempotency_key=idempotency.current_key())
+        ledger.record('regularPayment', response, payment_context_id=payment_context_id)
         #Display the API response response.id will find the field with id from the response
         return jsonify({"payment_id": response.id, "status":response.status})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
+        ledger.record('regularPayment', status="Error", error=str(e))
         #When there is an error display responses error codes and type
         return jsonify({"error": str(e), "error Code": response.error_codes, "Error Type": response.error_type}), 500
 
 #Payment Link
 @app.route('/api/paymentLink', methods=['POST'])
+@schemas.validate(schemas.PAYMENT_LINK)
 def paymentLink():
     try:
         # The frontend sends a JSON payload that matches the expected API structure.
-        # We can pass this dictionary directly to the SDK method.
-        payload = request.json
-
-        if 'processing_channel_id' not in payload:
-            payload['processing_channel_id'] = "pc_pxk25jk2hvuenon5nyv3p6nf2i"
-
-        payload['return_url'] = "https://react-frontend-elpl.onrender.com/success"
+        # Once validated (with the channel ID and return URL filled in) it goes straight to the SDK.
+        payload = schemas.payload()
 
-        print(payload)
+        log_payload(log, "Payment link request", payload)
 
         # The SDK's hosted_payments client is accessed directly from the main API instance.
         # The payload dictionary is passed as the argument.
-        response = checkout_api.payments_links.create_payment_link(payload)
+        response = upstream.call(upstream.CHECKOUT, 'create_payment_link', checkout_api.payments_links.create_payment_link, payload)
 
         # The SDK response object needs to be converted to a dict to be JSON serializable
         response_dict = {
@@ -204,8 +457,10 @@ def paymentLink():
         
         return jsonify(response_dict), 201
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        traceback.print_exc()
+        log.exception("Payment link creation failed")
         # Attempt to get more detailed error info from the SDK exception if available
         error_details = str(e)
         if hasattr(e, 'error_details'):
@@ -214,10 +469,12 @@ def paymentLink():
 
 #Payment Context - PayPal
 @app.route('/api/payment-contexts', methods=['POST'])
+@schemas.validate(schemas.PAYMENT_CONTEXT, status=400)
 def paymentContext():
     response = None # Initialize response to None for error handling
     try:
-        data = request.json
+        # Mandatory fields are already checked, and defaults filled in, by the schema
+        data = schemas.payload()
         
         # Extract dynamic values from the frontend request data
         amount = data["amount"]
@@ -227,15 +484,15 @@ def paymentContext():
         payment_type = data.get("payment_type", "Regular") # Default to Regular if not provided by frontend
         
         # Customer details (assuming frontend sends email and potentially name)
-        customer_email = data.get("email", "mark@hotmail.com")
-        customer_name = data.get("customer_name", "Mark Reilly")
+        customer_email = data["email"]
+        customer_name = data["customer_name"]
 
         # Billing address details (assuming frontend sends the full dict)
         #billing_address = data.get("billing_address")
         
-        processing_channel_id = data.get("processing_channel_id")
-        success_url = data.get("success_url")
-        failure_url = data.get("failure_url")
+        processing_channel_id = data["processing_channel_id"]
+        success_url = data["success_url"]
+        failure_url = data["failure_url"]
         # --- FIXED: Extract nested processing and item data correctly ---
         processing_data = data.get("processing", {})
         user_action = processing_data.get("user_action", "continue")
@@ -253,10 +510,6 @@ def paymentContext():
             }]
 
 
-        # Basic validation for mandatory fields from frontend
-        if not all([amount, currency, customer_email, processing_channel_id, success_url, failure_url]):
-            return jsonify({"error": "Missing essential fields for payment context (amount, currency, email, billing_address, processing_channel_id, success_url, failure_url)"}), 400
-
         # Construct the request for the Checkout.com API
         requestPaymentContext = {
             "source": { "type": "paypal" },
@@ -286,14 +539,18 @@ def paymentContext():
         
         # Ensure 'contexts' exists in 'checkout_api' client
         if not hasattr(checkout_api, "contexts") or not hasattr(checkout_api.contexts, "create_payment_contexts"):
-            print("Error: Checkout.com SDK 'contexts' client or 'create_payment_contexts' method not found.")
+            log.error("Checkout.com SDK 'contexts' client or 'create_payment_contexts' method not found")
             return jsonify({"error": "Payment Contexts SDK client not initialized correctly"}), 500
 
         # Create the payment context
         payment_contexts_client = checkout_api.contexts
-        response = payment_contexts_client.create_payment_contexts(requestPaymentContext)
+        response = upstream.call(upstream.CHECKOUT, 'create_payment_contexts',
+                                 payment_contexts_client.create_payment_contexts, requestPaymentContext)
         
-        print(f"Payment Context created successfully with ID: {response.id}, Order ID: {response.partner_metadata.order_id}")
+        log.info("Payment context created", extra=fields(
+            payment_context_id=response.id, order_id=response.partner_metadata.order_id, sampled=True))
+        ledger.record('paymentContext', response, requestPaymentContext, kind='payment_context',
+                      order_id=response.partner_metadata.order_id)
 
         # Return relevant response data to the frontend
         return jsonify({
@@ -301,39 +558,60 @@ def paymentContext():
             "order_id": response.partner_metadata.order_id # Contains PayPal's order_i
         }), 201 # Return 201 Created for successful creation
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception("Payment context creation failed")
         error_message = {"error": "Internal Server Error during payment context creation", "details": str(e)}
+        ledger.record('paymentContext', request_data=schemas.payload(), kind='payment_context', status="Error",
+                      error=str(e))
 
         if hasattr(e, 'http_metadata') and e.http_metadata and hasattr(e.http_metadata, 'status_code'):
              error_message["http_status_code"] = e.http_metadata.status_code
              if hasattr(e, 'error_details') and e.error_details:
                  error_message["api_errors"] = e.error_details
-             print(f"Checkout API Error: Status {e.http_metadata.status_code}, Details: {e.error_details}")
+             log.warning("Checkout API error", extra=fields(http_status_code=e.http_metadata.status_code, error_details=e.error_details))
         elif response and hasattr(response, 'error_type'):
             error_message["type"] = response.error_type
         return jsonify(error_message), 500
 
 # Apple Pay session - Tokenize and Pay
 @app.route('/api/apple-pay-session', methods=['POST'])
+@idempotency.idempotent
 def apple_pay_session():
     data = request.get_json()
-    print("Token Data in Apple Pay session call:", data["tokenData"])
+    log_payload(log, "Apple Pay session request", data)
+
+    # Tokenize-and-pay runs as a pipeline with an overall deadline, so the merchant
+    # gets an answer within APPLE_PAY_DEADLINE even if one of the legs is slow.
+    flow = pipeline.Pipeline("apple_pay", deadline=APPLE_PAY_DEADLINE)
+
+    def respond(body, status_code):
+        log.info("Apple Pay pipeline finished", extra=fields(spans=flow.spans, status_code=status_code))
+        response = jsonify(body)
+        response.headers['Server-Timing'] = flow.server_timing()
+        return response, status_code
     
     # 1. Tokenize the Apple Pay token using the SDK
     try:
-        token_response = checkout_api.tokens.request_wallet_token({
+        token_response = flow.run("tokenize", upstream.call, upstream.CHECKOUT, 'request_wallet_token',
+                                  checkout_api.tokens.request_wallet_token, {
             "type": "applepay",
             "token_data": data["tokenData"]
-        })
+        }, timeout=APPLE_PAY_TOKENIZE_TIMEOUT)
         token = token_response.token  # The Checkout.com card token
-        print("Tokenized Apple Pay token:", token)
+        log.debug("Apple Pay token tokenized")
+    except pipeline.StepTimeout as e:
+        log.warning("Apple Pay tokenization timed out", extra=fields(error=str(e)))
+        return respond({"approved": False, "error": "Tokenization timed out", "status": "Timeout"}, 504)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        print(f"Tokenization failed: {e}")
-        return jsonify({"error": "Tokenization failed", "details": str(e)}), 400
+        log.warning("Apple Pay tokenization failed", extra=fields(error=str(e)))
+        return respond({"error": "Tokenization failed", "details": str(e)}, 400)
     
     # 2. Use the token to create a payment request
+    payment_request = None
     try:
         payment_request = {
             "source": {
@@ -356,44 +634,64 @@ def apple_pay_session():
                 "enabled": True, # It's good practice to explicitly enable risk
                 "device_session_id": device_session_id
             }
-            print(f"Including risk data with device_session_id: {device_session_id}")
+            log.debug("Including risk data", extra=fields(device_session_id=device_session_id))
         
-        payment_response = payments_client.request_payment(payment_request)
+        payment_response = flow.run("pay", upstream.call, upstream.CHECKOUT, 'request_payment',
+                                    payments_client.request_payment, payment_request,
+                                    idempotency_key=idempotency.current_key(),
+                                    timeout=APPLE_PAY_PAYMENT_TIMEOUT)
         
         # Determine payment status
         is_approved = payment_response.status == "Authorized" or payment_response.status == "Captured"
-        return jsonify({
+        ledger.record('apple_pay_session', payment_response, payment_request, approved=is_approved)
+        return respond({
             "approved": is_approved,
             "status": payment_response.status,
             "payment_id": payment_response.id
-        }), 200
+        }, 200)
+    except (pipeline.StepTimeout, pipeline.PipelineCancelled) as e:
+        # The payment may still complete upstream - return the reference so it can be reconciled
+        log.warning("Apple Pay payment timed out", extra=fields(error=str(e), reference=payment_request["reference"]))
+        ledger.record('apple_pay_session', request_data=payment_request, status="Timeout", approved=False, error=str(e))
+        return respond({
+            "approved": False,
+            "error": "Payment timed out",
+            "status": "Timeout",
+            "reference": payment_request["reference"]
+        }, 504)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        print(f"Payment failed: {str(e)}")
+        log.warning("Apple Pay payment failed", extra=fields(error=str(e)))
         # Try to get more detailed error info from the SDK exception
         error_details = str(e)
         if hasattr(e, 'error_details'):
             error_details = e.error_details
-        return jsonify({
+        ledger.record('apple_pay_session', request_data=payment_request, status="Failed", approved=False, error=str(e))
+        return respond({
             "approved": False,
             "error": error_details,
             "status": "Failed"
-        }), 400
+        }, 400)
 
 #Apple Pay - Validate Merchant
 @app.route('/api/apple-pay/validate-merchant', methods=['POST'])
 def validate_merchant():
     data = request.get_json()
     validation_url = data.get('validationURL')
-    print("Validation URL:", validation_url)
     merchant_identifier = data.get('merchantIdentifier', MERCHANT_ID)  # Default to the defined MERCHANT_I
-    print("Merchant Identifier:", merchant_identifier)
     display_name = data.get('displayName', "CKO Integrations")  # Default display name
-    print("Display Name:", display_name)
     initiative_context = data.get('initiativeContext',"react-flask-project-kpyi.onrender.com")
-    print("Initiative Context:", initiative_context)
+    log.debug("Validating Apple Pay merchant", extra=fields(
+        validation_url=validation_url, merchant_identifier=merchant_identifier,
+        display_name=display_name, initiative_context=initiative_context))
 
     if not validation_url:
         return jsonify({"error": "Missing validationURL"}), 400
+    # The URL comes from the browser - only ever present our merchant certificate to Apple
+    if not apple_pay.is_validation_url(validation_url):
+        log.warning("Rejected Apple Pay validation URL", extra=fields(validation_url=validation_url))
+        return jsonify({"error": "validationURL is not an Apple Pay validation host"}), 400
     payload = {
         "merchantIdentifier": merchant_identifier,
         "displayName": display_name,
@@ -402,22 +700,18 @@ def validate_merchant():
     }
     
     try:
-        response = requests.post(
-            validation_url,
-            json=payload,
-            cert=(APPLE_PAY_CERT, APPLE_PAY_KEY),
-            headers={"Content-Type": "application/json"}
-        )
-        response.raise_for_status()
-        print("Merchant Verified")
-        return jsonify(response.json())
+        # Reuses a still-valid merchant session for the same merchant/domain when there is one
+        merchant_session, cached = merchant_validator.validate(validation_url, payload)
+        log.info("Apple Pay merchant verified", extra=fields(
+            merchant_identifier=merchant_identifier, cached=cached, sampled=True))
+        return jsonify(merchant_session)
     except requests.RequestException as e:
-        print("❌ Error validating merchant:")
-        traceback.print_exc()
+        log.exception("Error validating Apple Pay merchant")
         return jsonify({"error": str(e)}), 500
     
 #Flow - Submit payment session    
 @app.route('/api/submit-flow-session-payment', methods=['POST'])
+@idempotency.idempotent
 def submit_flow_session_payment():
     try:
         data = request.json
@@ -462,59 +756,72 @@ def submit_flow_session_payment():
             'Authorization': f'Bearer {CHECKOUT_SECRET_KEY}', # Use your Checkout.com Secret Key
             'Content-Type': 'application/json'
         }
+        if idempotency.current_key():
+            headers['Cko-Idempotency-Key'] = idempotency.current_key()
 
         # The URL for submitting payment sessions
-        submit_url = f'https://api.sandbox.checkout.com/payment-sessions/{payment_session_id}/submits'
+        submit_url = f'{CHECKOUT_API_URL}/payment-sessions/{payment_session_id}/submits'
 
-        print(f"Submitting payment session to CKO: {submit_url}")
-        print(f"Request body: {request_body}")
+        log.debug("Submitting payment session to CKO", extra=fields(url=submit_url))
+        log_payload(log, "Payment session submit request", request_body)
 
-        response = requests.post(submit_url, headers=headers, json=request_body)
+        response = upstream.call(upstream.CHECKOUT, 'submit_payment_session', http_client.checkout_session().post,
+                                 submit_url, headers=headers, json=request_body)
         response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
 
         # --- IMPORTANT: Return the UNMODIFIED response body from CKO to the frontend ---
         # The frontend's flowComponent.completePayment() expects this specific format.
-        print(f"Checkout.com submission response status: {response.status_code}")
-        print(f"Checkout.com submission response body: {response.json()}")
-        return jsonify(response.json()), response.status_code
+        response_body = response.json()
+        log.info("Payment session submitted", extra=fields(
+            payment_session_id=payment_session_id, status_code=response.status_code,
+            status=response_body.get("status"), sampled=True))
+        log_payload(log, "Payment session submit response", response_body)
+        ledger.record('submit_flow_session_payment', response_body, request_body, payment_session_id=payment_session_id)
+        if response_body.get("id"):
+            # Streams opened on the payment session id follow the payment from here on
+            streams.status_streams.link(payment_session_id, response_body["id"], {
+                "payment_id": response_body["id"], "payment_session_id": payment_session_id,
+                "status": response_body.get("status"), "source": "submit"})
+        return jsonify(response_body), response.status_code
 
     except requests.exceptions.HTTPError as http_err:
         # Handle HTTP errors from Checkout.com API call
-        print(f"HTTP error occurred: {http_err}")
-        print(f"Response content: {http_err.response.text}")
+        log.warning("CKO API HTTP error", extra=fields(error=str(http_err), response=http_err.response.text))
         try:
             error_details = http_err.response.json()
         except ValueError:
             error_details = {"message": http_err.response.text}
+        ledger.record('submit_flow_session_payment', request_data=request_body, status="Error", error=str(http_err),
+                      payment_session_id=payment_session_id, http_status_code=http_err.response.status_code)
         return jsonify({"error": "CKO API HTTP Error", "details": error_details}), http_err.response.status_code
     except requests.exceptions.ConnectionError as conn_err:
         # Handle network connectivity errors
-        print(f"Connection error occurred: {conn_err}")
+        log.error("Connection error to CKO", extra=fields(error=str(conn_err)))
         return jsonify({"error": "Network Connection Error to CKO", "details": str(conn_err)}), 503 # Service Unavailable
     except requests.exceptions.Timeout as timeout_err:
         # Handle request timeout errors
-        print(f"Timeout error occurred: {timeout_err}")
+        log.error("CKO API request timed out", extra=fields(error=str(timeout_err)))
         return jsonify({"error": "CKO API Request Timeout", "details": str(timeout_err)}), 504 # Gateway Timeout
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         # Catch any other unexpected errors
-        traceback.print_exc()
-        print(f"An unexpected error occurred during payment session submission: {e}")
+        log.exception("Unexpected error during payment session submission")
         return jsonify({"error": "Internal Server Error", "details": str(e)}), 500
     
 #Hosted Payments Page
 @app.route('/api/hosted-payments', methods=['POST'])
+@schemas.validate(schemas.HOSTED_PAYMENTS)
 def create_hosted_payments_page_session():
     try:
         # The frontend sends a JSON payload that matches the expected API structure.
-        # We can pass this dictionary directly to the SDK method.
-        payload = request.json
-
-        if 'processing_channel_id' not in payload:
-            payload['processing_channel_id'] = "pc_pxk25jk2hvuenon5nyv3p6nf2i"
+        # Once validated (with the channel ID filled in) it goes straight to the SDK.
+        payload = schemas.payload()
 
         # The SDK's hosted_payments client is accessed directly from the main API instance.
         # The payload dictionary is passed as the argument.
-        response = checkout_api.hosted_payments.create_hosted_payments_page_session(payload)
+        response = upstream.call(upstream.CHECKOUT, 'create_hosted_payments_page_session',
+                                 checkout_api.hosted_payments.create_hosted_payments_page_session, payload)
 
         # The SDK response object needs to be converted to a dict to be JSON serializable
         response_dict = {
@@ -522,15 +829,17 @@ def create_hosted_payments_page_session():
             "reference": response.reference,
             "_links": {
                 "redirect": {
-                    "href": response._links['redirect'].href
+                    "href": response._links.redirect.href
                 }
             }
         }
         
         return jsonify(response_dict), 201
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        traceback.print_exc()
+        log.exception("Hosted Payments session creation failed")
         # Attempt to get more detailed error info from the SDK exception if available
         error_details = str(e)
         if hasattr(e, 'error_details'):
@@ -538,5 +847,58 @@ def create_hosted_payments_page_session():
         return jsonify({"error": "Failed to create Hosted Payments session", "details": error_details}), 500
 
 
+# POST - bulk payment links / hosted payment pages from a CSV or JSONL upload (see bulk_jobs.py)
+# The body is streamed to disk, send it with Content-Type text/csv or application/x-ndjson (or ?format=csv|jsonl)
+# The bulk routes need ADMIN_TOKEN (see access.py)
+@app.route('/api/bulk/payment-links', methods=['POST'], defaults={'kind': 'payment_link'})
+@app.route('/api/bulk/hosted-payments', methods=['POST'], defaults={'kind': 'hosted_payment'})
+@access.admin_only
+def create_bulk_job(kind):
+    input_format = bulk_jobs.parse_format(request.content_type, request.args.get('format'))
+    try:
+        state = bulk_jobs.create(kind, input_format, request.stream)
+    except bulk_jobs.TooManyJobs as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '60'
+        return response, 429
+    except bulk_jobs.JobError as e:
+        return jsonify({"error": str(e)}), 400
+    log.info("Bulk job created", extra=fields(job_id=state["id"], kind=kind, input_bytes=state["input_bytes"]))
+    response = jsonify(state)
+    response.headers['Location'] = f'/api/bulk/jobs/{state["id"]}'
+    return response, 202
+
+# GET - bulk job progress
+@app.route('/api/bulk/jobs/<job_id>')
+@access.admin_only
+def get_bulk_job(job_id):
+    state = bulk_jobs.load(job_id)
+    if state is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(state)
+
+# GET - bulk job results so far, one JSON line per finished row
+@app.route('/api/bulk/jobs/<job_id>/results')
+@access.admin_only
+def get_bulk_job_results(job_id):
+    if bulk_jobs.load(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    results_path = bulk_jobs.results_path(job_id)
+    if not os.path.exists(results_path):
+        return app.response_class(b'', mimetype='application/x-ndjson')
+
+    def generate():
+        with open(results_path, 'rb') as f:
+            while True:
+                chunk = f.read(bulk_jobs.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    response = app.response_class(generate(), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename="{job_id}-results.jsonl"'
+    return response
+
+
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Apple Pay merchant validation.
+
+The merchant certificate is parsed once into the mTLS session's SSL context,
+connections to Apple's validation hosts are opened ahead of time and kept alive,
+and validated merchant sessions are reused for the same merchant/domain for as
+long as Apple allows, so opening the Apple Pay sheet usually costs no round trip
+at all.
+"""
+import logging, os, threading, time
+from urllib.parse import urlsplit
+
+import http_client, metrics, upstream
+from cache import LRUCache, SingleFlight
+from logging_config import fields
+
+log = logging.getLogger('app.apple_pay')
+
+# Apple's merchant validation endpoints (production, China and sandbox certificates)
+VALIDATION_HOSTS = [host.strip() for host in os.environ.get(
+    'APPLE_PAY_VALIDATION_HOSTS',
+    'apple-pay-gateway.apple.com,cn-apple-pay-gateway.apple.com,apple-pay-gateway-cert.apple.com',
+).split(',') if host.strip()]
+# Every host Apple lists for merchant validation. validationURL comes from the browser,
+# so nothing outside this list (plus VALIDATION_HOSTS) is ever called with our certificate.
+APPLE_VALIDATION_HOSTS = frozenset(
+    ['apple-pay-gateway.apple.com', 'cn-apple-pay-gateway.apple.com',
+     'apple-pay-gateway-cert.apple.com', 'cn-apple-pay-gateway-cert.apple.com']
+    + [f'apple-pay-gateway-{pod}-pod{n}.apple.com' for pod in ('nc', 'pr') for n in range(1, 6)]
+    + [f'cn-apple-pay-gateway-{pod}-pod{n}.apple.com' for pod in ('sh', 'tj') for n in range(1, 4)]
+)
+ALLOWED_VALIDATION_HOSTS = APPLE_VALIDATION_HOSTS | set(VALIDATION_HOSTS)
+# A local stand-in (bench/fake_upstream.py) may be reached over plain http once listed in APPLE_PAY_VALIDATION_HOSTS
+_LOOPBACK_HOSTS = {'127.0.0.1', 'localhost', '::1'}
+# Apple merchant sessions expire five minutes after they are created - keep a
+# safety margin so a cached session is never handed out just before it expires
+SESSION_CACHE_TTL = float(os.environ.get('APPLE_PAY_SESSION_CACHE_TTL', 240))
+SESSION_EXPIRY_MARGIN = 30
+PREWARM = os.environ.get('APPLE_PAY_PREWARM', 'true').lower() == 'true'
+
+VALIDATION_LATENCY = metrics.Histogram('apple_pay_validation_seconds', 'Time to answer a merchant validation request',
+                                       ('source',))
+
+
+def is_validation_url(url):
+    """ True when url is https to an Apple Pay validation host on the default port (or a listed loopback stand-in) """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except (TypeError, ValueError):
+        return False
+    host = parts.hostname
+    if host not in ALLOWED_VALIDATION_HOSTS or parts.username or parts.password:
+        return False
+    if host in _LOOPBACK_HOSTS:
+        return parts.scheme in ('http', 'https')
+    return parts.scheme == 'https' and port in (None, 443)
+
+
+class MerchantValidator:
+    def __init__(self, cert_path, key_path):
+        self.cert_path = cert_path
+        self.key_path = key_path
+        self.sessions = LRUCache(maxsize=256)
+        self.flights = SingleFlight()
+
+    def session(self):
+        return http_client.mtls_session(self.cert_path, self.key_path)
+
+    def preload(self):
+        """ Parse the certificate now rather than on the first validation """
+        try:
+            self.session()
+        except (OSError, ValueError):
+            log.exception("Could not load the Apple Pay merchant certificate")
+            return False
+        return True
+
+    def prewarm(self, hosts=None):
+        """ Open a keep-alive mTLS connection to each validation host in the background """
+        def warm():
+            for host in hosts or VALIDATION_HOSTS:
+                try:
+                    self.session().head(f"https://{host}/", timeout=(3.05, 5))
+                except Exception as e:
+                    log.warning("Could not pre-warm Apple Pay host", extra=fields(host=host, error=str(e)))
+        thread = threading.Thread(target=warm, name='apple-pay-prewarm', daemon=True)
+        thread.start()
+        return thread
+
+    def validate(self, validation_url, payload):
+        """ Returns (merchant_session, cached) - raises requests.RequestException on failure """
+        if not is_validation_url(validation_url):
+            raise ValueError(f"Not an Apple Pay validation URL: {validation_url!r}")
+        start = time.perf_counter()
+        key = (urlsplit(validation_url).hostname, payload["merchantIdentifier"],
+               payload["displayName"], payload["initiativeContext"])
+        merchant_session = self.sessions.get(key) if SESSION_CACHE_TTL > 0 else None
+        source = 'cache'
+        if merchant_session is None:
+            # Concurrent sheets for the same merchant share one call to Apple
+            merchant_session, shared = self.flights.do(key, self._request, key, validation_url, payload)
+            source = 'coalesced' if shared else 'apple'
+        VALIDATION_LATENCY.observe(source, value=time.perf_counter() - start)
+        return merchant_session, source != 'apple'
+
+    def _request(self, key, validation_url, payload):
+        response = upstream.call(
+            upstream.APPLE, 'validate_merchant', self.session().post,
+            validation_url,
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            allow_redirects=False,
+        )
+        response.raise_for_status()
+        merchant_session = response.json()
+        ttl = self._ttl(merchant_session)
+        if ttl > 0:
+            self.sessions.set(key, merchant_session, ttl)
+        return merchant_session
+
+    def _ttl(self, merchant_session):
+        ttl = SESSION_CACHE_TTL
+        expires_at = merchant_session.get("expiresAt")  # epoch milliseconds
+        if isinstance(expires_at, (int, float)):
+            ttl = min(ttl, expires_at / 1000 - time.time() - SESSION_EXPIRY_MARGIN)
+        return ttl
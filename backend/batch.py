@@ -0,0 +1,66 @@
+"""
+Concurrent fan-out for batch lookups.
+
+fan_out() runs fn(item) for every item on a shared, bounded thread pool, keeps at
+most `concurrency` items of one batch in flight, and yields (item, result, error)
+as each call finishes - so results can be streamed back while the rest are still
+running. An item that takes longer than `timeout` is reported as a TimeoutError
+and the batch moves on. With a `deadline` the whole batch ends by then: items
+still running are reported as timed out and items not started yet are reported
+straight away, without calling fn.
+"""
+import os, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 16))
+
+executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+_END = object()
+
+
+def fan_out(items, fn, concurrency=BATCH_MAX_WORKERS, timeout=10.0, pool=None, deadline=None):
+    """ deadline is a time.monotonic() value, or None for no limit on the whole batch """
+    pool = pool or executor
+    items = iter(items)
+    pending = {}  # future -> (item, expires)
+
+    def fill():
+        while len(pending) < concurrency:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+            item = next(items, _END)
+            if item is _END:
+                return
+            expires = now + timeout if deadline is None else min(now + timeout, deadline)
+            pending[pool.submit(fn, item)] = (item, expires)
+
+    try:
+        fill()
+        while pending:
+            next_expiry = min(expires for _, expires in pending.values())
+            done, _ = wait(pending, timeout=max(0, next_expiry - time.monotonic()), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                item, _ = pending.pop(future)
+                error = future.exception()
+                yield item, (None if error else future.result()), error
+
+            now = time.monotonic()
+            out_of_time = deadline is not None and now >= deadline
+            for future, (item, expires) in list(pending.items()):
+                if expires <= now:
+                    # Can't interrupt a running call - stop waiting for it and free the slot
+                    future.cancel()
+                    del pending[future]
+                    yield item, None, TimeoutError("Batch time limit reached" if out_of_time
+                                                   else f"No result within {timeout}s")
+            fill()
+        # Out of time - whatever wasn't started is reported, not looked up
+        for item in items:
+            yield item, None, TimeoutError("Batch time limit reached")
+    finally:
+        # The client went away or the batch finished early - drop work that hasn't started
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,94 @@
+"""
+Size and latency report for payment details responses: identity vs gzip vs
+brotli vs a 304, plus what each costs to produce on the server.
+
+Transfer times are estimated for typical mobile links (bandwidth plus one round
+trip), which is where the saving matters for checkout pages.
+
+    cd backend
+    python bench/bench_compression.py [--number 2000]
+"""
+import argparse, glob, json, os, sys, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+import http_cache, serializer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# name -> (bits per second, round trip seconds)
+LINKS = {
+    "3G": (750_000, 0.3),
+    "4G": (10_000_000, 0.07),
+}
+# Bytes a 304 puts on the wire (status line and headers)
+NOT_MODIFIED_BYTES = 250
+
+
+def transfer_ms(size, link):
+    bandwidth, rtt = LINKS[link]
+    return round((rtt + size * 8 / bandwidth) * 1000, 1)
+
+
+def run(number):
+    app = Flask(__name__)
+    results = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.json'))):
+        with open(path) as f:
+            data = json.load(f)
+        encoded = http_cache.encode(data)
+        sizes = {"identity": len(encoded.body)}
+        for encoding in http_cache._PREFERENCE:
+            if encoding in http_cache._COMPRESSORS:
+                sizes[encoding] = len(encoded.variant(encoding))
+        sizes["not_modified"] = NOT_MODIFIED_BYTES
+
+        def request(headers):
+            with app.test_request_context(headers=headers):
+                return http_cache.respond(http_cache.encoded_for(path, data))
+
+        http_cache.encoded_for(path, data)
+        server_us = {
+            "serialize": timeit.timeit(lambda: serializer.dumps(data), number=number),
+            "gzip_compress": timeit.timeit(lambda: http_cache._COMPRESSORS['gzip'](encoded.body), number=number),
+            "cached_identity": timeit.timeit(lambda: request({}), number=number),
+            "cached_gzip": timeit.timeit(lambda: request({"Accept-Encoding": "gzip"}), number=number),
+            "not_modified": timeit.timeit(lambda: request({"If-None-Match": encoded.etag}), number=number),
+        }
+        if 'br' in http_cache._COMPRESSORS:
+            server_us["brotli_compress"] = timeit.timeit(lambda: http_cache._COMPRESSORS['br'](encoded.body),
+                                                         number=number)
+        results[os.path.basename(path)] = {
+            "bytes": sizes,
+            "server_us": {name: round(total / number * 1e6, 2) for name, total in server_us.items()},
+            "transfer_ms": {link: {name: transfer_ms(size, link) for name, size in sizes.items()} for link in LINKS},
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--json', action='store_true', help='print the raw report as JSON')
+    args = parser.parse_args()
+
+    results = run(args.number)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"brotli: {'yes' if http_cache.brotli else 'no'}")
+    for fixture, report in results.items():
+        print(fixture)
+        identity = report["bytes"]["identity"]
+        for name, size in report["bytes"].items():
+            saved = 100 - size * 100 // identity
+            times = '  '.join(f"{link} {report['transfer_ms'][link][name]:>6}ms" for link in LINKS)
+            print(f"  {name:<14}{size:>8} B  (-{saved:>2}%)  {times}")
+        for name, micros in report["server_us"].items():
+            print(f"  {name:<20}{micros:>10} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Microbenchmark: serializer.py against the old recursive make_json_serializable.
+
+Recorded Checkout.com responses in bench/fixtures are rebuilt as SDK-style
+response objects (nested objects for JSON objects, including the _links
+entries, plus the http_metadata the SDK attaches), then serialized and encoded
+with each implementation.
+
+    cd backend
+    python bench/bench_serializer.py [--number 2000]
+"""
+import argparse, glob, json, os, sys, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from requests.structures import CaseInsensitiveDict
+
+import serializer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class ResponseWrapper:
+    """ Same shape as the SDK's response objects: one attribute per JSON field """
+
+    def __init__(self, data):
+        for key, value in data.items():
+            setattr(self, key, wrap(value))
+
+
+class HttpMetadata:
+    """ What the SDK's map_to_http_metadata() attaches - headers stay a CaseInsensitiveDict of (name, value) tuples """
+
+    def __init__(self, status_code, headers):
+        self.reason_phrase = None
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+
+
+RESPONSE_HEADERS = {
+    "Content-Type": "application/json; charset=utf-8",
+    "Cko-Request-Id": "5f6e2cbd-5ce0-4f43-b1b5-8ca58a8e86c9",
+    "Cko-Version": "1.2.3",
+}
+
+
+def wrap(value):
+    if isinstance(value, dict):
+        return ResponseWrapper(value)
+    if isinstance(value, list):
+        return [wrap(item) for item in value]
+    return value
+
+
+def legacy_make_json_serializable(data):
+    """ The implementation app.py used before serializer.py """
+    if isinstance(data, dict):
+        return {key: legacy_make_json_serializable(value) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [legacy_make_json_serializable(item) for item in data]
+    elif hasattr(data, '__dict__'):
+        return legacy_make_json_serializable(vars(data))
+    elif isinstance(data, (str, int, float, bool, type(None))):
+        return data
+    elif hasattr(data, 'href'):
+        return data.href
+    else:
+        return str(data)
+
+
+def legacy_encode(response):
+    # jsonify(make_json_serializable(vars(response))) minus the Flask response object
+    return json.dumps(legacy_make_json_serializable(vars(response)), sort_keys=True).encode()
+
+
+def run(number):
+    results = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.json'))):
+        with open(path) as f:
+            response = wrap(json.load(f))
+        response.http_metadata = HttpMetadata(200, RESPONSE_HEADERS)
+
+        # Both must produce the same data before timing means anything
+        assert serializer.make_json_serializable(response) == legacy_make_json_serializable(vars(response))
+        assert json.loads(serializer.dumps(response)) == json.loads(legacy_encode(response))
+
+        timings = {
+            "legacy_to_plain": timeit.timeit(lambda: legacy_make_json_serializable(vars(response)), number=number),
+            "to_plain": timeit.timeit(lambda: serializer.to_plain(response), number=number),
+            "make_json_serializable": timeit.timeit(lambda: serializer.make_json_serializable(response), number=number),
+            "legacy_encode": timeit.timeit(lambda: legacy_encode(response), number=number),
+            "dumps": timeit.timeit(lambda: serializer.dumps(response), number=number),
+        }
+        results[os.path.basename(path)] = {name: round(total / number * 1e6, 2) for name, total in timings.items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if serializer.orjson else 'no'} - microseconds per call")
+    for fixture, timings in run(args.number).items():
+        print(fixture)
+        for name, micros in timings.items():
+            print(f"  {name:<24}{micros:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Microbenchmark: schemas.py validation overhead per request.
+
+Times each route schema against a valid payload and an invalid one, next to a
+plain dict copy of the same payload (the floor for anything that normalizes),
+and the old hand-written paymentContext check.
+
+    cd backend
+    python bench/bench_validation.py [--number 20000]
+"""
+import argparse, copy, os, sys, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import schemas
+
+BILLING = {"address": {"address_line1": "1 Test Street", "city": "London", "zip": "W1 1AA", "country": "gb"}}
+
+PAYLOADS = {
+    "PAYMENT_SESSION": {
+        "amount": 5555, "currency": "gbp", "reference": "ORD-5023-4E89",
+        "billing": BILLING, "customer": {"name": "Jia Tsang", "email": "jia.tsang@example.com"},
+        "items": [{"name": "Wireless Headphones", "quantity": 1, "unit_price": 5555}],
+        "enabled_payment_methods": ["card", "applepay", "googlepay"],
+    },
+    "CARD_PAYMENT": {
+        "source": {"type": "card", "number": "4242424242424242", "expiry_month": 12, "expiry_year": 2030, "cvv": "100"},
+        "amount": "1000", "currency": "GBP", "reference": "card-risk-demo", "capture": True,
+        "risk": {"enabled": True, "device_session_id": "dsid_ipsmclhxwq72phhr32iwfvrflm"},
+    },
+    "PAYMENT_LINK": {"amount": 1000, "currency": "EUR", "reference": "INV-1001", "billing": BILLING},
+    "HOSTED_PAYMENTS": {
+        "amount": 1000, "currency": "GBP", "reference": "HPP-1", "billing": BILLING,
+        "success_url": "https://example.com/success", "failure_url": "https://example.com/failure",
+        "cancel_url": "https://example.com/cancel",
+    },
+    "PAYMENT_CONTEXT": {
+        "amount": 1000, "currency": "GBP", "capture": True, "payment_type": "Regular",
+        "email": "mark@hotmail.com", "processing_channel_id": "pc_pxk25jk2hvuenon5nyv3p6nf2i",
+        "success_url": "https://example.com/success", "failure_url": "https://example.com/failure",
+        "processing": {"user_action": "pay_now", "shipping_preference": "no_shipping"},
+        "items": [{"name": "Item", "unit_price": 1000, "quantity": 1, "total_amount": 1000}],
+    },
+}
+
+
+def invalid(payload):
+    """ Same payload with a bad amount, a bad currency and a required field missing """
+    bad = copy.deepcopy(payload)
+    bad["amount"] = 10.5
+    bad["currency"] = "pounds"
+    bad.pop("billing", None) or bad.pop("source", None) or bad.pop("success_url", None)
+    return bad
+
+
+def legacy_payment_context_check(data):
+    """ The hand-written check paymentContext ran before schemas.py """
+    amount = data["amount"]
+    currency = data["currency"]
+    customer_email = data.get("email", "mark@hotmail.com")
+    processing_channel_id = data.get("processing_channel_id")
+    success_url = data.get("success_url")
+    failure_url = data.get("failure_url")
+    return all([amount, currency, customer_email, processing_channel_id, success_url, failure_url])
+
+
+def run(number):
+    results = {}
+    for name, payload in PAYLOADS.items():
+        schema = getattr(schemas, name)
+        bad = invalid(payload)
+        assert not schema(payload)[1], schema(payload)[1]
+        assert schema(bad)[1]
+
+        timings = {
+            "dict_copy": timeit.timeit(lambda: dict(payload), number=number),
+            "valid": timeit.timeit(lambda: schema(payload), number=number),
+            "invalid": timeit.timeit(lambda: schema(bad), number=number),
+        }
+        if name == "PAYMENT_CONTEXT":
+            timings["legacy_check"] = timeit.timeit(lambda: legacy_payment_context_check(payload), number=number)
+        results[name] = {label: round(total / number * 1e6, 2) for label, total in timings.items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    print("microseconds per call")
+    for name, timings in run(args.number).items():
+        print(name)
+        for label, micros in timings.items():
+            print(f"  {label:<16}{micros:>10}")
+    print(f"errors reported for an invalid PAYMENT_LINK: {schemas.PAYMENT_LINK(invalid(PAYLOADS['PAYMENT_LINK']))[1]}")
+
+
+if __name__ == '__main__':
+    main()
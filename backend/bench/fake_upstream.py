@@ -0,0 +1,238 @@
+"""
+Local stand-in for Checkout.com and Apple Pay merchant validation.
+
+Answers every endpoint the backend calls with a realistic response body, after a
+latency drawn from a configurable distribution, and fails a configurable
+fraction of requests with a 5xx.
+
+    cd backend
+    python bench/fake_upstream.py --port 8099 --latency lognormal:80,0.5 --error-rate 0.01
+    CHECKOUT_API_URL=http://127.0.0.1:8099 flask run
+
+Apple Pay: send validationURL=http://127.0.0.1:8099/paymentservices/startSession, with
+APPLE_PAY_VALIDATION_HOSTS=127.0.0.1 set for the backend so it accepts that host.
+
+Latency specs (milliseconds): fixed:50, uniform:20,120, lognormal:<median>,<sigma>
+"""
+import argparse, json, math, os, random, re, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def parse_latency(spec):
+    """ Turn a latency spec into a function returning a delay in seconds """
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+    if kind == 'fixed':
+        return lambda: values[0] / 1000
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+    raise ValueError(f"Unknown latency spec {spec!r}")
+
+
+def _id(prefix):
+    return prefix + uuid.uuid4().hex[:26]
+
+
+def _links(base, path, **extra):
+    links = {"self": {"href": f"{base}{path}"}}
+    links.update({name: {"href": href} for name, href in extra.items()})
+    return links
+
+
+def payment(base, body):
+    payment_id = _id('pay_')
+    return 201, {
+        "id": payment_id,
+        "action_id": _id('act_'),
+        "amount": body.get("amount", 1000),
+        "currency": body.get("currency", "GBP"),
+        "approved": True,
+        "status": "Authorized" if body.get("capture") is False else "Captured",
+        "response_code": "10000",
+        "response_summary": "Approved",
+        "reference": body.get("reference"),
+        "processed_on": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "source": {"type": "card", "id": _id('src_'), "scheme": "Visa", "last4": "4242", "bin": "424242"},
+        "_links": _links(base, f"/payments/{payment_id}", actions=f"{base}/payments/{payment_id}/actions"),
+    }
+
+
+def payment_details(base, body, payment_id):
+    with open(os.path.join(FIXTURES_DIR, 'payment_details.json')) as f:
+        details = json.load(f)
+    details["id"] = payment_id
+    details["_links"] = _links(base, f"/payments/{payment_id}", actions=f"{base}/payments/{payment_id}/actions")
+    return 200, details
+
+
+def payment_session(base, body):
+    session_id = _id('ps_')
+    return 201, {
+        "id": session_id,
+        "payment_session_secret": "pss_" + uuid.uuid4().hex,
+        "payment_session_token": uuid.uuid4().hex * 4,
+        "_links": _links(base, f"/payment-sessions/{session_id}"),
+    }
+
+
+def payment_session_submit(base, body, session_id):
+    return 201, {"id": _id('pay_'), "status": "Approved", "type": "card"}
+
+
+def payment_context(base, body):
+    context_id = _id('pct_')
+    return 201, {
+        "id": context_id,
+        "partner_metadata": {"order_id": uuid.uuid4().hex[:17].upper()},
+        "_links": _links(base, f"/payment-contexts/{context_id}"),
+    }
+
+
+def hosted_payment(base, body):
+    hpp_id = _id('hpp_')
+    return 201, {
+        "id": hpp_id,
+        "reference": body.get("reference"),
+        "_links": _links(base, f"/hosted-payments/{hpp_id}", redirect=f"https://pay.sandbox.checkout.com/page/{hpp_id}"),
+    }
+
+
+def payment_link(base, body):
+    link_id = _id('pl_')
+    return 201, {
+        "id": link_id,
+        "expires_on": "2030-01-01T00:00:00Z",
+        "_links": _links(base, f"/payment-links/{link_id}", redirect=f"https://pay.sandbox.checkout.com/link/{link_id}"),
+    }
+
+
+def wallet_token(base, body):
+    return 201, {
+        "type": body.get("type", "applepay"),
+        "token": _id('tok_'),
+        "expires_on": "2030-01-01T00:00:00Z",
+        "scheme": "VISA",
+        "last4": "4242",
+        "bin": "424242",
+    }
+
+
+def merchant_session(base, body):
+    now_ms = int(time.time() * 1000)
+    return 200, {
+        "epochTimestamp": now_ms,
+        "expiresAt": now_ms + 5 * 60 * 1000,
+        "merchantSessionIdentifier": "SSH" + uuid.uuid4().hex.upper(),
+        "nonce": uuid.uuid4().hex[:8],
+        "merchantIdentifier": body.get("merchantIdentifier"),
+        "domainName": body.get("initiativeContext"),
+        "displayName": body.get("displayName"),
+        "signature": uuid.uuid4().hex * 8,
+    }
+
+
+# (method, path pattern, handler) - handlers get (base_url, body, *path groups)
+ROUTES = [
+    ('POST', re.compile(r'^/payments$'), payment),
+    ('GET', re.compile(r'^/payments/([^/]+)$'), payment_details),
+    ('POST', re.compile(r'^/payment-sessions$'), payment_session),
+    ('POST', re.compile(r'^/payment-sessions/([^/]+)/submits$'), payment_session_submit),
+    ('POST', re.compile(r'^/payment-contexts$'), payment_context),
+    ('POST', re.compile(r'^/hosted-payments$'), hosted_payment),
+    ('POST', re.compile(r'^/payment-links$'), payment_link),
+    ('POST', re.compile(r'^/tokens$'), wallet_token),
+    ('POST', re.compile(r'^/paymentservices/(?:startSession|paymentSession)$'), merchant_session),
+]
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency='fixed:0', error_rate=0.0):
+        super().__init__(address, FakeUpstreamHandler)
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.request_counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key):
+        with self._lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Cko-Request-Id', str(uuid.uuid4()))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        body = json.loads(raw) if raw else {}
+        path = self.path.split('?')[0]
+        server = self.server
+
+        time.sleep(server.latency())
+        server.count(f"{method} {path.split('/')[1] if '/' in path else path}")
+
+        if random.random() < server.error_rate:
+            return self._send(random.choice([500, 502, 503]), {"request_id": str(uuid.uuid4()), "error_type": "server_error"})
+
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                return self._send(*handler(server.base_url, body, *match.groups()))
+        self._send(404, {"error_type": "not_found", "path": path})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def start(port=0, latency='fixed:0', error_rate=0.0):
+    """ Run the stand-in on a background thread, returns the server (see .base_url) """
+    server = FakeUpstreamServer(('127.0.0.1', port), latency=latency, error_rate=error_rate)
+    threading.Thread(target=server.serve_forever, name='fake-upstream', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', default='lognormal:80,0.4')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeUpstreamServer(('127.0.0.1', args.port), latency=args.latency, error_rate=args.error_rate)
+    print(f"Fake Checkout.com/Apple upstream on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Load test comparing the sync and async (gevent) serving modes.
+
+Starts the app under gunicorn once per mode, drives one route at a fixed
+concurrency for a fixed duration and prints throughput and latency percentiles.
+
+    cd backend
+    python bench/loadtest.py --path /api/payment-details/pay_xxx --concurrency 50
+    python bench/loadtest.py --method POST --path /api/request-card-payment --body payment.json
+
+Point the app at a local upstream stand-in to avoid hammering the sandbox.
+"""
+import argparse, collections, json, os, subprocess, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    """ latencies of the 2xx responses; errors counts everything else, by status (or 'exception') """
+    latencies = sorted(latencies)
+    error_count = sum(errors.values())
+    return {
+        "requests": len(latencies) + error_count,
+        "errors": error_count,
+        "error_statuses": dict(errors),
+        "throughput_rps": round((len(latencies) + error_count) / elapsed, 1) if elapsed else 0,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(latencies[-1] if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def drive(base_url, method, path, body, concurrency, duration, headers=None):
+    """
+    Hammer one route from `concurrency` threads for `duration` seconds.
+    path, body and headers may be callables, to vary them per request.
+    """
+    latencies, errors = [], collections.Counter()
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client_loop():
+        session = requests.Session()
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                response = session.request(
+                    method, base_url + (path() if callable(path) else path),
+                    json=body() if callable(body) else body,
+                    headers=headers() if callable(headers) else headers,
+                    timeout=60)
+                # Only 2xx counts - a 4xx is as much a failed run as a 5xx, and much faster
+                outcome = None if 200 <= response.status_code < 300 else str(response.status_code)
+            except requests.RequestException:
+                outcome = 'exception'
+            took = time.perf_counter() - start
+            with lock:
+                if outcome is None:
+                    latencies.append(took)
+                else:
+                    errors[outcome] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client_loop)
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up")
+
+
+def start_server(mode, port, workers, extra_env=None):
+    env = dict(os.environ, SERVE_MODE=mode, **(extra_env or {}))
+    # All the load comes from one client IP - per-client rate limits would throttle the benchmark itself
+    env.setdefault('ADMISSION_ENABLED', 'false')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'app:app'],
+        cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--method', default='GET')
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--body', help='JSON file to send as the request body')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    body = None
+    if args.body:
+        with open(args.body) as f:
+            body = json.load(f)
+
+    results = {}
+    for mode in args.modes.split(','):
+        server = start_server(mode, args.port, args.workers)
+        base_url = f'http://127.0.0.1:{args.port}'
+        try:
+            wait_until_up(base_url)
+            results[mode] = drive(base_url, args.method, args.path, body, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        print(mode, json.dumps(results[mode]))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
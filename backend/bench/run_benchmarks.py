@@ -0,0 +1,170 @@
+"""
+End-to-end benchmark suite against the local upstream stand-in.
+
+Starts bench/fake_upstream.py, starts the app under gunicorn pointed at it, then
+drives every route at increasing concurrency and reports throughput and
+p50/p95/p99 latency. Results are written to bench/results/<timestamp>-<commit>.json.
+
+    cd backend
+    python bench/run_benchmarks.py                                   # all routes
+    python bench/run_benchmarks.py --routes payment_details_cached,card_payment --levels 1,16,64
+    python bench/run_benchmarks.py --compare bench/results/old.json bench/results/new.json
+"""
+import argparse, json, os, subprocess, sys, time, uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_upstream, loadtest
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Key formats the SDK accepts - the stand-in never checks them
+BENCH_SECRET_KEY = 'sk_sbox_benchbenchbenchbenchbenchb#'
+BENCH_PUBLIC_KEY = 'pk_sbox_benchbenchbenchbenchbenchb#'
+
+
+def _unique_key():
+    return {"Idempotency-Key": str(uuid.uuid4())}
+
+
+def routes(upstream_url):
+    """ name -> (method, path, body, headers) - callables are evaluated per request """
+    card = {
+        "source": {"type": "card", "number": "4242424242424242", "expiry_month": 12, "expiry_year": 2030, "cvv": "100"},
+        "amount": 1000, "currency": "GBP", "reference": "bench",
+    }
+    return {
+        "payment_details_cached": ('GET', '/api/payment-details/pay_benchcached', None, None),
+        "payment_details_uncached": ('GET', lambda: f'/api/payment-details/pay_{uuid.uuid4().hex[:26]}', None, None),
+        "create_payment_session": ('POST', '/api/create-payment-session',
+                                   {"amount": 5555, "currency": "GBP", "reference": "bench",
+                                    "billing": {"address": {"country": "GB"}}}, None),
+        "card_payment": ('POST', '/api/request-card-payment', card, _unique_key),
+        "regular_payment": ('POST', '/api/payments', {"payment_context_id": "pct_bench"}, _unique_key),
+        "payment_context": ('POST', '/api/payment-contexts',
+                            {"amount": 1000, "currency": "GBP", "processing_channel_id": "pc_bench",
+                             "success_url": "https://example.com/s", "failure_url": "https://example.com/f"}, None),
+        "apple_pay_session": ('POST', '/api/apple-pay-session',
+                              {"tokenData": {"version": "EC_v1", "data": "bench", "signature": "bench",
+                                             "header": {"ephemeralPublicKey": "bench", "publicKeyHash": "bench",
+                                                        "transactionId": "bench"}},
+                               "amount": 1000, "currencyCode": "GBP"}, _unique_key),
+        "apple_pay_validate_merchant": ('POST', '/api/apple-pay/validate-merchant',
+                                        {"validationURL": f"{upstream_url}/paymentservices/startSession"}, None),
+        "submit_flow_session": ('POST', '/api/submit-flow-session-payment',
+                                lambda: {"session_data": uuid.uuid4().hex, "payment_session_id": "ps_bench",
+                                         "amount": 5555, "threeDsEnabled": False}, None),
+        "hosted_payments": ('POST', '/api/hosted-payments',
+                            {"amount": 1000, "currency": "GBP", "reference": "bench",
+                             "billing": {"address": {"country": "GB"}},
+                             "success_url": "https://example.com/s", "failure_url": "https://example.com/f",
+                             "cancel_url": "https://example.com/c"}, None),
+        "payment_link": ('POST', '/api/paymentLink',
+                         {"amount": 1000, "currency": "GBP", "reference": "bench",
+                          "billing": {"address": {"country": "GB"}}}, None),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=loadtest.BACKEND_DIR,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    upstream = fake_upstream.start(latency=args.latency, error_rate=args.error_rate)
+    env = {
+        "CHECKOUT_API_URL": upstream.base_url,
+        "CHECKOUT_SECRET_KEY": BENCH_SECRET_KEY,
+        "CHECKOUT_PUBLIC_KEY": BENCH_PUBLIC_KEY,
+        "APPLE_PAY_PREWARM": "false",
+        # Lets validate-merchant call the stand-in, which the Apple host allowlist would refuse
+        "APPLE_PAY_VALIDATION_HOSTS": "127.0.0.1",
+        "LOG_LEVEL": "WARNING",
+    }
+    server = loadtest.start_server(args.mode, args.port, args.workers, extra_env=env)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    all_routes = routes(upstream.base_url)
+    selected = args.routes.split(',') if args.routes else list(all_routes)
+    levels = [int(level) for level in args.levels.split(',')]
+    results = {}
+    try:
+        loadtest.wait_until_up(base_url)
+        for name in selected:
+            method, path, body, headers = all_routes[name]
+            results[name] = {}
+            for level in levels:
+                summary = loadtest.drive(base_url, method, path, body, level, args.duration, headers=headers)
+                results[name][str(level)] = summary
+                print(f"{name:<30}c={level:<4} {summary['throughput_rps']:>8} rps  "
+                      f"p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  p99 {summary['p99_ms']}ms  "
+                      f"errors {summary['errors']}")
+                if summary['errors'] > summary['requests'] // 2:
+                    print(f"  warning: mostly errors {summary['error_statuses']} - latencies are of the few successes")
+    finally:
+        server.terminate()
+        server.wait()
+        upstream.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "config": {"mode": args.mode, "workers": args.workers, "duration": args.duration,
+                   "latency": args.latency, "error_rate": args.error_rate, "levels": levels},
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+
+def compare(old_path, new_path):
+    """ Print throughput and p99 changes between two result files """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    for name, levels in new["results"].items():
+        for level, summary in levels.items():
+            before = old["results"].get(name, {}).get(level)
+            if not before:
+                continue
+            rps_change = _pct(before["throughput_rps"], summary["throughput_rps"])
+            p99_change = _pct(before["p99_ms"], summary["p99_ms"])
+            print(f"{name:<30}c={level:<4} rps {rps_change:>8}  p99 {p99_change:>8}")
+
+
+def _pct(before, after):
+    if not before or after is None:
+        return 'n/a'
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', help='comma-separated route names (default: all)')
+    parser.add_argument('--levels', default='1,8,32,64', help='concurrency levels to step through')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per route and level')
+    parser.add_argument('--mode', default='sync', choices=['sync', 'async'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--latency', default='lognormal:80,0.4', help='upstream latency spec, see fake_upstream.py')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='result file (default: bench/results/<timestamp>-<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
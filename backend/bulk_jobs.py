@@ -0,0 +1,344 @@
+"""
+Bulk payment-link and hosted-payments-page jobs.
+
+An upload (CSV with a header row, or JSON lines) is streamed straight to disk,
+never held in memory. A background thread then reads it row by row, checks each
+row against the same schema as the single-item route and calls Checkout.com on
+a bounded worker pool, throttled by a token bucket shared by every job in the
+process. Each finished row is appended to results.jsonl - the id and redirect
+link, or the error - which can be downloaded while the job is still running.
+
+Everything lives in BULK_JOBS_DIR/<job_id>/:
+    input.csv / input.jsonl   the upload
+    job.json                  status and counters, rewritten as the job runs
+    results.jsonl             one line per finished row
+
+Finished jobs are deleted BULK_JOB_RETENTION after they end, by cleanup() - run
+when a worker starts and before each new upload - and at most
+BULK_MAX_ACTIVE_JOBS jobs are queued or running at once.
+
+A job that was interrupted by a restart is picked up again by resume(), which
+skips the rows already in results.jsonl. Rows that were in flight when the
+process died are sent again - their `reference` tells the two apart.
+
+CSV columns use dotted names for nested fields, e.g. billing.address.country.
+"""
+import csv, fcntl, json, logging, os, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import batch, metrics, schemas, serializer, upstream
+from clients import checkout_api
+from logging_config import fields
+from ratelimit import TokenBucket
+
+log = logging.getLogger('app.bulk_jobs')
+
+BULK_JOBS_DIR = os.environ.get('BULK_JOBS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bulk_jobs'))
+BULK_JOB_CONCURRENCY = int(os.environ.get('BULK_JOB_CONCURRENCY', 4))
+# Calls per second to Checkout.com, across all jobs in this process
+BULK_JOB_RATE = float(os.environ.get('BULK_JOB_RATE', 10))
+BULK_JOB_ROW_TIMEOUT = float(os.environ.get('BULK_JOB_ROW_TIMEOUT', 30))
+BULK_JOB_MAX_BYTES = int(os.environ.get('BULK_JOB_MAX_BYTES', 200 * 1024 * 1024))
+# Jobs queued or running at once, across all processes sharing BULK_JOBS_DIR
+BULK_MAX_ACTIVE_JOBS = int(os.environ.get('BULK_MAX_ACTIVE_JOBS', 4))
+# Seconds a finished job (upload, progress and results) is kept - 0 keeps them forever
+BULK_JOB_RETENTION = float(os.environ.get('BULK_JOB_RETENTION', 7 * 86400))
+# job.json is rewritten at most this often while a job runs
+PROGRESS_INTERVAL = 1.0
+CHUNK_SIZE = 64 * 1024
+
+ROWS = metrics.Counter('bulk_job_rows_total', 'Bulk job rows processed, by outcome', ('kind', 'outcome'))
+
+_executor = ThreadPoolExecutor(max_workers=BULK_JOB_CONCURRENCY * 2, thread_name_prefix='bulk')
+_bucket = TokenBucket(BULK_JOB_RATE, capacity=BULK_JOB_CONCURRENCY)
+
+
+def _create_payment_link(payload):
+    return upstream.call(upstream.CHECKOUT, 'create_payment_link',
+                         checkout_api.payments_links.create_payment_link, payload)
+
+
+def _create_hosted_payment(payload):
+    return upstream.call(upstream.CHECKOUT, 'create_hosted_payments_page_session',
+                         checkout_api.hosted_payments.create_hosted_payments_page_session, payload)
+
+
+# kind -> (schema the rows must match, function creating one item)
+KINDS = {
+    "payment_link": (schemas.PAYMENT_LINK, _create_payment_link),
+    "hosted_payment": (schemas.HOSTED_PAYMENTS, _create_hosted_payment),
+}
+FORMATS = {"csv", "jsonl"}
+
+
+class JobError(Exception):
+    pass
+
+
+class TooManyJobs(JobError):
+    pass
+
+
+class RowInvalid(ValueError):
+    def __init__(self, errors):
+        super().__init__("Invalid row")
+        self.errors = errors
+
+
+def _job_dir(job_id):
+    # Ids are generated by us - anything else (e.g. '../') is not a job
+    if not job_id.startswith('job_') or not job_id[4:].isalnum():
+        raise JobError(f"Unknown job {job_id}")
+    return os.path.join(BULK_JOBS_DIR, job_id)
+
+
+def _write_state(job_dir, state):
+    path = os.path.join(job_dir, 'job.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def load(job_id):
+    """ The job's job.json, or None """
+    try:
+        with open(os.path.join(_job_dir(job_id), 'job.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError, JobError):
+        return None
+
+
+def results_path(job_id):
+    return os.path.join(_job_dir(job_id), 'results.jsonl')
+
+
+def _job_ids():
+    if not os.path.isdir(BULK_JOBS_DIR):
+        return []
+    return sorted(name for name in os.listdir(BULK_JOBS_DIR) if name.startswith('job_'))
+
+
+def active_jobs():
+    return sum(1 for job_id in _job_ids() if (load(job_id) or {}).get("status") in ("queued", "running"))
+
+
+def cleanup(now=None):
+    """ Delete jobs that finished more than BULK_JOB_RETENTION ago, and uploads that never became a job """
+    if BULK_JOB_RETENTION <= 0:
+        return []
+    cutoff = (now or time.time()) - BULK_JOB_RETENTION
+    removed = []
+    for job_id in _job_ids():
+        state = load(job_id)
+        try:
+            if state is None:
+                # Cut short by a crash before job.json was written
+                stale = os.path.getmtime(os.path.join(BULK_JOBS_DIR, job_id)) < cutoff
+            else:
+                stale = state["status"] in ("completed", "failed") and state.get("finished_at", 0) < cutoff
+            if stale:
+                _remove(_job_dir(job_id))
+                removed.append(job_id)
+        except (OSError, JobError):
+            pass  # another worker got there first
+    if removed:
+        log.info("Deleted expired bulk jobs", extra=fields(job_ids=removed))
+    return removed
+
+
+def create(kind, input_format, stream):
+    """ Save an uploaded CSV/JSONL stream as a new job and start it. Returns the job state. """
+    if kind not in KINDS:
+        raise JobError(f"Unknown job kind {kind!r}")
+    if input_format not in FORMATS:
+        raise JobError(f"Unsupported format {input_format!r}, expected csv or jsonl")
+    cleanup()
+    if BULK_MAX_ACTIVE_JOBS > 0 and active_jobs() >= BULK_MAX_ACTIVE_JOBS:
+        raise TooManyJobs(f"{BULK_MAX_ACTIVE_JOBS} bulk jobs are already queued or running, try again later")
+
+    job_id = 'job_' + uuid.uuid4().hex
+    job_dir = _job_dir(job_id)
+    os.makedirs(job_dir)
+    size = 0
+    with open(os.path.join(job_dir, f'input.{input_format}'), 'wb') as f:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > BULK_JOB_MAX_BYTES:
+                f.close()
+                _remove(job_dir)
+                raise JobError(f"Upload is larger than {BULK_JOB_MAX_BYTES} bytes")
+            f.write(chunk)
+
+    state = {
+        "id": job_id, "kind": kind, "format": input_format, "status": "queued",
+        "created_at": time.time(), "input_bytes": size,
+        "rows_done": 0, "succeeded": 0, "failed": 0,
+    }
+    _write_state(job_dir, state)
+    _start(job_id)
+    return state
+
+
+def _remove(job_dir):
+    for name in os.listdir(job_dir):
+        os.remove(os.path.join(job_dir, name))
+    os.rmdir(job_dir)
+
+
+def resume():
+    """ Restart jobs that were queued or running when the last process stopped. Returns their ids. """
+    if not os.path.isdir(BULK_JOBS_DIR):
+        return []
+    resumed = []
+    for job_id in sorted(os.listdir(BULK_JOBS_DIR)):
+        state = load(job_id)
+        if state and state["status"] in ("queued", "running") and _start(job_id):
+            resumed.append(job_id)
+    if resumed:
+        log.info("Resuming bulk jobs", extra=fields(job_ids=resumed))
+    return resumed
+
+
+def _start(job_id):
+    """ Run the job on a background thread, unless another process or thread already is """
+    lock = open(os.path.join(_job_dir(job_id), 'job.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    threading.Thread(target=_run, args=(job_id, lock), name=f'bulk-{job_id[:12]}', daemon=True).start()
+    return True
+
+
+def _read_rows(path, input_format, skip):
+    """ Yield (row_number, row) lazily, skipping rows already in the results """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if input_format == 'csv':
+            for number, record in enumerate(csv.DictReader(f), start=1):
+                if number not in skip:
+                    yield number, _unflatten(record)
+        else:
+            number = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                number += 1
+                if number not in skip:
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as e:
+                        yield number, e
+
+
+def _unflatten(record):
+    """ {'billing.address.country': 'GB'} -> {'billing': {'address': {'country': 'GB'}}}, empty cells dropped """
+    row = {}
+    for key, value in record.items():
+        if key is None or value in (None, ''):
+            continue
+        target = row
+        *parents, leaf = key.strip().split('.')
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return row
+
+
+def _done_rows(path):
+    """ Rows already in the results file, and how many of them succeeded """
+    done, succeeded = set(), 0
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                    done.add(result["row"])
+                    succeeded += bool(result["ok"])
+                except (ValueError, KeyError):
+                    pass  # a line cut short by the crash - that row runs again
+    return done, succeeded
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def _run(job_id, lock):
+    job_dir = _job_dir(job_id)
+    state = load(job_id)
+    schema, create_item = KINDS[state["kind"]]
+    output_path = os.path.join(job_dir, 'results.jsonl')
+    # Counters are rebuilt from the results, job.json may be behind after a crash
+    done, succeeded = _done_rows(output_path)
+    state.update(succeeded=succeeded, failed=len(done) - succeeded, rows_done=len(done))
+    state["status"] = "running"
+    state["started_at"] = state.get("started_at") or time.time()
+    _write_state(job_dir, state)
+
+    def process(entry):
+        number, row = entry
+        if isinstance(row, Exception):
+            raise ValueError(f"Invalid JSON: {row}")
+        payload, errors = schema(row)
+        if errors:
+            raise RowInvalid(errors)
+        _bucket.acquire()
+        response = serializer.to_plain(create_item(payload))
+        return {"id": response.get("id"), "reference": payload.get("reference"),
+                "redirect": ((response.get("_links") or {}).get("redirect") or {}).get("href")}
+
+    last_saved = time.monotonic()
+    try:
+        rows = _read_rows(os.path.join(job_dir, f'input.{state["format"]}'), state["format"], done)
+        with open(output_path, 'a') as output:
+            if output.tell() and not _ends_with_newline(output_path):
+                output.write('\n')  # end a line cut short by the crash, so the next result starts clean
+            for (number, _), result, error in batch.fan_out(rows, process, concurrency=BULK_JOB_CONCURRENCY,
+                                                            timeout=BULK_JOB_ROW_TIMEOUT, pool=_executor):
+                if error is None:
+                    line = dict(row=number, ok=True, **result)
+                    state["succeeded"] += 1
+                else:
+                    line = {"row": number, "ok": False, "error": str(error)}
+                    if isinstance(error, RowInvalid):
+                        line["fields"] = error.errors
+                    error_details = getattr(error, 'error_details', None)
+                    if error_details:
+                        line["details"] = error_details
+                    state["failed"] += 1
+                ROWS.inc(state["kind"], 'ok' if error is None else 'error')
+                state["rows_done"] += 1
+                output.write(json.dumps(line) + '\n')
+                output.flush()
+                if time.monotonic() - last_saved >= PROGRESS_INTERVAL:
+                    _write_state(job_dir, state)
+                    last_saved = time.monotonic()
+        state["status"] = "completed"
+    except Exception as e:
+        log.exception("Bulk job failed", extra=fields(job_id=job_id))
+        state["status"] = "failed"
+        state["error"] = str(e)
+    finally:
+        state["finished_at"] = time.time()
+        _write_state(job_dir, state)
+        lock.close()
+    log.info("Bulk job finished", extra=fields(job_id=job_id, status=state["status"],
+                                               succeeded=state["succeeded"], failed=state["failed"]))
+
+
+def parse_format(content_type, requested=None):
+    """ csv/jsonl from ?format= or the upload's Content-Type """
+    if requested:
+        return requested.lower()
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        return 'jsonl'
+    return content_type or None
@@ -0,0 +1,232 @@
+"""
+In-process caching primitives and the payment-details read-through cache.
+
+- LRUCache: bounded, thread-safe, per-entry TTL
+- LocalStore / RedisStore: optional shared second level (LocalStore is the in-memory fake used for tests)
+- SingleFlight: concurrent calls for the same key share one execution
+"""
+import json, os, threading, time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """ Bounded LRU cache with a TTL per entry """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalStore:
+    """ In-memory stand-in for a Redis-style shared store (get/set with expiry/delete) """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RedisStore:
+    """ Shared store backed by Redis (needs the optional `redis` package) """
+
+    def __init__(self, url, prefix='cko:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def store_from_url(url):
+    """ 'memory://' gives a LocalStore, 'redis://...' a RedisStore, empty gives None """
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return LocalStore()
+    return RedisStore(url)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Collapse concurrent calls for the same key into one execution """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """ Returns (result, shared) - shared is True when we waited on someone else's call """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+# --- Payment details ---
+
+# States a payment won't normally leave - safe to cache for a long time
+TERMINAL_STATUSES = {"Captured", "Declined", "Refunded", "Voided", "Canceled", "Expired", "Paid"}
+
+PAYMENT_CACHE_SIZE = int(os.environ.get('PAYMENT_CACHE_SIZE', 1024))
+PAYMENT_CACHE_TERMINAL_TTL = float(os.environ.get('PAYMENT_CACHE_TERMINAL_TTL', 3600))
+PAYMENT_CACHE_PENDING_TTL = float(os.environ.get('PAYMENT_CACHE_PENDING_TTL', 2))
+PAYMENT_CACHE_STORE_URL = os.environ.get('PAYMENT_CACHE_STORE_URL')
+
+
+def ttl_for_status(status):
+    return PAYMENT_CACHE_TERMINAL_TTL if status in TERMINAL_STATUSES else PAYMENT_CACHE_PENDING_TTL
+
+
+class PaymentDetailsCache:
+    """ Read-through cache for serialized payment details, keyed by payment id """
+
+    def __init__(self, maxsize=PAYMENT_CACHE_SIZE, store=None):
+        self.local = LRUCache(maxsize)
+        self.store = store
+        self.flights = SingleFlight()
+        self._stats = {"hits": 0, "store_hits": 0, "misses": 0, "coalesced": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, field):
+        with self._stats_lock:
+            self._stats[field] += 1
+
+    def get(self, payment_id, loader):
+        """ Return cached details, or call loader(payment_id) once for all concurrent callers """
+        details = self.local.get(payment_id)
+        if details is not None:
+            self._count("hits")
+            return details
+
+        if self.store is not None:
+            raw = self.store.get(payment_id)
+            if raw is not None:
+                details = json.loads(raw)
+                self.local.set(payment_id, details, ttl_for_status(details.get("status")))
+                self._count("store_hits")
+                return details
+
+        details, shared = self.flights.do(payment_id, self._load, payment_id, loader)
+        self._count("coalesced" if shared else "misses")
+        return details
+
+    def _load(self, payment_id, loader):
+        details = loader(payment_id)
+        self.put(payment_id, details)
+        return details
+
+    def put(self, payment_id, details):
+        ttl = ttl_for_status(details.get("status"))
+        self.local.set(payment_id, details, ttl)
+        if self.store is not None:
+            self.store.set(payment_id, json.dumps(details), ttl)
+
+    def peek(self, payment_id):
+        """ Cached details, or None - never calls the loader """
+        details = self.local.get(payment_id)
+        if details is None and self.store is not None:
+            raw = self.store.get(payment_id)
+            if raw is not None:
+                details = json.loads(raw)
+        return details
+
+    def invalidate(self, payment_id):
+        self.local.delete(payment_id)
+        if self.store is not None:
+            self.store.delete(payment_id)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["size"] = len(self.local)
+        stats["in_flight"] = self.flights.in_flight()
+        return stats
+
+
+payment_details_cache = PaymentDetailsCache(store=store_from_url(PAYMENT_CACHE_STORE_URL))
@@ -0,0 +1,67 @@
+"""
+Lazily built upstream clients.
+
+The Checkout SDK is only imported and built the first time a route touches it
+(or when startup.prewarm() asks for it), so importing the app stays cheap.
+"""
+import os, threading
+
+import http_client, profiling
+
+CHECKOUT_SECRET_KEY = os.environ.get('CHECKOUT_SECRET_KEY')
+CHECKOUT_PUBLIC_KEY = os.environ.get('CHECKOUT_PUBLIC_KEY')
+
+SANDBOX_API_URL = 'https://api.sandbox.checkout.com'
+# Point everything at another Checkout.com-compatible host (e.g. bench/fake_upstream.py)
+CHECKOUT_API_URL = os.environ.get('CHECKOUT_API_URL', SANDBOX_API_URL).rstrip('/')
+if CHECKOUT_API_URL != SANDBOX_API_URL:
+    http_client.url_rewrites[SANDBOX_API_URL] = CHECKOUT_API_URL
+
+_lock = threading.Lock()
+_checkout_api = None
+
+
+def _build_checkout_api():
+    from checkout_sdk.checkout_sdk import CheckoutSdk
+    from checkout_sdk.environment import Environment
+    from checkout_sdk.http_client_interface import HttpClientBuilderInterface
+
+    # Hand the SDK our shared, pooled session so SDK calls reuse keep-alive connections
+    class PooledHttpClientBuilder(HttpClientBuilderInterface):
+        def get_client(self):
+            return http_client.checkout_session()
+
+    return CheckoutSdk.builder() \
+        .secret_key(CHECKOUT_SECRET_KEY) \
+        .public_key(CHECKOUT_PUBLIC_KEY) \
+        .environment(Environment.sandbox()) \
+        .http_client_builder(PooledHttpClientBuilder()) \
+        .build()
+
+
+def get_checkout_api():
+    global _checkout_api
+    if _checkout_api is None:
+        with _lock:
+            if _checkout_api is None:
+                with profiling.phase('sdk.build'):
+                    _checkout_api = _build_checkout_api()
+    return _checkout_api
+
+
+def is_built():
+    return _checkout_api is not None
+
+
+class Lazy:
+    """ Stands in for an object that is only created on first attribute access """
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+checkout_api = Lazy(get_checkout_api)
+payments_client = Lazy(lambda: get_checkout_api().payments)
@@ -0,0 +1,56 @@
+# gunicorn picks this file up automatically when started from backend/ (see render.yaml)
+import os
+
+# SERVE_MODE=sync  - default, one request per sync worker (same as a bare `gunicorn app:app`)
+# SERVE_MODE=async - gevent workers. Blocking socket calls made by requests and the
+#                    Checkout SDK yield to other requests, so one process can keep
+#                    hundreds of payment calls in flight while waiting on Checkout.com.
+serve_mode = os.environ.get('SERVE_MODE', 'sync').lower()
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+if serve_mode == 'async':
+    worker_class = 'gevent'
+    # Max in-flight requests per worker process
+    worker_connections = int(os.environ.get('ASYNC_WORKER_CONNECTIONS', 500))
+    # Every in-flight request may be holding an upstream connection
+    os.environ.setdefault('HTTP_POOL_MAXSIZE', str(worker_connections))
+    # Payment status streams are cheap greenlets here - allow up to half the connections
+    os.environ.setdefault('SSE_MAX_SUBSCRIBERS', str(worker_connections // 2))
+    # gevent workers keep heartbeating while a batch streams - no need to cut it short
+    os.environ.setdefault('BATCH_MAX_DURATION', '0')
+elif serve_mode == 'sync':
+    # A sync worker streaming a batch doesn't heartbeat - end the batch well before
+    # gunicorn kills the worker mid-stream, leaving room for a slow client to read it
+    if timeout > 0:
+        os.environ.setdefault('BATCH_MAX_DURATION', str(max(1, timeout // 2)))
+else:
+    raise ValueError(f"Unknown SERVE_MODE {serve_mode!r}, expected 'sync' or 'async'")
+
+
+def when_ready(server):
+    # Runs once in the master before workers take traffic - just report reachability,
+    # sockets opened here would be shared by every forked worker.
+    # Not with gevent: requests (and with it ssl) imported in the master is inherited by
+    # the workers before they monkey-patch, and every HTTPS call they make then fails.
+    # The workers report it instead (post_worker_init).
+    if serve_mode == 'async':
+        return
+    import requests, startup
+    with requests.Session() as session:
+        server.log.info("Checkout.com reachable: %s", startup.health_probe(session))
+
+
+def post_worker_init(worker):
+    # Runs in each worker right after the app is imported (post_fork is too early -
+    # the app isn't loaded yet). Pre-warm in the background so the worker starts
+    # accepting requests straight away; the first request waits on the SDK lock
+    # instead of building a second client. Background work (webhook workers, resumed bulk jobs) only
+    # ever starts here, never in `startup.py --profile-startup`.
+    import threading, startup
+    threading.Thread(target=startup.start_background_work, name='background-work', daemon=True).start()
+    if startup.PREWARM:
+        # Logs whether Checkout.com is reachable too
+        threading.Thread(target=startup.prewarm, name='prewarm', daemon=True).start()
+    elif serve_mode == 'async':
+        probe = lambda: worker.log.info("Checkout.com reachable: %s", startup.health_probe())
+        threading.Thread(target=probe, name='health-probe', daemon=True).start()
@@ -0,0 +1,121 @@
+"""
+ETags, conditional GETs and compression for JSON read endpoints.
+
+A response body is encoded once into an EncodedBody, which carries its ETag (a
+hash of the bytes) and lazily builds - then keeps - its gzip and brotli forms.
+respond() answers If-None-Match with a bare 304 before touching the body, and
+otherwise sends the smallest encoding the client accepts.
+
+encoded_for() keeps the EncodedBody next to cached data, so a payment that is
+served from cache is neither re-serialized nor re-compressed:
+
+    details = payment_details_cache.get(payment_id, fetch_payment_details)
+    return http_cache.respond(http_cache.encoded_for(payment_id, details))
+"""
+import gzip, hashlib, os, threading
+
+from flask import current_app, request
+
+import metrics, profiling
+from cache import LRUCache
+from serializer import dumps
+
+try:
+    import brotli
+except ImportError:  # optional - gzip only
+    brotli = None
+
+# Bodies smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+ENCODED_CACHE_SIZE = int(os.environ.get('ENCODED_CACHE_SIZE', 1024))
+
+RESPONSES = metrics.Counter('http_cache_responses_total', 'Cacheable JSON responses, by how they were sent',
+                            ('result',))
+BYTES_SAVED = metrics.Counter('http_cache_bytes_saved_total', 'Response bytes not sent thanks to 304s and compression')
+
+_COMPRESSORS = {
+    'gzip': lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+}
+if brotli is not None:
+    _COMPRESSORS['br'] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+# Preferred first
+_PREFERENCE = ('br', 'gzip')
+
+
+class EncodedBody:
+    def __init__(self, body):
+        self.body = body
+        self.etag = 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def variant(self, encoding):
+        """ The body compressed with `encoding`, built on first use """
+        compressed = self._variants.get(encoding)
+        if compressed is None:
+            with self._lock:
+                compressed = self._variants.get(encoding)
+                if compressed is None:
+                    with profiling.phase('compress'):
+                        compressed = self._variants[encoding] = _COMPRESSORS[encoding](self.body)
+        return compressed
+
+
+def encode(data):
+    with profiling.phase('serialize'):
+        return EncodedBody(dumps(data))
+
+
+# key -> (data, EncodedBody) - reused for as long as the caller hands us the same data object
+_encoded = LRUCache(ENCODED_CACHE_SIZE)
+
+
+def encoded_for(key, data):
+    entry = _encoded.get(key)
+    if entry is not None and entry[0] is data:
+        return entry[1]
+    encoded = encode(data)
+    _encoded.set(key, (data, encoded))
+    return encoded
+
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    for encoding in _PREFERENCE:
+        if encoding in _COMPRESSORS and accepted[encoding]:
+            return encoding
+    return None
+
+
+def _not_modified(etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    # Weak comparison - W/"x" and "x" match
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+def respond(encoded, status=200, max_age=0):
+    """ 304 if the client already has this body, otherwise the body in the best accepted encoding """
+    headers = {
+        'ETag': encoded.etag,
+        'Vary': 'Accept-Encoding',
+        # Clients may keep it, but must check back with the ETag before reusing it
+        'Cache-Control': f'private, max-age={max_age}, must-revalidate',
+    }
+    if status == 200 and _not_modified(encoded.etag):
+        RESPONSES.inc('not_modified')
+        BYTES_SAVED.inc(amount=len(encoded.body))
+        return current_app.response_class(status=304, headers=headers)
+
+    body = encoded.body
+    encoding = _accepted_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding is not None:
+        body = encoded.variant(encoding)
+        headers['Content-Encoding'] = encoding
+        BYTES_SAVED.inc(amount=len(encoded.body) - len(body))
+    RESPONSES.inc(encoding or 'identity')
+    return current_app.response_class(body, status=status, mimetype='application/json', headers=headers)
@@ -0,0 +1,204 @@
+"""
+Shared outbound HTTP layer.
+
+Every call to Checkout.com (through the SDK or directly) and to Apple's merchant
+validation endpoint goes through the sessions built here, so TCP/TLS connections
+are kept alive and reused instead of being opened per request.
+"""
+import contextlib, contextvars, os, ssl, threading, time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Pool sizing - pool_connections is the number of hosts we keep a pool for,
+# pool_maxsize is how many keep-alive connections are kept per host.
+# Size pool_maxsize to at least the number of threads in a gunicorn worker.
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+POOL_BLOCK = os.environ.get('HTTP_POOL_BLOCK', 'false').lower() == 'true'
+
+# (connect, read) timeouts in seconds, applied when a caller doesn't pass its own
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+# Pool hit/miss counters, per host. A "hit" is a request served on an existing
+# keep-alive connection, a "miss" is a request that had to open a new one.
+_stats_lock = threading.Lock()
+_pool_stats = {}
+
+
+def _count(host, field):
+    with _stats_lock:
+        host_stats = _pool_stats.setdefault(host, {"requests": 0, "misses": 0})
+        host_stats[field] += 1
+
+
+class _CountingPoolMixin:
+    def _get_conn(self, timeout=None):
+        _count(self.host, "requests")
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _count(self.host, "misses")
+        return super()._new_conn()
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """ HTTPAdapter that counts pool hits/misses and can carry a preloaded SSL context """
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        kwargs.setdefault('pool_connections', POOL_CONNECTIONS)
+        kwargs.setdefault('pool_maxsize', POOL_MAXSIZE)
+        kwargs.setdefault('pool_block', POOL_BLOCK)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.ssl_context is not None:
+            pool_kwargs['ssl_context'] = self.ssl_context
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+# Base URL prefix -> replacement, applied to every outbound request. Lets the SDK
+# (which only knows the real sandbox URL) talk to another host, e.g. the local
+# stand-in in bench/fake_upstream.py
+url_rewrites = {}
+
+
+def _rewrite(url):
+    for prefix, replacement in url_rewrites.items():
+        if url.startswith(prefix):
+            return replacement + url[len(prefix):]
+    return url
+
+
+# Callables run on every upstream response, e.g. metrics.record_upstream_response
+response_hooks = []
+
+
+def _run_response_hooks(response, *args, **kwargs):
+    for hook in response_hooks:
+        hook(response, *args, **kwargs)
+    return response
+
+# time.monotonic() by which the current pipeline step has to be done - see deadline()
+_deadline = contextvars.ContextVar('http_deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Cap the connect and read timeouts of every request made inside the block (by
+    this thread, or anything run in a copy of its context) to what is left of `seconds`
+    """
+    deadline_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline_at if outer is None else min(outer, deadline_at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """ Seconds left before the current deadline, or None when there isn't one """
+    deadline_at = _deadline.get()
+    return None if deadline_at is None else deadline_at - time.monotonic()
+
+
+def _capped(timeout):
+    left = remaining()
+    if left is None:
+        return timeout
+    # The read timeout applies per socket read, so a slow trickle can still run a little over
+    left = max(0.01, left)
+    if isinstance(timeout, tuple):
+        return tuple(left if t is None else min(t, left) for t in timeout)
+    return left if timeout is None else min(timeout, left)
+
+
+class PooledSession(requests.Session):
+    """ requests.Session with a default timeout, safe to share between worker threads """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, ssl_context=None):
+        super().__init__()
+        self.timeout = timeout
+        # We never rely on cookies from Checkout.com or Apple, and a shared cookie
+        # jar is the one piece of a Session that threads would otherwise fight over.
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = PooledAdapter(ssl_context=ssl_context)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.hooks['response'].append(_run_response_hooks)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        kwargs['timeout'] = _capped(kwargs['timeout'])
+        if url_rewrites:
+            url = _rewrite(url)
+        return super().request(method, url, **kwargs)
+
+
+def load_mtls_context(cert_path, key_path):
+    """ Build an SSL context with the client certificate loaded once, up front """
+    context = ssl.create_default_context()
+    context.load_cert_chain(certfile=cert_path, keyfile=key_path)
+    return context
+
+
+_sessions_lock = threading.Lock()
+_checkout_session = None
+_mtls_sessions = {}
+
+
+def checkout_session():
+    """ Shared session for Checkout.com - used by the SDK and the raw REST calls """
+    global _checkout_session
+    if _checkout_session is None:
+        with _sessions_lock:
+            if _checkout_session is None:
+                _checkout_session = PooledSession()
+    return _checkout_session
+
+
+def mtls_session(cert_path, key_path):
+    """ Shared session presenting the given client certificate (Apple Pay merchant validation) """
+    key = (cert_path, key_path)
+    session = _mtls_sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _mtls_sessions.get(key)
+            if session is None:
+                session = PooledSession(ssl_context=load_mtls_context(cert_path, key_path))
+                _mtls_sessions[key] = session
+    return session
+
+
+def pool_stats():
+    """ Snapshot of the per-host pool hit/miss counters """
+    with _stats_lock:
+        return {
+            host: {
+                "requests": host_stats["requests"],
+                "hits": host_stats["requests"] - host_stats["misses"],
+                "misses": host_stats["misses"],
+            }
+            for host, host_stats in _pool_stats.items()
+        }
@@ -0,0 +1,96 @@
+"""
+Idempotency for the payment creation routes.
+
+Requests are keyed by their Idempotency-Key header or, when there isn't one, by a
+hash of the route and JSON payload. While a request is in flight, duplicates wait
+for its result; once it has completed, the stored response is replayed instead of
+calling Checkout.com again. 5xx responses are never stored so a retry gets a
+fresh attempt.
+"""
+import functools, hashlib, json, os
+
+from flask import current_app, g, request
+
+from cache import LRUCache, SingleFlight
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# Explicit keys are the client's promise that it's the same payment - keep them a day.
+# Payload hashes only catch double-clicks and quick retries, so the window is short
+# enough not to swallow a genuine second payment for the same basket.
+IDEMPOTENCY_KEY_TTL = float(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+IDEMPOTENCY_PAYLOAD_TTL = float(os.environ.get('IDEMPOTENCY_PAYLOAD_TTL', 10))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+
+_completed = LRUCache(IDEMPOTENCY_MAX_ENTRIES)
+_flights = SingleFlight()
+
+# Headers that belong to the original response and shouldn't be replayed
+_SKIP_HEADERS = {'content-length', 'date', 'server'}
+
+
+def _fingerprint():
+    payload = request.get_json(silent=True)
+    if payload is not None:
+        body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    else:
+        body = request.get_data()
+    return hashlib.sha256(request.method.encode() + request.path.encode() + b'\n' + body).hexdigest()
+
+
+def current_key():
+    """
+    Client-supplied Idempotency-Key of the request being handled, to forward to
+    Checkout.com. Payload hashes are never forwarded - Checkout.com remembers keys
+    far longer than our double-click window.
+    """
+    return g.get('idempotency_key')
+
+
+def idempotent(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        fingerprint = _fingerprint()
+        client_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if client_key:
+            key, ttl = f"{request.path}:{client_key}", IDEMPOTENCY_KEY_TTL
+        else:
+            key, ttl = fingerprint, IDEMPOTENCY_PAYLOAD_TTL
+        g.idempotency_key = client_key
+
+        stored = _completed.get(key)
+        if stored is None:
+            stored, shared = _flights.do(key, _execute, view, args, kwargs, fingerprint, key, ttl)
+            # The request that actually ran gets its response back as is
+            if not shared:
+                return _build(stored, replayed=False)
+
+        if stored["fingerprint"] != fingerprint:
+            return current_app.response_class(
+                json.dumps({"error": f"{IDEMPOTENCY_HEADER} was already used with a different payload"}),
+                status=422, mimetype='application/json')
+        return _build(stored, replayed=True)
+    return wrapper
+
+
+def _execute(view, args, kwargs, fingerprint, key, ttl):
+    response = current_app.make_response(view(*args, **kwargs))
+    stored = {
+        "fingerprint": fingerprint,
+        "status": response.status_code,
+        "headers": [(k, v) for k, v in response.headers.items() if k.lower() not in _SKIP_HEADERS],
+        "body": response.get_data(),
+    }
+    if response.status_code < 500:
+        _completed.set(key, stored, ttl)
+    return stored
+
+
+def _build(stored, replayed):
+    response = current_app.response_class(stored["body"], status=stored["status"], headers=stored["headers"])
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def stats():
+    return {"stored": len(_completed), "in_flight": _flights.in_flight()}
@@ -0,0 +1,212 @@
+"""
+Local payment ledger - every payment outcome the backend sees, in SQLite.
+
+Routes call record() with what they got back from Checkout.com. It only puts
+the entry on a queue; a background thread writes entries in batches, one
+transaction each, so the request never waits on the disk - or fails because of
+it: a database that can't be opened or written only costs ledger entries. The
+database runs in WAL mode, so reads (and other worker processes' writes) don't
+block on the writer.
+
+Rows are append-only: a payment that was authorized and later captured (via a
+webhook) has two rows. query() pages newest first by row id, filtered by time,
+status, reference or payment id - all indexed - without calling Checkout.com.
+"""
+import json, logging, os, queue, sqlite3, threading, time
+
+import metrics
+from logging_config import fields
+
+log = logging.getLogger('app.ledger')
+
+# Empty disables the ledger
+LEDGER_PATH = os.environ.get('LEDGER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ledger.sqlite3'))
+LEDGER_QUEUE_SIZE = int(os.environ.get('LEDGER_QUEUE_SIZE', 10000))
+LEDGER_BATCH_SIZE = int(os.environ.get('LEDGER_BATCH_SIZE', 200))
+# Longest an entry waits for its batch to fill up, in seconds
+LEDGER_FLUSH_INTERVAL = float(os.environ.get('LEDGER_FLUSH_INTERVAL', 0.5))
+LEDGER_MAX_PAGE = 500
+
+ENTRIES = metrics.Counter('ledger_entries_total', 'Ledger entries, by outcome', ('outcome',))
+
+COLUMNS = ('recorded_at', 'route', 'kind', 'payment_id', 'reference', 'status', 'approved',
+           'amount', 'currency', 'error', 'details')
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS payments ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, recorded_at REAL NOT NULL, route TEXT NOT NULL, kind TEXT NOT NULL, "
+    "payment_id TEXT, reference TEXT, status TEXT, approved INTEGER, amount INTEGER, currency TEXT, "
+    "error TEXT, details TEXT)",
+    "CREATE INDEX IF NOT EXISTS payments_payment_id ON payments (payment_id)",
+    "CREATE INDEX IF NOT EXISTS payments_reference ON payments (reference)",
+    "CREATE INDEX IF NOT EXISTS payments_status ON payments (status, recorded_at)",
+    "CREATE INDEX IF NOT EXISTS payments_recorded_at ON payments (recorded_at)",
+]
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Durable as of the last checkpoint on power loss, but never corrupt - fine for a local copy
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _value(source, name):
+    if source is None:
+        return None
+    if isinstance(source, dict):
+        return source.get(name)
+    return getattr(source, name, None)
+
+
+class Ledger:
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self.queue = queue.Queue(maxsize=LEDGER_QUEUE_SIZE)
+        self.dropped = 0
+        self._writer = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _start(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='ledger', daemon=True)
+                self._writer.start()
+
+    def record(self, route, response=None, request_data=None, kind='payment', error=None, **values):
+        """
+        Queue one outcome. Fields are taken from `values`, then the SDK response or
+        response dict, then the request payload - never blocks and never raises; the
+        entry is dropped if the queue is full or it can't be built.
+        """
+        if not self.enabled:
+            return
+        try:
+            if self._writer is None:
+                self._start()
+            entry = {"recorded_at": time.time(), "route": route, "kind": kind, "error": error}
+            for name in ('reference', 'status', 'approved', 'amount', 'currency'):
+                value = values.pop(name, None)
+                if value is None:
+                    value = _value(response, name)
+                if value is None:
+                    value = _value(request_data, name)
+                entry[name] = value
+            if entry["approved"] is not None:
+                entry["approved"] = int(bool(entry["approved"]))
+            entry["payment_id"] = values.pop('payment_id', None) or _value(response, 'id')
+            entry["details"] = json.dumps(values, default=str) if values else None
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self._drop()
+        except Exception:
+            # The payment already happened - losing its ledger row must not fail the request
+            log.exception("Could not queue ledger entry", extra=fields(route=route))
+            self._drop()
+
+    def _drop(self):
+        self.dropped += 1
+        ENTRIES.inc('dropped')
+
+    def _open(self):
+        """ Writer thread only - None (and the error logged) when the database can't be opened """
+        try:
+            conn = connect(self.path)
+            with conn:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+            return conn
+        except sqlite3.Error:
+            log.exception("Could not open the ledger", extra=fields(path=self.path))
+            return None
+
+    def _write_loop(self):
+        # Opened here rather than on the first request's thread; retried with each batch
+        # until it works, so a bad LEDGER_PATH costs failed entries, not failed payments
+        conn = None
+        insert = f"INSERT INTO payments ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        while True:
+            batch = [self.queue.get()]
+            flush_at = time.monotonic() + LEDGER_FLUSH_INTERVAL
+            while len(batch) < LEDGER_BATCH_SIZE:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            rows = [tuple(entry[column] for column in COLUMNS) for entry in batch]
+            if conn is None:
+                conn = self._open()
+            if conn is None:
+                ENTRIES.inc('failed', amount=len(rows))
+            else:
+                try:
+                    with conn:
+                        conn.executemany(insert, rows)
+                    ENTRIES.inc('written', amount=len(rows))
+                except sqlite3.Error:
+                    ENTRIES.inc('failed', amount=len(rows))
+                    log.exception("Ledger write failed", extra=fields(entries=len(rows)))
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self, timeout=5):
+        """ Wait until everything queued so far is written (for scripts and shutdown) """
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self.queue.unfinished_tasks
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=10,
+                                                      check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def query(self, since=None, until=None, status=None, reference=None, payment_id=None, route=None,
+              limit=100, cursor=None):
+        """ Newest first. Returns (rows, next_cursor) - pass next_cursor back for the following page. """
+        clauses, params = [], []
+        for column, operator, value in (('recorded_at', '>=', since), ('recorded_at', '<', until),
+                                        ('status', '=', status), ('reference', '=', reference),
+                                        ('payment_id', '=', payment_id), ('route', '=', route),
+                                        ('id', '<', cursor)):
+            if value is not None:
+                clauses.append(f"{column} {operator} ?")
+                params.append(value)
+        limit = max(1, min(int(limit), LEDGER_MAX_PAGE))
+        sql = "SELECT * FROM payments"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id DESC LIMIT ?"
+        try:
+            rows = [dict(row) for row in self._reader().execute(sql, (*params, limit + 1))]
+        except sqlite3.OperationalError as e:
+            if not os.path.exists(self.path):
+                return [], None  # nothing recorded yet
+            raise e
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        rows = rows[:limit]
+        for row in rows:
+            if row["details"]:
+                row["details"] = json.loads(row["details"])
+            if row["approved"] is not None:
+                row["approved"] = bool(row["approved"])
+        return rows, next_cursor
+
+    def stats(self):
+        return {"enabled": self.enabled, "queued": self.queue.qsize(), "dropped": self.dropped,
+                "writer_running": self._writer is not None and self._writer.is_alive()}
+
+
+ledger = Ledger()
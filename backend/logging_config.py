@@ -0,0 +1,125 @@
+"""
+Structured, non-blocking logging.
+
+Request threads only put log records on a bounded queue. A background listener
+thread does the expensive work - redacting secrets, JSON encoding and writing
+to stdout - so a slow stdout never holds up a payment.
+
+    log = logging.getLogger('app')
+    log.info("Payment created", extra=fields(payment_id=response.id, sampled=True))
+    log_payload(log, "Payment request", payload)   # free unless LOG_LEVEL=DEBUG
+
+Extra fields and payloads are redacted and encoded on the listener thread, so
+don't mutate a payload after logging it.
+"""
+import atexit, json, logging, os, queue, random, sys, time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Fraction of high-volume success logs (logged with sampled=True) that are kept
+LOG_SUCCESS_SAMPLE_RATE = float(os.environ.get('LOG_SUCCESS_SAMPLE_RATE', 1.0))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# Field names whose values never make it into the logs (compared lower-cased)
+REDACTED_FIELDS = {
+    'authorization', 'secret', 'secret_key', 'token', 'token_data', 'tokendata', 'session_data',
+    'payment_session_secret', 'payment_session_token', 'cryptogram', 'number', 'cvv',
+    'paymentdata', 'signature', 'merchantsessionidentifier', 'cko-signature',
+}
+REDACTED = '[REDACTED]'
+
+
+def fields(sampled=False, **values):
+    """ Build the `extra` for a log call: structured fields plus the sampling flag """
+    return {"fields": values, "sampled": sampled}
+
+
+def log_payload(logger, message, payload, level=logging.DEBUG, **values):
+    """ Log a full request/response body - nothing is copied or formatted unless `level` is enabled """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra=fields(payload=payload, **values))
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {key: REDACTED if str(key).lower() in REDACTED_FIELDS else redact(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        extra = getattr(record, 'fields', None)
+        if extra:
+            entry.update(redact(extra))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """ Keep only LOG_SUCCESS_SAMPLE_RATE of the records logged with sampled=True """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and self.rate < 1.0:
+            return random.random() < self.rate
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """ Hands records to the listener thread untouched, and drops them if the queue is full """
+
+    dropped = 0
+
+    def prepare(self, record):
+        # The default prepare() formats the message on the calling thread - leave
+        # that to the listener. Only the traceback has to be captured now.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_listener = None
+
+
+def setup_logging():
+    """ Route the 'app' loggers through the background queue. Safe to call more than once. """
+    global _listener
+    logger = logging.getLogger('app')
+    logger.setLevel(LOG_LEVEL)
+    if _listener is not None:
+        return logger
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(LOG_SUCCESS_SAMPLE_RATE))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
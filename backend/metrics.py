@@ -0,0 +1,183 @@
+"""
+Lightweight in-process metrics with Prometheus text output.
+
+Counters, gauges and histograms are plain dicts keyed by label values behind a
+lock - cheap enough to leave on for every request. init_app() hooks Flask so
+every route gets latency, in-flight, status and payload size metrics, and
+render() produces the text served at /metrics.
+"""
+import bisect, threading, time
+
+from flask import g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_registry = []
+_collectors = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+                                 for labels, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # per-bucket counts (not cumulative), then sum and count
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        lines = self._header()
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+def register_collector(fn):
+    """ fn() returns extra exposition lines, gathered at scrape time (e.g. pool or cache stats) """
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Route metrics ---
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time spent handling a request', ('route', 'method'))
+REQUESTS = Counter('http_requests_total', 'Requests handled, by response status', ('route', 'method', 'status'))
+IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests currently being handled', ('route',))
+REQUEST_SIZE = Histogram('http_request_size_bytes', 'Request body size', ('route',), buckets=SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Response body size', ('route',), buckets=SIZE_BUCKETS)
+
+# --- Upstream metrics (see upstream.py and http_client.py) ---
+
+UPSTREAM_LATENCY = Histogram('upstream_request_duration_seconds', 'Time spent in an upstream operation',
+                             ('upstream', 'operation'))
+UPSTREAM_CALLS = Counter('upstream_requests_total', 'Upstream operations, by outcome',
+                         ('upstream', 'operation', 'outcome'))
+UPSTREAM_IN_FLIGHT = Gauge('upstream_requests_in_flight', 'Upstream operations currently waiting on a response',
+                           ('upstream', 'operation'))
+UPSTREAM_REJECTIONS = Counter('upstream_rejections_total', 'Calls refused by a circuit breaker or bulkhead',
+                              ('upstream', 'operation', 'reason'))
+UPSTREAM_RESPONSES = Counter('upstream_http_responses_total', 'HTTP responses received from upstream hosts',
+                             ('host', 'status'))
+UPSTREAM_RESPONSE_SIZE = Histogram('upstream_response_size_bytes', 'Upstream response body size', ('host',),
+                                   buckets=SIZE_BUCKETS)
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _before_request():
+    g.metrics_started_at = time.perf_counter()
+    g.metrics_route = _route()
+    IN_FLIGHT.inc(g.metrics_route)
+    if request.content_length:
+        REQUEST_SIZE.observe(g.metrics_route, value=request.content_length)
+
+
+def _after_request(response):
+    route = g.get('metrics_route')
+    if route is not None:
+        REQUEST_LATENCY.observe(route, request.method, value=time.perf_counter() - g.metrics_started_at)
+        REQUESTS.inc(route, request.method, str(response.status_code))
+        if response.content_length is not None:
+            RESPONSE_SIZE.observe(route, value=response.content_length)
+    return response
+
+
+def _teardown_request(exc):
+    route = g.pop('metrics_route', None)
+    if route is not None:
+        IN_FLIGHT.dec(route)
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def record_upstream_response(response, *args, **kwargs):
+    """ requests response hook - status and size of every raw upstream HTTP response """
+    host = response.url.split('/')[2] if '://' in response.url else response.url
+    UPSTREAM_RESPONSES.inc(host, str(response.status_code))
+    length = response.headers.get('Content-Length')
+    if length is not None and length.isdigit():
+        UPSTREAM_RESPONSE_SIZE.observe(host, value=int(length))
+    return response
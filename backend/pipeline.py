@@ -0,0 +1,103 @@
+"""
+Deadline-bound pipelines for routes that chain several upstream calls.
+
+A Pipeline gets an overall deadline when the request comes in. Each step runs
+with its own timeout, capped by whatever is left of the deadline. When a step
+fails or times out the pipeline is cancelled and later steps are never started,
+so e.g. a slow Apple Pay tokenization can't go on to trigger a late payment.
+Every step records a timing span.
+
+A step that is already running can't be interrupted. Instead its outbound HTTP
+requests get connect/read timeouts no longer than the step's budget (see
+http_client.deadline()), so a timed-out step gives up its worker thread and
+bulkhead slot shortly after the route has stopped waiting for it.
+"""
+import contextvars, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import http_client
+
+# Steps run on a shared, bounded pool so the request thread can stop waiting on them
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PIPELINE_MAX_WORKERS', 32)),
+    thread_name_prefix='pipeline',
+)
+
+
+class StepTimeout(Exception):
+    def __init__(self, step, timeout):
+        super().__init__(f"Step '{step}' did not finish within {timeout:.2f}s")
+        self.step = step
+        self.timeout = timeout
+
+
+class PipelineCancelled(Exception):
+    def __init__(self, step):
+        super().__init__(f"Pipeline cancelled before step '{step}'")
+        self.step = step
+
+
+class Pipeline:
+    def __init__(self, name, deadline):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.deadline_at = self.started_at + deadline
+        self.spans = []
+        self._cancelled = threading.Event()
+
+    def remaining(self):
+        return self.deadline_at - time.perf_counter()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self, step, fn, *args, timeout=None, **kwargs):
+        """ Run one step, waiting at most min(timeout, time left before the deadline) """
+        if self.cancelled:
+            raise PipelineCancelled(step)
+        budget = self.remaining()
+        if timeout is not None:
+            budget = min(budget, timeout)
+        if budget <= 0:
+            self.cancel()
+            self._record(step, time.perf_counter(), "deadline")
+            raise StepTimeout(step, 0)
+
+        def step_fn():
+            # Outbound HTTP requests made by the step time out when its budget runs out
+            with http_client.deadline(budget):
+                return fn(*args, **kwargs)
+
+        start = time.perf_counter()
+        # Run in a copy of the request's context, so the step still sees e.g. its profile
+        future = _executor.submit(contextvars.copy_context().run, step_fn)
+        try:
+            result = future.result(timeout=budget)
+        except FutureTimeout:
+            # The worker thread can't be interrupted mid-call, but nothing after
+            # this step will run and its late result is thrown away.
+            future.cancel()
+            self.cancel()
+            self._record(step, start, "timeout")
+            raise StepTimeout(step, budget)
+        except Exception:
+            self.cancel()
+            self._record(step, start, "error")
+            raise
+        self._record(step, start, "ok")
+        return result
+
+    def _record(self, step, start, outcome):
+        self.spans.append({
+            "step": step,
+            "outcome": outcome,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+        })
+
+    def server_timing(self):
+        """ Spans formatted for the Server-Timing response header """
+        return ", ".join(f"{span['step']};dur={span['duration_ms']}" for span in self.spans)
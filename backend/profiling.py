@@ -0,0 +1,207 @@
+"""
+On-demand request profiling - where did a slow request spend its time?
+
+With PROFILING_ENABLED, every request carries a Profile while it runs and the
+code marks its phases with `with profiling.phase('name'):`
+- parse       request body JSON parsing (request.json / get_json)
+- upstream.*  upstream.call() - one per operation, retries included
+- network     time to the response headers, for each HTTP request made
+- serialize   SDK objects to JSON (serializer, jsonify)
+- compress    gzip / brotli for http_cache
+- sdk.build   building the Checkout SDK client
+
+A profile is kept when the request was sampled (PROFILE_SAMPLE_RATE), asked for
+one with the PROFILE_HEADER header, or took longer than PROFILE_SLOW_MS. Kept
+profiles go in a bounded ring buffer served at /api/admin/profiles - only once
+PROFILE_TOKEN is set, and only to requests that send it (see protected()).
+
+With profiling off (the default) no hooks are installed and phase() returns a
+shared no-op context manager, so the marked code pays for one global lookup.
+"""
+import collections, contextlib, contextvars, functools, os, random, threading, time, uuid
+
+from flask import Request, g, request
+from flask.json.provider import DefaultJSONProvider
+
+import access, http_client, metrics
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+# Fraction of requests to keep whatever their latency, 0..1
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Requests slower than this are always kept - 0 turns slow capture off
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 1000))
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', 200))
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Debug-Profile')
+# When set, the header only counts if its value matches. Also the key to
+# /api/admin/profiles, which is off until it is set.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+
+PROFILES = metrics.Counter('profiles_captured_total', 'Request profiles kept, by why they were kept', ('reason',))
+
+_current = contextvars.ContextVar('profile', default=None)
+_NULL = contextlib.nullcontext()
+
+
+class Profile:
+    def __init__(self, reason=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.reason = reason
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.phases = []
+
+    def add(self, name, start, duration):
+        # list.append is atomic, so pipeline worker threads can add to the same profile
+        self.phases.append((name, start - self.started, duration, threading.current_thread().name))
+
+    def breakdown(self, total):
+        """ Milliseconds per kind of work; 'other' is what no phase covered (route code, Flask, waiting) """
+        sums = collections.defaultdict(float)
+        for name, _, duration, _ in self.phases:
+            sums['upstream' if name.startswith('upstream.') else name] += duration
+        breakdown = {name: round(seconds * 1000, 3) for name, seconds in sums.items()}
+        if 'upstream' in sums:
+            # What an upstream call spent outside the HTTP exchange - SDK request/response objects, retry waits
+            breakdown['sdk'] = round(max(0.0, sums['upstream'] - sums['network']) * 1000, 3)
+        covered = sum(seconds for name, seconds in sums.items() if name != 'network')
+        breakdown['other'] = round(max(0.0, total - covered) * 1000, 3)
+        return breakdown
+
+    def to_dict(self, total, **extra):
+        return dict(
+            id=self.id, reason=self.reason, started_at=self.started_at, total_ms=round(total * 1000, 3),
+            breakdown=self.breakdown(total),
+            phases=[{"name": name, "offset_ms": round(start * 1000, 3), "ms": round(duration * 1000, 3),
+                     "thread": thread} for name, start, duration, thread in self.phases],
+            **extra)
+
+
+class _Phase:
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profile.add(self.name, self.start, time.perf_counter() - self.start)
+
+
+def phase(name):
+    """ Time the block as `name` in the current request's profile, if there is one """
+    if not PROFILING_ENABLED:
+        return _NULL
+    profile = _current.get()
+    if profile is None:
+        return _NULL
+    return _Phase(profile, name)
+
+
+class ProfileBuffer:
+    """ The last `maxsize` kept profiles """
+
+    def __init__(self, maxsize=PROFILE_BUFFER_SIZE):
+        self._profiles = collections.deque(maxlen=maxsize)
+
+    def add(self, profile):
+        self._profiles.append(profile)
+
+    def get(self, profile_id):
+        return next((p for p in list(self._profiles) if p["id"] == profile_id), None)
+
+    def list(self, reason=None, route=None):
+        return [p for p in list(self._profiles)
+                if (reason is None or p["reason"] == reason) and (route is None or p["route"] == route)]
+
+    def stats(self):
+        return {"enabled": PROFILING_ENABLED, "kept": len(self._profiles), "size": self._profiles.maxlen,
+                "sample_rate": PROFILE_SAMPLE_RATE, "slow_ms": PROFILE_SLOW_MS}
+
+
+profiles = ProfileBuffer()
+
+
+class ProfiledRequest(Request):
+    def get_json(self, *args, **kwargs):
+        with phase('parse'):
+            return super().get_json(*args, **kwargs)
+
+
+class ProfiledJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        with phase('serialize'):
+            return super().response(*args, **kwargs)
+
+
+def _asked_for():
+    value = request.headers.get(PROFILE_HEADER)
+    return value is not None and (not PROFILE_TOKEN or access.matches(value, PROFILE_TOKEN))
+
+
+def protected(view):
+    """
+    Profiles hold every route's paths and timings - serve them only with PROFILE_TOKEN,
+    sent as `Authorization: Bearer <token>` or in the PROFILE_HEADER header. 404 while no token is set.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return access.refuse(PROFILE_TOKEN, PROFILE_HEADER) or view(*args, **kwargs)
+    return wrapper
+
+
+def _before_request():
+    if _asked_for():
+        reason = 'header'
+    elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        reason = 'sampled'
+    else:
+        reason = None
+    g.profile_token = _current.set(Profile(reason))
+
+
+def _after_request(response):
+    profile = _current.get()
+    if profile is None:
+        return response
+    total = time.perf_counter() - profile.started
+    if profile.reason is None and PROFILE_SLOW_MS and total * 1000 >= PROFILE_SLOW_MS:
+        profile.reason = 'slow'
+    if profile.reason is not None:
+        rule = request.url_rule
+        profiles.add(profile.to_dict(total, route=rule.rule if rule is not None else 'unmatched',
+                                     method=request.method, path=request.path, status=response.status_code))
+        PROFILES.inc(profile.reason)
+        if profile.reason == 'header':
+            response.headers['X-Profile-Id'] = profile.id
+            response.headers.add('Server-Timing', ', '.join(
+                f'{name};dur={ms}' for name, ms in profile.breakdown(total).items()))
+    return response
+
+
+def _teardown_request(exc):
+    token = g.pop('profile_token', None)
+    if token is not None:
+        _current.reset(token)
+
+
+def _record_network(response, *args, **kwargs):
+    """ http_client response hook - time from sending the request to the response headers """
+    profile = _current.get()
+    if profile is not None:
+        elapsed = response.elapsed.total_seconds()
+        profile.add('network', time.perf_counter() - elapsed, elapsed)
+    return response
+
+
+def init_app(app):
+    if not PROFILING_ENABLED:
+        return
+    app.request_class = ProfiledRequest
+    app.json = ProfiledJSONProvider(app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    http_client.response_hooks.append(_record_network)
@@ -0,0 +1,103 @@
+"""
+Token bucket rate limiting.
+
+A TokenBucket refills at `rate` tokens per second up to `capacity`, so it allows
+short bursts while holding the average to `rate`. take() never blocks and says
+how long to wait when the bucket is empty; acquire() waits for a token.
+
+LocalBuckets and RedisBuckets hold one bucket per key (client IP, route, ...),
+per process or shared between instances.
+"""
+import threading, time
+
+from cache import LRUCache
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, tokens=1):
+        """ Take tokens if there are enough. Returns 0 on success, otherwise seconds until there will be. """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            if self.rate <= 0:
+                return float('inf')
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        """ Wait for tokens. False if they wouldn't be available within `timeout` seconds. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.take(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class LocalBuckets:
+    """ One TokenBucket per key, in this process. Idle keys are forgotten once `maxsize` is reached. """
+
+    def __init__(self, maxsize=10000):
+        self._buckets = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, tokens=1):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(rate, capacity)
+                    self._buckets.set(key, bucket)
+        return bucket.take(tokens)
+
+
+# Refill and take in one atomic step, on the Redis clock so instances agree on time
+_TAKE_SCRIPT = """
+local rate, capacity, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """ Token buckets shared by every instance, kept in Redis (needs the optional `redis` package) """
+
+    def __init__(self, url, prefix='cko:bucket:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, rate, capacity, tokens=1):
+        return float(self._take(keys=[self.prefix + key], args=[rate, capacity, tokens]))
+
+
+def buckets_from_url(url):
+    """ 'redis://...' gives RedisBuckets, anything else per-process LocalBuckets """
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBuckets(url)
+    return LocalBuckets()
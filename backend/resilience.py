@@ -0,0 +1,107 @@
+"""
+Failure isolation primitives used by upstream.py.
+
+- CircuitBreaker: after enough consecutive failures, reject calls for a while
+  instead of letting every request wait on a degraded upstream
+- Bulkhead: cap the calls in flight to one upstream so it can't hold every worker
+- retry(): bounded retries with jittered exponential backoff, for idempotent calls only
+"""
+import random, threading, time
+
+
+class UpstreamUnavailable(Exception):
+    """ Raised instead of calling an upstream that is known to be failing or saturated """
+
+    def __init__(self, upstream, reason, retry_after=1):
+        super().__init__(f"{upstream} is unavailable ({reason})")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """ Raise UpstreamUnavailable if the call shouldn't go out """
+        with self._lock:
+            if self.state == self.OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout:
+                    raise UpstreamUnavailable(self.name, 'circuit open', retry_after=self.reset_timeout - waited)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                # Let a single trial call through to find out if the upstream recovered
+                if self._trial_in_flight:
+                    raise UpstreamUnavailable(self.name, 'circuit half-open', retry_after=1)
+                self._trial_in_flight = True
+
+    def record_success(self):
+        # Any answer from the upstream (including a 4xx) means it is up
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Bulkhead:
+    def __init__(self, name, max_concurrent, max_wait=0.5):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if not self._semaphore.acquire(timeout=self.max_wait):
+            raise UpstreamUnavailable(self.name, 'too many concurrent calls', retry_after=1)
+        with self._lock:
+            self._in_use += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._in_use -= 1
+        self._semaphore.release()
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+
+def backoff_delays(attempts, base=0.1, cap=1.0):
+    """ Full-jitter exponential backoff: the sleep before each retry """
+    for attempt in range(attempts - 1):
+        yield random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry(fn, attempts, should_retry, base=0.1, cap=1.0):
+    """ Call fn() up to `attempts` times while should_retry(exc) says the failure is transient """
+    delays = backoff_delays(attempts, base, cap)
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            delay = next(delays, None)
+            if delay is None or not should_retry(e):
+                raise
+            time.sleep(delay)
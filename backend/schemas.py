@@ -0,0 +1,257 @@
+"""
+Request validation for the routes that forward payloads to Checkout.com.
+
+Each route's schema is compiled once, at import, into nested check functions, so
+validating a request is a handful of dict lookups and isinstance checks. In the
+same pass it normalizes amounts and currency codes and fills in the
+processing_channel_id and redirect URL defaults. A bad payload gets a 422 (400
+for payment contexts, as before) with every failing field listed, without
+calling Checkout.com.
+
+    @app.route('/api/paymentLink', methods=['POST'])
+    @schemas.validate(schemas.PAYMENT_LINK)
+    def paymentLink():
+        payload = schemas.payload()
+
+Fields not mentioned in a schema are passed through untouched.
+"""
+import functools, os, re
+
+from flask import g, jsonify, request
+
+import metrics
+
+DEFAULT_PROCESSING_CHANNEL_ID = os.environ.get('CHECKOUT_PROCESSING_CHANNEL_ID', "pc_pxk25jk2hvuenon5nyv3p6nf2i")
+SUCCESS_URL = "https://react-frontend-elpl.onrender.com/success"
+FAILURE_URL = "https://react-frontend-elpl.onrender.com/failure"
+
+SCHEMA_REJECTIONS = metrics.Counter('request_validation_failures_total', 'Requests rejected by schema validation',
+                                    ('schema',))
+
+_MISSING = object()
+_REQUIRED, _OPTIONAL, _DEFAULT, _ALWAYS = 'required', 'optional', 'default', 'always'
+
+_CURRENCY = re.compile(r'^[A-Za-z]{3}$')
+_COUNTRY = re.compile(r'^[A-Za-z]{2}$')
+_URL = re.compile(r'^https?://[^\s/$.?#][^\s]*$')
+_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def _error(errors, path, message):
+    errors.append({"field": path, "error": message})
+
+
+# --- Field checks: check(value, path, errors) -> normalized value ---
+
+def amount(value, path, errors):
+    """ Minor units - a non-negative integer, digit strings are converted """
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        _error(errors, path, "must be an integer amount in minor units")
+    elif value < 0:
+        _error(errors, path, "must not be negative")
+    return value
+
+
+def currency(value, path, errors):
+    """ ISO 4217 code, upper-cased """
+    if isinstance(value, str) and _CURRENCY.match(value):
+        return value.upper()
+    _error(errors, path, "must be a 3-letter ISO currency code")
+    return value
+
+
+def country(value, path, errors):
+    """ ISO 3166 alpha-2 code, upper-cased """
+    if isinstance(value, str) and _COUNTRY.match(value):
+        return value.upper()
+    _error(errors, path, "must be a 2-letter ISO country code")
+    return value
+
+
+def boolean(value, path, errors):
+    if not isinstance(value, bool):
+        _error(errors, path, "must be true or false")
+    return value
+
+
+def string(max_length=None, pattern=None, message=None):
+    def check(value, path, errors):
+        if not isinstance(value, str) or not value:
+            _error(errors, path, "must be a non-empty string")
+        elif max_length is not None and len(value) > max_length:
+            _error(errors, path, f"must be at most {max_length} characters")
+        elif pattern is not None and not pattern.match(value):
+            _error(errors, path, message or "has an invalid format")
+        return value
+    return check
+
+
+url = string(max_length=1024, pattern=_URL, message="must be an http(s) URL")
+email = string(max_length=255, pattern=_EMAIL, message="must be an email address")
+
+
+def one_of(*choices):
+    allowed = frozenset(choices)
+
+    def check(value, path, errors):
+        if value not in allowed:
+            _error(errors, path, f"must be one of {', '.join(sorted(map(str, allowed)))}")
+        return value
+    return check
+
+
+def array(item, min_items=0, max_items=None):
+    def check(value, path, errors):
+        if not isinstance(value, list):
+            _error(errors, path, "must be a list")
+            return value
+        if len(value) < min_items:
+            _error(errors, path, f"must have at least {min_items} item(s)")
+        if max_items is not None and len(value) > max_items:
+            _error(errors, path, f"must have at most {max_items} items")
+        return [item(element, f"{path}[{i}]", errors) for i, element in enumerate(value)]
+    return check
+
+
+def obj(spec):
+    """ Compile {name: field} into a check for a JSON object. Bare checks are optional fields. """
+    fields = []
+    for name, field in spec.items():
+        mode, check, fixed = field if isinstance(field, tuple) else (_OPTIONAL, field, None)
+        fields.append((name, mode, check, fixed))
+    fields = tuple(fields)
+
+    def check_object(value, path, errors):
+        if not isinstance(value, dict):
+            _error(errors, path or "body", "must be a JSON object")
+            return value
+        out = dict(value)
+        for name, mode, check, fixed in fields:
+            if mode is _ALWAYS:
+                out[name] = fixed
+                continue
+            item = value.get(name, _MISSING)
+            if item is _MISSING or item is None:
+                if mode is _REQUIRED:
+                    _error(errors, f"{path}.{name}" if path else name, "is required")
+                elif mode is _DEFAULT:
+                    out[name] = fixed
+                continue
+            out[name] = check(item, f"{path}.{name}" if path else name, errors)
+        return out
+    return check_object
+
+
+# --- Field modes ---
+
+def required(check):
+    return _REQUIRED, check, None
+
+
+def default(check, value):
+    """ Optional, with `value` filled in when missing """
+    return _DEFAULT, check, value
+
+
+def always(value):
+    """ Set by the server whatever the client sent """
+    return _ALWAYS, None, value
+
+
+class Schema:
+    def __init__(self, name, spec):
+        self.name = name
+        self._check = obj(spec)
+
+    def __call__(self, data):
+        """ Returns (normalized payload, errors) """
+        errors = []
+        normalized = self._check(data, '', errors)
+        return normalized, errors
+
+
+def validate(schema, status=422):
+    """ Reject the request with `status` unless its JSON body matches `schema` - see payload() """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            data, errors = schema(request.get_json(silent=True))
+            if errors:
+                SCHEMA_REJECTIONS.inc(schema.name)
+                return jsonify({"error": "Invalid request", "fields": errors}), status
+            g.payload = data
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def payload():
+    """ The validated, normalized body of the request being handled """
+    return g.payload
+
+
+# --- Route schemas ---
+
+_billing = obj({"address": required(obj({"country": required(country)}))})
+_processing_channel = default(string(max_length=50), DEFAULT_PROCESSING_CHANNEL_ID)
+
+PAYMENT_SESSION = Schema('payment_session', {
+    "amount": required(amount),
+    "currency": required(currency),
+    "reference": string(max_length=80),
+    "billing": required(_billing),
+    "customer": obj({"email": email}),
+    "processing_channel_id": _processing_channel,
+    "success_url": always(SUCCESS_URL),
+    "failure_url": always(FAILURE_URL),
+})
+
+CARD_PAYMENT = Schema('card_payment', {
+    "source": required(obj({"type": required(string(max_length=50))})),
+    "amount": amount,
+    "currency": required(currency),
+    "reference": string(max_length=80),
+    "capture": boolean,
+    "processing_channel_id": _processing_channel,
+    "success_url": url,
+    "failure_url": url,
+})
+
+PAYMENT_LINK = Schema('payment_link', {
+    "amount": required(amount),
+    "currency": required(currency),
+    "reference": string(max_length=80),
+    "billing": required(_billing),
+    "processing_channel_id": _processing_channel,
+    "return_url": always(SUCCESS_URL),
+})
+
+HOSTED_PAYMENTS = Schema('hosted_payments', {
+    "amount": required(amount),
+    "currency": required(currency),
+    "reference": string(max_length=80),
+    "billing": required(_billing),
+    "processing_channel_id": _processing_channel,
+    "success_url": required(url),
+    "failure_url": required(url),
+    "cancel_url": required(url),
+})
+
+PAYMENT_CONTEXT = Schema('payment_context', {
+    "amount": required(amount),
+    "currency": required(currency),
+    "reference": string(max_length=80),
+    "capture": boolean,
+    # Every type the PayPal page offers (frontend/src/components/PayPal.js)
+    "payment_type": one_of("Regular", "Recurring", "Installment", "PayLater", "MOTO", "Unscheduled"),
+    "email": default(email, "mark@hotmail.com"),
+    "customer_name": default(string(max_length=255), "Mark Reilly"),
+    "processing_channel_id": required(string(max_length=50)),
+    "success_url": required(url),
+    "failure_url": required(url),
+    "processing": obj({"user_action": string(), "shipping_preference": string(), "invoice_id": string()}),
+    "items": array(obj({"name": required(string()), "unit_price": amount, "quantity": amount,
+                        "total_amount": amount})),
+})
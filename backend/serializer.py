@@ -0,0 +1,139 @@
+"""
+Serializer for Checkout SDK response objects.
+
+The SDK hands back ResponseWrapper objects whose attributes mirror the JSON
+Checkout.com sent. The old make_json_serializable ran an isinstance/hasattr chain
+on every value it visited. Here the decision is made once per class: the first
+time a type is seen we compile a plan for it and every later value of that type
+is dispatched straight to the plan.
+
+When orjson is installed, responses are encoded by orjson directly, with the
+plans only consulted for the SDK objects it can't encode natively.
+"""
+import json
+
+from flask import current_app
+
+import profiling
+
+try:
+    import orjson
+except ImportError:  # optional - falls back to the stdlib encoder
+    orjson = None
+
+_PRIMITIVES = (str, int, float, bool, type(None))
+
+
+def _identity(value):
+    return value
+
+
+def _plain_dict(value):
+    return {key: to_plain(item) for key, item in value.items()}
+
+
+def _plain_list(value):
+    return [to_plain(item) for item in value]
+
+
+def _plain_object(value):
+    return _plain_dict(vars(value))
+
+
+def _plain_href(value):
+    return value.href
+
+
+def _plain_str(value):
+    return str(value)
+
+
+# orjson writes tuples as arrays without asking _orjson_default, where the old walk wrote
+# str(tuple). The only tuples in SDK responses sit directly inside SDK objects and dict
+# subclasses (e.g. the (name, value) pairs of http_metadata.headers), which orjson does
+# hand to us - so those are stringified on the way through.
+def _shallow_dict(value):
+    return {key: str(item) if isinstance(item, tuple) else item for key, item in value.items()}
+
+
+def _shallow_list(value):
+    return [str(item) if isinstance(item, tuple) else item for item in value]
+
+
+def _shallow_object(value):
+    return _shallow_dict(vars(value))
+
+
+# class -> function turning a value of that class into plain JSON data
+_plans = {
+    str: _identity, int: _identity, float: _identity, bool: _identity, type(None): _identity,
+    dict: _plain_dict, list: _plain_list,
+}
+# class -> function turning a value into something orjson can encode (orjson recurses itself)
+_shallow_plans = {}
+
+
+def _has_instance_dict(cls):
+    return getattr(cls, '__dictoffset__', 0) != 0
+
+
+def _compile(cls):
+    """ Work out once how values of `cls` are serialized - same precedence as the old recursive walk """
+    if issubclass(cls, dict):
+        plan, shallow = _plain_dict, _shallow_dict
+    elif issubclass(cls, list):
+        plan, shallow = _plain_list, _shallow_list
+    elif _has_instance_dict(cls):
+        # ResponseWrapper and its link objects - attributes differ per instance, so the plan is vars()
+        plan, shallow = _plain_object, _shallow_object
+    elif issubclass(cls, _PRIMITIVES):
+        base = next(base for base in _PRIMITIVES if issubclass(cls, base))
+        plan, shallow = _identity, base
+    elif hasattr(cls, 'href'):
+        plan, shallow = _plain_href, _plain_href
+    else:
+        plan, shallow = _plain_str, str
+    _plans[cls] = plan
+    _shallow_plans[cls] = shallow
+    return plan
+
+
+def to_plain(data):
+    """ Convert SDK objects (and anything nested in them) to plain dicts/lists/primitives """
+    plan = _plans.get(type(data))
+    if plan is None:
+        plan = _compile(type(data))
+    return plan(data)
+
+
+def _orjson_default(value):
+    shallow = _shallow_plans.get(type(value))
+    if shallow is None:
+        _compile(type(value))
+        shallow = _shallow_plans[type(value)]
+    return shallow(value)
+
+
+if orjson is not None:
+    # Hand subclasses, datetimes and dataclasses to our plans so the output matches to_plain()
+    _ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_SUBCLASS
+                       | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def dumps(data):
+        """ Encode SDK objects straight to JSON bytes """
+        return orjson.dumps(data, default=_orjson_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps(data):
+        """ Encode SDK objects straight to JSON bytes """
+        return json.dumps(to_plain(data), sort_keys=True, separators=(',', ':')).encode()
+
+# Plain data for callers that keep it (e.g. the payment details cache). Walking with the
+# plans is quicker than an orjson dumps/loads round trip.
+make_json_serializable = to_plain
+
+
+def json_response(data, status=200):
+    """ Drop-in for jsonify() that accepts SDK response objects """
+    with profiling.phase('serialize'):
+        body = dumps(data)
+    return current_app.response_class(body, status=status, mimetype='application/json')
@@ -0,0 +1,120 @@
+"""
+Startup: pre-warming and cold-start profiling.
+
+By default nothing heavy happens at import - the Checkout SDK, the Apple Pay
+certificate and upstream connections are all set up on first use. With
+STARTUP_PREWARM on, gunicorn.conf.py calls prewarm() in each worker once the app
+is loaded, so the first checkout after a spin-up finds everything warm.
+
+    python startup.py --profile-startup [--json startup.json]
+
+reports what each import and each init step costs, so cold-start time can be
+tracked across releases. It only runs prewarm(), which has no side effects
+outside the process - start_background_work() is for gunicorn workers.
+"""
+import argparse, importlib, json, logging, os, sys, time
+
+PREWARM = os.environ.get('STARTUP_PREWARM', 'true').lower() == 'true'
+
+# Heaviest first-party and third-party imports, in the order the app pulls them in
+PROFILED_IMPORTS = ['flask', 'flask_cors', 'requests', 'orjson', 'checkout_sdk.checkout_sdk', 'app']
+
+log = logging.getLogger('app.startup')
+
+
+def _timed(timings, name, fn):
+    start = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def health_probe(session=None, timeout=(3.05, 5)):
+    """ True if Checkout.com answers at all - any HTTP status means the network path is up """
+    from clients import CHECKOUT_API_URL
+    if session is None:
+        import http_client
+        session = http_client.checkout_session()
+    try:
+        session.head(CHECKOUT_API_URL, timeout=timeout)
+        return True
+    except Exception as e:
+        log.warning("Checkout.com health probe failed: %s", e)
+        return False
+
+
+def prewarm():
+    """ Build clients, load the Apple Pay certificate and open upstream connections. Returns timings in ms. """
+    import app, apple_pay, clients
+
+    timings = {}
+    _timed(timings, 'checkout_sdk', clients.get_checkout_api)
+    cert_loaded = _timed(timings, 'apple_pay_cert', app.merchant_validator.preload)
+    # Opens (and keeps) the first keep-alive connection to Checkout.com
+    healthy = _timed(timings, 'checkout_connect', health_probe)
+    if cert_loaded and apple_pay.PREWARM:
+        _timed(timings, 'apple_pay_connect', lambda: app.merchant_validator.prewarm().join())
+    log.info("Worker pre-warmed in %sms (checkout reachable: %s)", sum(timings.values()), healthy,
+             extra={"fields": {"timings_ms": timings}})
+    return timings
+
+
+def start_background_work():
+    """
+    Per-worker background work that changes shared state - gunicorn.conf.py runs it
+    in each worker. Not part of prewarm(): `--profile-startup` runs that in a
+    throwaway process, which must not take work from the real workers.
+    """
+    import bulk_jobs, webhooks
+    if webhooks.WEBHOOK_SECRET:
+        # Workers up and unprocessed events replaying before the first delivery arrives.
+        # Replayed events are marked processed - only a worker that lives on may take them.
+        webhooks.processor.start()
+    # Bulk jobs interrupted by the restart - only one worker gets each job's lock, and
+    # rows in flight when its process exits are sent again on the next resume
+    bulk_jobs.cleanup()
+    bulk_jobs.resume()
+
+
+def profile_startup():
+    """ Cost of each import and init step, measured in this fresh process """
+    imports = {}
+    for module in PROFILED_IMPORTS:
+        already = module in sys.modules
+        try:
+            _timed(imports, module, lambda: importlib.import_module(module))
+        except ImportError as e:
+            imports[module] = f"not installed ({e})"
+        if already:
+            imports[module] = 0.0
+    init = prewarm()
+    return {
+        "imports_ms": imports,
+        "init_ms": init,
+        "total_ms": round(sum(v for v in imports.values() if isinstance(v, float)) + sum(init.values()), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile-startup', action='store_true', help='report per-import and per-init cost')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+    if not args.profile_startup:
+        parser.print_help()
+        return
+
+    report = profile_startup()
+    for section in ("imports_ms", "init_ms"):
+        print(section)
+        for name, value in report[section].items():
+            print(f"  {name:<28}{value:>10}")
+    print(f"total_ms{report['total_ms']:>30}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
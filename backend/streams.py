@@ -0,0 +1,152 @@
+"""
+Server-Sent Events for payment status.
+
+The browser opens one EventSource per checkout instead of polling. Each open
+stream is a Subscription in `status_streams`, keyed by payment id or payment
+session id. Status changes are published to it as they become known - from
+webhook events, or from the submit response, which links a payment session to
+its payment.
+
+Every open stream holds its connection (and, under sync workers, the whole
+worker) until it ends, so the registry is bounded. A stream ends once the
+payment reaches a terminal status, after SSE_IDLE_TIMEOUT seconds without an
+update, or after SSE_MAX_DURATION seconds; EventSource reconnects on its own if
+the page is still waiting. Serve streams with SERVE_MODE=async - gunicorn.conf.py
+only enables them there by default.
+"""
+import json, os, queue, threading, time
+
+import metrics
+from cache import LRUCache, TERMINAL_STATUSES
+
+# 0 disables streaming - a sync worker would be stuck on each open stream.
+# gunicorn.conf.py raises the default for gevent workers.
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 0))
+SSE_IDLE_TIMEOUT = float(os.environ.get('SSE_IDLE_TIMEOUT', 120))
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 900))
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+# Updates buffered per subscriber - a slow client only ever misses intermediate states
+SSE_SUBSCRIBER_QUEUE = 16
+
+STREAM_EVENTS = metrics.Counter('sse_events_total', 'Payment status events sent to streams', ('event',))
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    def __init__(self, key):
+        self.key = key
+        self.queue = queue.Queue(maxsize=SSE_SUBSCRIBER_QUEUE)
+
+    def push(self, state):
+        while True:
+            try:
+                self.queue.put_nowait(state)
+                return
+            except queue.Full:
+                # Keep the newest - drop the oldest unsent state
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def events(self, idle_timeout=SSE_IDLE_TIMEOUT, max_duration=SSE_MAX_DURATION, heartbeat=SSE_HEARTBEAT):
+        """ Yield states as they arrive and None as a heartbeat, until idle or too old """
+        started = last_update = time.monotonic()
+        while True:
+            now = time.monotonic()
+            remaining = min(last_update + idle_timeout, started + max_duration) - now
+            if remaining <= 0:
+                return
+            try:
+                state = self.queue.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                yield None
+                continue
+            last_update = time.monotonic()
+            yield state
+
+
+class StatusStreams:
+    """ Bounded registry of open status streams """
+
+    def __init__(self, max_subscribers=SSE_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}  # key -> set of Subscription
+        self._count = 0
+        # payment id -> payment session ids watching it
+        self._aliases = LRUCache(maxsize=10000)
+        self._lock = threading.Lock()
+
+    def subscribe(self, key):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers(f"{self._count} streams already open")
+            subscription = Subscription(key)
+            self._subscribers.setdefault(key, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.key]
+            self._count -= 1
+
+    def link(self, session_id, payment_id, state=None):
+        """ Send updates for payment_id to the streams for session_id too, starting with `state` """
+        with self._lock:
+            sessions = self._aliases.get(payment_id) or frozenset()
+            self._aliases.set(payment_id, sessions | {session_id}, ttl=SSE_MAX_DURATION)
+        if state is not None:
+            self.publish(payment_id, state)
+
+    def publish(self, payment_id, state):
+        with self._lock:
+            keys = [payment_id, *(self._aliases.get(payment_id) or ())]
+            targets = [sub for key in keys for sub in self._subscribers.get(key, ())]
+        for subscription in targets:
+            subscription.push(state)
+
+    def stats(self):
+        with self._lock:
+            return {"open": self._count, "max": self.max_subscribers, "keys": len(self._subscribers)}
+
+
+def stream(subscription, initial_state=None):
+    """ The text/event-stream body for one subscription - unsubscribes when the client goes away """
+    def is_terminal(state):
+        return state.get("status") in TERMINAL_STATUSES
+
+    try:
+        yield "retry: 3000\n\n"  # EventSource reconnect delay, ms
+        if initial_state is not None:
+            STREAM_EVENTS.inc('status')
+            yield format_event('status', initial_state)
+            if is_terminal(initial_state):
+                return
+        for state in subscription.events():
+            if state is None:
+                yield ": keepalive\n\n"
+                continue
+            STREAM_EVENTS.inc('status')
+            yield format_event('status', state)
+            if is_terminal(state):
+                return
+        STREAM_EVENTS.inc('timeout')
+        yield format_event('timeout', {"key": subscription.key})
+    finally:
+        status_streams.unsubscribe(subscription)
+
+
+status_streams = StatusStreams()
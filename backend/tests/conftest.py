@@ -0,0 +1,19 @@
+import os, sys
+
+import pytest
+
+# The backend modules import each other as top-level modules (gunicorn runs from backend/)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Read at import time - keep tests from writing a ledger or tripping the rate limits
+os.environ.setdefault('LEDGER_PATH', '')
+os.environ.setdefault('ADMISSION_ENABLED', 'false')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """ Flask test client, run from backend/ like gunicorn (the Apple Pay certificate paths are relative) """
+    monkeypatch.chdir(BACKEND_DIR)
+    import app
+    return app.app.test_client()
@@ -0,0 +1,80 @@
+import threading, time
+
+import pytest
+from flask import Flask
+
+import admission
+from admission import AdmissionController, ConcurrencyLimiter
+from ratelimit import LocalBuckets
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """ A bare app with its own controller - the real one is off in tests (ADMISSION_ENABLED=false) """
+    monkeypatch.setattr(admission, 'ADMISSION_IP_RATE', 0.001)
+    monkeypatch.setattr(admission, 'ADMISSION_IP_BURST', 3)
+    controller = AdmissionController(LocalBuckets(), {'limited': (0.001, 1)}, ConcurrencyLimiter(10, 0, 1))
+    app = Flask(__name__)
+    app.add_url_rule('/limited', 'limited', lambda: 'ok')
+    app.add_url_rule('/open', 'open', lambda: 'ok')
+    app.add_url_rule('/api/admin/stats', 'admin_stats', lambda: 'ok')
+    app.before_request(controller.before_request)
+    app.teardown_request(controller.teardown_request)
+    app.controller = controller
+    return app
+
+
+def from_ip(ip):
+    return {'X-Forwarded-For': ip}
+
+
+def test_route_limit(app):
+    client = app.test_client()
+    assert client.get('/limited', headers=from_ip('10.0.0.1')).status_code == 200
+    refused = client.get('/limited', headers=from_ip('10.0.0.2'))
+    assert refused.status_code == 429
+    assert refused.get_json()["reason"] == "route_rate"
+    assert int(refused.headers['Retry-After']) >= 1
+    assert client.get('/open', headers=from_ip('10.0.0.2')).status_code == 200
+
+
+def test_client_limit_is_per_ip(app):
+    client = app.test_client()
+    for _ in range(3):
+        assert client.get('/open', headers=from_ip('10.0.0.1')).status_code == 200
+    refused = client.get('/open', headers=from_ip('10.0.0.1'))
+    assert refused.status_code == 429
+    assert refused.get_json()["reason"] == "client_rate"
+    assert client.get('/open', headers=from_ip('10.0.0.2')).status_code == 200
+    # Only the proxy's own entry counts - a spoofed left-hand address doesn't get a fresh bucket
+    assert client.get('/open', headers=from_ip('1.2.3.4, 10.0.0.1')).status_code == 429
+
+
+def test_admin_routes_are_exempt(app):
+    client = app.test_client()
+    for _ in range(10):
+        assert client.get('/api/admin/stats', headers=from_ip('10.0.0.1')).status_code == 200
+
+
+def test_slots_are_released_after_each_request(app):
+    client = app.test_client()
+    client.get('/open', headers=from_ip('10.0.0.1'))
+    assert app.controller.limiter.in_use == 0
+
+
+def test_concurrency_limiter_queues_then_refuses():
+    limiter = ConcurrencyLimiter(limit=1, queue_size=1, timeout=0.05)
+    assert limiter.acquire() == 'ok'
+    assert limiter.acquire() == 'queue_timeout'
+
+    outcomes = []
+    waiter = threading.Thread(target=lambda: outcomes.append(limiter.acquire()))
+    limiter.timeout = 5
+    waiter.start()
+    while not limiter.waiting:
+        time.sleep(0.001)
+    assert limiter.acquire() == 'queue_full'
+    limiter.release()
+    waiter.join(5)
+    assert outcomes == ['ok']
+    assert limiter.in_use == 1
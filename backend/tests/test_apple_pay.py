@@ -0,0 +1,39 @@
+import pytest
+
+import apple_pay
+
+
+@pytest.mark.parametrize('url', [
+    'https://apple-pay-gateway.apple.com/paymentservices/startSession',
+    'https://apple-pay-gateway-cert.apple.com/paymentservices/startSession',
+    'https://apple-pay-gateway-nc-pod3.apple.com/paymentservices/paymentSession',
+    'https://cn-apple-pay-gateway-tj-pod2.apple.com/paymentservices/startSession',
+])
+def test_apple_hosts_are_accepted(url):
+    assert apple_pay.is_validation_url(url)
+
+
+@pytest.mark.parametrize('url', [
+    'http://169.254.169.254/latest/meta-data/',
+    'http://apple-pay-gateway.apple.com/paymentservices/startSession',
+    'https://apple-pay-gateway.apple.com:8443/paymentservices/startSession',
+    'https://apple-pay-gateway.apple.com.example.com/paymentservices/startSession',
+    'https://user@apple-pay-gateway.apple.com/paymentservices/startSession',
+    'https://example.com/?apple-pay-gateway.apple.com',
+    'http://127.0.0.1:8099/paymentservices/startSession',
+    'not a url',
+    None,
+])
+def test_other_urls_are_refused(url):
+    assert not apple_pay.is_validation_url(url)
+
+
+def test_validate_merchant_refuses_other_hosts_before_calling_out(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("validator should not be called")
+
+    import app
+    monkeypatch.setattr(app.merchant_validator, 'validate', fail)
+    response = client.post('/api/apple-pay/validate-merchant',
+                           json={"validationURL": "http://169.254.169.254/latest/meta-data/"})
+    assert response.status_code == 400
@@ -0,0 +1,71 @@
+import json, os, socket, sys, time
+
+import pytest
+
+import batch
+from conftest import BACKEND_DIR
+
+
+def slow(item):
+    time.sleep(0.2)
+    return item
+
+
+def test_every_item_is_reported_once():
+    results = {item: error for item, _, error in batch.fan_out(range(20), slow, concurrency=10)}
+    assert sorted(results) == list(range(20))
+    assert not any(results.values())
+
+
+def test_slow_items_time_out():
+    results = list(batch.fan_out(range(2), lambda item: time.sleep(1), timeout=0.05))
+    assert [str(error) for _, _, error in results] == ["No result within 0.05s"] * 2
+
+
+def test_batch_ends_at_the_deadline():
+    calls = []
+
+    def lookup(item):
+        calls.append(item)
+        return slow(item)
+
+    start = time.monotonic()
+    results = list(batch.fan_out(range(100), lookup, concurrency=4, deadline=start + 0.5))
+    assert time.monotonic() - start < 0.8
+    assert sorted(item for item, _, _ in results) == list(range(100))
+    late = [item for item, _, error in results if error is not None]
+    assert late and all(str(error) == "Batch time limit reached" for _, _, error in results if error is not None)
+    assert len(calls) < 100  # the rest were never looked up
+
+
+def test_sync_worker_finishes_the_stream_before_its_timeout(monkeypatch):
+    """ 400 ids at 200ms each take far longer than GUNICORN_TIMEOUT=5 - every line still arrives """
+    pytest.importorskip('gunicorn')
+    requests = pytest.importorskip('requests')
+    sys.path.insert(0, os.path.join(BACKEND_DIR, 'bench'))
+    import fake_upstream, loadtest, run_benchmarks
+
+    upstream = fake_upstream.start(latency='fixed:200')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = loadtest.start_server('sync', port, 1, extra_env={
+        "CHECKOUT_API_URL": upstream.base_url, "CHECKOUT_SECRET_KEY": run_benchmarks.BENCH_SECRET_KEY,
+        "CHECKOUT_PUBLIC_KEY": run_benchmarks.BENCH_PUBLIC_KEY, "APPLE_PAY_PREWARM": "false",
+        "GUNICORN_TIMEOUT": "5"})
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        loadtest.wait_until_up(base_url)
+        payment_ids = [f'pay_{n:026d}' for n in range(400)]
+        response = requests.post(f'{base_url}/api/payment-details/batch', json={"payment_ids": payment_ids},
+                                 timeout=30)
+        lines = [json.loads(line) for line in response.iter_lines() if line]
+    finally:
+        server.terminate()
+        server.wait()
+        upstream.shutdown()
+
+    assert response.status_code == 200
+    assert sorted(line["payment_id"] for line in lines) == payment_ids
+    assert any(line["ok"] for line in lines)
+    assert {line["error"] for line in lines if not line["ok"]} == {"Batch time limit reached"}
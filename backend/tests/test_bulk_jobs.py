@@ -0,0 +1,79 @@
+import io, json, os, time
+
+import pytest
+
+import access, bulk_jobs
+
+TOKEN = 'admin-secret'
+
+
+@pytest.fixture
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_jobs, 'BULK_JOBS_DIR', str(tmp_path))
+    monkeypatch.setattr(bulk_jobs, 'BULK_JOB_RETENTION', 3600)
+    return tmp_path
+
+
+def add_job(jobs_dir, status, finished_ago=None):
+    job_id = 'job_' + os.urandom(8).hex()
+    os.mkdir(jobs_dir / job_id)
+    state = {"id": job_id, "status": status}
+    if finished_ago is not None:
+        state["finished_at"] = time.time() - finished_ago
+    (jobs_dir / job_id / 'job.json').write_text(json.dumps(state))
+    return job_id
+
+
+def test_bulk_routes_need_the_admin_token(client, jobs_dir, monkeypatch):
+    job_id = add_job(jobs_dir, 'completed', finished_ago=0)
+    urls = [f'/api/bulk/jobs/{job_id}', f'/api/bulk/jobs/{job_id}/results']
+    upload = {'data': 'amount,currency\n', 'content_type': 'text/csv'}
+
+    monkeypatch.setattr(access, 'ADMIN_TOKEN', '')
+    assert client.post('/api/bulk/payment-links', **upload).status_code == 404
+    assert all(client.get(url).status_code == 404 for url in urls)
+
+    monkeypatch.setattr(access, 'ADMIN_TOKEN', TOKEN)
+    wrong = {'Authorization': 'Bearer nope'}
+    assert client.post('/api/bulk/hosted-payments', headers=wrong, **upload).status_code == 401
+    assert all(client.get(url, headers=wrong).status_code == 401 for url in urls)
+    assert os.listdir(jobs_dir) == [job_id]  # nothing was uploaded
+
+    response = client.get(urls[0], headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "completed"
+
+
+def test_cleanup_deletes_only_expired_finished_jobs(jobs_dir):
+    expired = [add_job(jobs_dir, 'completed', finished_ago=7200), add_job(jobs_dir, 'failed', finished_ago=7200)]
+    recent = add_job(jobs_dir, 'completed', finished_ago=60)
+    running = add_job(jobs_dir, 'running')
+    abandoned = 'job_' + os.urandom(8).hex()  # upload cut short before job.json was written
+    os.mkdir(jobs_dir / abandoned)
+    os.utime(jobs_dir / abandoned, (time.time() - 7200,) * 2)
+
+    assert sorted(bulk_jobs.cleanup()) == sorted(expired + [abandoned])
+    assert sorted(os.listdir(jobs_dir)) == sorted([recent, running])
+
+
+def test_retention_zero_keeps_everything(jobs_dir, monkeypatch):
+    monkeypatch.setattr(bulk_jobs, 'BULK_JOB_RETENTION', 0)
+    job_id = add_job(jobs_dir, 'completed', finished_ago=10 ** 9)
+    assert bulk_jobs.cleanup() == []
+    assert os.listdir(jobs_dir) == [job_id]
+
+
+def test_new_jobs_are_refused_while_the_active_limit_is_reached(client, jobs_dir, monkeypatch):
+    monkeypatch.setattr(bulk_jobs, 'BULK_MAX_ACTIVE_JOBS', 2)
+    monkeypatch.setattr(access, 'ADMIN_TOKEN', TOKEN)
+    add_job(jobs_dir, 'queued')
+    add_job(jobs_dir, 'running')
+    add_job(jobs_dir, 'completed', finished_ago=0)
+
+    with pytest.raises(bulk_jobs.TooManyJobs):
+        bulk_jobs.create('payment_link', 'csv', io.BytesIO(b'amount,currency\n'))
+    response = client.post('/api/bulk/payment-links', data='amount,currency\n', content_type='text/csv',
+                           headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '60'
+    assert len(os.listdir(jobs_dir)) == 3
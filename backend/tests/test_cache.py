@@ -0,0 +1,78 @@
+import threading, time
+
+import pytest
+
+import cache
+from cache import LocalStore, LRUCache, PaymentDetailsCache
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    lru = LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1
+    lru.set('short', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert lru.get('short') is None
+
+
+def test_terminal_payments_are_kept_longer():
+    assert cache.ttl_for_status("Captured") == cache.PAYMENT_CACHE_TERMINAL_TTL
+    assert cache.ttl_for_status("Pending") == cache.PAYMENT_CACHE_PENDING_TTL
+
+
+def test_concurrent_misses_share_one_load():
+    details_cache = PaymentDetailsCache()
+    release = threading.Event()
+    loads = []
+
+    def loader(payment_id):
+        loads.append(payment_id)
+        release.wait(5)
+        return {"id": payment_id, "status": "Captured"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(details_cache.get('pay_1', loader)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while details_cache.flights.in_flight() == 0:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert loads == ['pay_1']
+    assert len(results) == 5
+    assert details_cache.get('pay_1', loader)["status"] == "Captured"
+    stats = details_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+
+def test_failed_loads_are_not_cached():
+    details_cache = PaymentDetailsCache()
+
+    def failing(payment_id):
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        details_cache.get('pay_1', failing)
+    assert details_cache.get('pay_1', lambda payment_id: {"status": "Pending"}) == {"status": "Pending"}
+
+
+def test_shared_store_serves_other_workers():
+    store = LocalStore()
+    PaymentDetailsCache(store=store).get('pay_1', lambda payment_id: {"id": payment_id, "status": "Captured"})
+
+    def unexpected(payment_id):
+        raise AssertionError("should come from the shared store")
+
+    other_worker = PaymentDetailsCache(store=store)
+    assert other_worker.get('pay_1', unexpected)["status"] == "Captured"
+    assert other_worker.stats()["store_hits"] == 1
+    assert other_worker.peek('pay_2') is None
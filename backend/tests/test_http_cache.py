@@ -0,0 +1,61 @@
+import gzip, json, uuid
+
+import pytest
+
+import http_cache
+
+
+@pytest.fixture
+def details(client, monkeypatch):
+    """ Serve payment details from a stub loader, counting the calls """
+    import app
+    loads = []
+
+    def fetch(payment_id):
+        loads.append(payment_id)
+        return {"id": payment_id, "status": "Captured", "description": "x" * 2000}
+
+    monkeypatch.setattr(app, 'fetch_payment_details', fetch)
+    return loads
+
+
+def test_unchanged_details_get_a_304(client, details):
+    url = f'/api/payment-details/pay_{uuid.uuid4().hex}'
+    first = client.get(url)
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+    assert 'must-revalidate' in first.headers['Cache-Control']
+
+    again = client.get(url, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+    assert client.get(url, headers={'If-None-Match': etag.removeprefix('W/')}).status_code == 304
+    assert client.get(url, headers={'If-None-Match': 'W/"other"'}).status_code == 200
+    assert len(details) == 1
+
+
+def test_large_bodies_are_compressed_for_clients_that_accept_it(client, details):
+    url = f'/api/payment-details/pay_{uuid.uuid4().hex}'
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers
+
+    compressed = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+
+
+def test_small_bodies_are_sent_as_is(client):
+    import app
+    with app.app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = http_cache.respond(http_cache.encode({"id": "pay_1"}))
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_encoding_is_reused_while_the_data_is_the_same_object():
+    data = {"id": "pay_1"}
+    encoded = http_cache.encoded_for('pay_1', data)
+    assert http_cache.encoded_for('pay_1', data) is encoded
+    assert http_cache.encoded_for('pay_1', dict(data)) is not encoded
+    assert encoded.variant('gzip') is encoded.variant('gzip')
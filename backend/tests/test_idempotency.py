@@ -0,0 +1,135 @@
+import threading, time, types, uuid
+
+import pytest
+
+import http_client, idempotency
+from cache import LRUCache, SingleFlight
+
+CARD = {"source": {"type": "token", "token": "tok_test"}, "amount": 1000, "currency": "GBP"}
+
+
+@pytest.fixture
+def fresh_store(monkeypatch):
+    monkeypatch.setattr(idempotency, '_completed', LRUCache(100))
+    monkeypatch.setattr(idempotency, '_flights', SingleFlight())
+
+
+@pytest.fixture
+def payments(client, fresh_store, monkeypatch):
+    """ Stand-in for the SDK payments client - records every request_payment call """
+    import app
+    fake = types.SimpleNamespace(calls=[], release=None, fail=False)
+
+    def request_payment(data, idempotency_key=None):
+        fake.calls.append(idempotency_key)
+        if fake.release is not None:
+            fake.release.wait(5)
+        if fake.fail:
+            raise RuntimeError("upstream blew up")
+        return types.SimpleNamespace(id=f"pay_{len(fake.calls)}", status="Authorized")
+
+    fake.request_payment = request_payment
+    monkeypatch.setattr(app, 'payments_client', fake)
+    return fake
+
+
+def pay(client, key=None, body=CARD):
+    headers = {idempotency.IDEMPOTENCY_HEADER: key} if key else {}
+    return client.post('/api/request-card-payment', json=body, headers=headers)
+
+
+def test_completed_request_is_replayed(client, payments):
+    key = str(uuid.uuid4())
+    first = pay(client, key)
+    second = pay(client, key)
+    assert first.status_code == second.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json() == first.get_json()
+    assert len(payments.calls) == 1
+
+
+def test_concurrent_duplicates_run_the_view_once(client, payments, monkeypatch):
+    arrived = threading.Semaphore(0)
+
+    class CountingFlights(SingleFlight):
+        def do(self, *args, **kwargs):
+            arrived.release()
+            return super().do(*args, **kwargs)
+
+    monkeypatch.setattr(idempotency, '_flights', CountingFlights())
+    payments.release = threading.Event()
+    key = str(uuid.uuid4())
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(pay(client, key))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        assert arrived.acquire(timeout=5)
+    time.sleep(0.05)  # let the last arrival reach the in-flight call's wait
+    payments.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(payments.calls) == 1
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert len({r.get_json()["id"] for r in responses}) == 1
+    assert sorted(r.headers.get('Idempotent-Replayed', 'false') for r in responses) == ['false', 'true', 'true']
+
+
+def test_reused_key_with_a_different_payload_is_refused(client, payments):
+    key = str(uuid.uuid4())
+    assert pay(client, key).status_code == 200
+    response = pay(client, key, body=dict(CARD, amount=2000))
+    assert response.status_code == 422
+    assert len(payments.calls) == 1
+
+
+def test_server_errors_are_not_stored(client, payments):
+    key = str(uuid.uuid4())
+    payments.fail = True
+    assert pay(client, key).status_code == 500
+    payments.fail = False
+    response = pay(client, key)
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+    assert len(payments.calls) == 2
+
+
+def test_payload_hash_catches_double_clicks(client, payments):
+    assert pay(client).status_code == 200
+    assert pay(client).headers['Idempotent-Replayed'] == 'true'
+    assert len(payments.calls) == 1
+
+
+def test_only_client_keys_are_forwarded(client, payments):
+    key = str(uuid.uuid4())
+    pay(client, key)
+    pay(client, body=dict(CARD, reference="no-key"))
+    assert payments.calls == [key, None]
+
+
+def test_flow_submit_forwards_client_keys_as_cko_idempotency_key(client, fresh_store, monkeypatch):
+    sent = []
+
+    class Response:
+        status_code = 201
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"id": "pay_flow", "status": "Approved"}
+
+    def post(url, headers=None, json=None):
+        sent.append(headers)
+        return Response()
+
+    monkeypatch.setattr(http_client, 'checkout_session', lambda: types.SimpleNamespace(post=post))
+    body = {"session_data": "sd", "payment_session_id": "ps_test", "amount": 1000}
+    key = str(uuid.uuid4())
+    assert client.post('/api/submit-flow-session-payment', json=body,
+                       headers={idempotency.IDEMPOTENCY_HEADER: key}).status_code == 201
+    assert client.post('/api/submit-flow-session-payment', json=dict(body, amount=2000)).status_code == 201
+    assert sent[0]['Cko-Idempotency-Key'] == key
+    assert 'Cko-Idempotency-Key' not in sent[1]
@@ -0,0 +1,84 @@
+import types, uuid
+
+import ledger as ledger_module
+from ledger import ENTRIES, Ledger
+
+BAD_PATH = '/nonexistent/dir/ledger.sqlite3'
+
+
+def count(outcome):
+    return ENTRIES._values.get((outcome,), 0)
+
+
+def test_records_and_queries(tmp_path):
+    book = Ledger(str(tmp_path / 'ledger.sqlite3'))
+    book.record('request_card_payment', {"id": "pay_1", "status": "Authorized", "approved": True},
+                {"reference": "ord-1", "amount": 1000, "currency": "GBP"})
+    book.record('request_card_payment', request_data={"reference": "ord-2"}, status="Error", error="declined")
+    assert book.flush()
+
+    rows, next_cursor = book.query(limit=1)
+    assert [row["reference"] for row in rows] == ["ord-2"]
+    rows, _ = book.query(cursor=next_cursor)
+    assert rows[0]["payment_id"] == "pay_1"
+    assert rows[0]["approved"] is True
+    assert rows[0]["amount"] == 1000
+
+
+def test_unopenable_database_never_reaches_the_caller():
+    book = Ledger(BAD_PATH)
+    failed = count('failed')
+
+    book.record('request_card_payment', {"id": "pay_1", "status": "Authorized"})
+    writer = book._writer
+    book.record('request_card_payment', {"id": "pay_2", "status": "Authorized"})
+    assert book.flush()
+
+    assert book._writer is writer  # started once, not again for every request
+    assert book.stats()["writer_running"]
+    assert count('failed') - failed == 2
+    assert book.query() == ([], None)
+
+
+def test_entry_that_cannot_be_built_is_dropped():
+    class Exploding:
+        def __getattr__(self, name):
+            raise RuntimeError("SDK object broke")
+
+    book = Ledger(BAD_PATH)
+    dropped = count('dropped')
+    book.record('request_card_payment', Exploding())
+    assert book.dropped == 1
+    assert count('dropped') - dropped == 1
+
+
+def test_card_payment_succeeds_when_the_ledger_cannot_be_written(client, monkeypatch):
+    import app
+    monkeypatch.setattr(ledger_module.ledger, 'path', BAD_PATH)
+    monkeypatch.setattr(app, 'payments_client', types.SimpleNamespace(
+        request_payment=lambda data, idempotency_key=None: types.SimpleNamespace(id="pay_ok", status="Authorized")))
+
+    response = client.post('/api/request-card-payment', headers={"Idempotency-Key": str(uuid.uuid4())},
+                           json={"source": {"type": "token", "token": "tok_test"}, "amount": 1000, "currency": "GBP"})
+    assert response.status_code == 200
+    assert response.get_json()["id"] == "pay_ok"
+    assert ledger_module.ledger.flush()
+
+
+def test_ledger_route_needs_the_admin_token(client, monkeypatch, tmp_path):
+    import access
+    book = Ledger(str(tmp_path / 'ledger.sqlite3'))
+    book.record('request_card_payment', {"id": "pay_1", "status": "Authorized"})
+    assert book.flush()
+    import app
+    monkeypatch.setattr(app, 'ledger', book)
+
+    monkeypatch.setattr(access, 'ADMIN_TOKEN', '')
+    assert client.get('/api/ledger/payments').status_code == 404
+
+    monkeypatch.setattr(access, 'ADMIN_TOKEN', 'admin-test-token')
+    assert client.get('/api/ledger/payments').status_code == 401
+    assert client.get('/api/ledger/payments', headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get('/api/ledger/payments', headers={"Authorization": "Bearer admin-test-token"})
+    assert response.status_code == 200
+    assert [row["payment_id"] for row in response.get_json()["payments"]] == ["pay_1"]
@@ -0,0 +1,62 @@
+import threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_client, pipeline
+
+
+@pytest.fixture
+def slow_server():
+    """ Answers after 5 seconds """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(5)
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/'
+    server.shutdown()
+
+
+def test_timed_out_step_stops_its_http_request(slow_server):
+    session = http_client.PooledSession()
+    outcome = {}
+
+    def step():
+        start = time.monotonic()
+        try:
+            session.get(slow_server)
+        except requests.Timeout as e:
+            outcome["error"] = e
+        outcome["seconds"] = time.monotonic() - start
+
+    flow = pipeline.Pipeline("test", deadline=5)
+    with pytest.raises(pipeline.StepTimeout):
+        flow.run("slow", step, timeout=0.3)
+
+    # The request was given the step's budget as its timeout, not the 30s default
+    deadline = time.monotonic() + 2
+    while "seconds" not in outcome and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert isinstance(outcome.get("error"), requests.Timeout)
+    assert outcome["seconds"] < 1
+    assert flow.spans[-1]["outcome"] == "timeout"
+
+
+def test_deadline_caps_timeouts():
+    with http_client.deadline(0.5):
+        connect, read = http_client._capped((3.05, 30))
+        assert connect <= 0.5 and read <= 0.5
+        with http_client.deadline(10):
+            # An inner deadline never extends the outer one
+            assert http_client.remaining() <= 0.5
+    assert http_client.remaining() is None
+    assert http_client._capped((3.05, 30)) == (3.05, 30)
@@ -0,0 +1,23 @@
+import profiling
+
+TOKEN = 'profile-test-token'
+
+
+def test_profiles_are_off_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', '')
+    assert client.get('/api/admin/profiles').status_code == 404
+    assert client.get('/api/admin/profiles/abc').status_code == 404
+
+
+def test_profiles_need_the_token(client, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', TOKEN)
+    assert client.get('/api/admin/profiles').status_code == 401
+    assert client.get('/api/admin/profiles', headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get('/api/admin/profiles/abc', headers={profiling.PROFILE_HEADER: "wrong"}).status_code == 401
+
+    response = client.get('/api/admin/profiles', headers={"Authorization": f"Bearer {TOKEN}"})
+    assert response.status_code == 200
+    assert "profiles" in response.get_json()
+    response = client.get('/api/admin/profiles/abc', headers={profiling.PROFILE_HEADER: TOKEN})
+    assert response.status_code == 404  # authorized, but no such profile
+    assert response.get_json()["error"] == "Profile not found"
@@ -0,0 +1,149 @@
+import pytest
+
+import schemas
+
+# What the frontend actually sends, copied from frontend/src/components - keep in step with the pages
+
+BILLING_GB = {"address": {"country": "GB"}}
+DEMO_BILLING = {"address_line1": "123 Main St", "address_line2": "", "city": "London", "zip": "SW1A 0AA",
+                "country": "GB"}
+
+PAYMENT_SESSION_PAYLOADS = {
+    # Flow.js defaultSessionPayload
+    "Flow": {
+        "amount": 4700, "currency": "GBP", "reference": "ORD-123A", "billing": BILLING_GB,
+        "3ds": {"enabled": True},
+        "customer": {"name": "Mark Reilly", "email": "mark.reilly@hotmail.com"},
+        "shipping": {"address": {"address_line1": "123 High St.", "address_line2": "Flat 456", "city": "London",
+                                 "state": "str", "zip": "SW1A 1AA", "country": "GB"}},
+        "items": [{"name": "Tie-Dye Printed Skirt 40", "unit_price": 2700, "quantity": 1},
+                  {"name": "Printed Jersey T-Shirt M", "unit_price": 2000, "quantity": 1}],
+    },
+    # RememberMe.js, with the processing channel field filled in
+    "RememberMe": {
+        "amount": 4700, "currency": "GBP", "reference": "ORD-REMEMBER-ME", "billing": BILLING_GB,
+        "customer": {"name": "John Doe", "email": "customer@example.com"},
+        "processing_channel_id": "pc_yeh2m5bgbfpefmkd2m3kmetiqy",
+    },
+    "FlowSavedCard": {
+        "amount": 1000, "currency": "GBP", "reference": "Save-Card-DEMO", "billing": BILLING_GB,
+        "customer": {"name": "John Doe", "email": "john.doe@example.com"},
+        "payment_method_configuration": {"card": {"store_payment_details": "collect_consent"}},
+    },
+    "Tokenization": {
+        "amount": 1000, "currency": "GBP", "reference": "ORD-TOKENIZATION-DEMO", "billing": BILLING_GB,
+        "customer": {"name": "John Doe", "email": "john.doe@example.com"},
+    },
+    "OnAuthorized": {
+        "amount": 1099, "currency": "GBP", "reference": "on-authorized-demo-1700000000000",
+        "customer": {"email": "customer@example.com"}, "billing": BILLING_GB,
+    },
+    "FlowHandleSubmit": {
+        "amount": 5000, "currency": "EUR", "reference": "handle-submit-demo-1700000000000",
+        "billing": {"address": DEMO_BILLING}, "customer": {"email": "test@example.com"},
+    },
+    "FlowHandleClick": {
+        "amount": 5000, "currency": "GBP", "reference": "handle-click-demo-1700000000000",
+        "3ds": {"enabled": False}, "billing": {"address": DEMO_BILLING}, "customer": {"email": "test@example.com"},
+    },
+    # CheckoutDemo/DeliveryPage.js after BasketPage.js
+    "DeliveryPage": {
+        "amount": 5500, "currency": "EUR", "reference": "checkout-demo-ord-1700000000000",
+        "billing": {"address": DEMO_BILLING}, "customer": {"email": "shopper@example.com"},
+        "shipping": {"address": DEMO_BILLING},
+        "items": [{"name": "Wireless Headphones", "quantity": 1, "unit_price": 5000},
+                  {"name": "Standard Delivery (3-5 days)", "quantity": 1, "unit_price": 500}],
+    },
+}
+
+CARD_PAYMENT = {  # RequestPayment.js, with the Risk.js device session appended
+    "source": {"type": "card", "number": "4242424242424242", "expiry_month": "09", "expiry_year": 29},
+    "amount": 1000, "currency": "EUR", "reference": "risk-json-demo-123",
+    "customer": {"email": "customer@example.com"},
+    "risk": {"enabled": True, "device_session_id": "dsid_example"},
+}
+
+PAYMENT_LINK = {  # PaymentLink.js
+    "amount": 2000, "currency": "GBP", "reference": "PaymentLink-123", "billing": BILLING_GB,
+    "customer": {"name": "John Smith", "email": "john.smith@example.com"},
+    "items": {"name": "Test Item", "amount": 2000, "quantity": 1},
+}
+
+HOSTED_PAYMENTS = {  # HostedPaymentPages.js
+    "amount": 2000, "currency": "GBP", "reference": "ORD-HPP-DEMO-123", "billing": BILLING_GB,
+    "customer": {"name": "John Smith", "email": "john.smith@example.com"},
+    "success_url": "https://example.com/payments/success",
+    "failure_url": "https://example.com/payments/failure",
+    "cancel_url": "https://example.com/payments/cancel",
+}
+
+
+def paypal_context(payment_type, user_action='pay_now', shipping_preference='get_from_file', item_type='digital'):
+    """ PayPal.js handleCreatePaymentContext """
+    return {
+        "source": {"type": "paypal"}, "currency": "USD", "amount": 1000,
+        "capture": payment_type not in ("Recurring", "Unscheduled"),
+        "payment_type": payment_type,
+        "processing_channel_id": "pc_pxk25jk2hvuenon5nyv3p6nf2i",
+        "success_url": "https://react-flask-project-kpyi.onrender.com/success",
+        "failure_url": "https://react-flask-project-kpyi.onrender.com/failure",
+        "reference": "cko-paypal-ref-1700000000000",
+        "items": [{"type": item_type, "name": "Wireless Headphones", "unit_price": 1000, "quantity": 1}],
+        "processing": {"invoice_id": "inv-1700000000000", "user_action": user_action,
+                       "shipping_preference": shipping_preference},
+    }
+
+
+@pytest.mark.parametrize('page', sorted(PAYMENT_SESSION_PAYLOADS))
+def test_payment_session_pages_are_accepted(page):
+    _, errors = schemas.PAYMENT_SESSION(PAYMENT_SESSION_PAYLOADS[page])
+    assert errors == []
+
+
+@pytest.mark.parametrize('schema, payload', [
+    (schemas.CARD_PAYMENT, CARD_PAYMENT),
+    (schemas.PAYMENT_LINK, PAYMENT_LINK),
+    (schemas.HOSTED_PAYMENTS, HOSTED_PAYMENTS),
+])
+def test_other_pages_are_accepted(schema, payload):
+    _, errors = schema(payload)
+    assert errors == []
+
+
+# PayPal.js paymentTypes, userActionOptions, shippingPreferenceOptions and typeOptions
+@pytest.mark.parametrize('payment_type', ['Regular', 'Recurring', 'Installment', 'PayLater', 'MOTO', 'Unscheduled'])
+@pytest.mark.parametrize('user_action', ['pay_now', 'continue'])
+@pytest.mark.parametrize('shipping_preference', ['no_shipping', 'set_provided_address', 'get_from_file'])
+@pytest.mark.parametrize('item_type', ['digital', 'physical'])
+def test_every_paypal_option_is_accepted(payment_type, user_action, shipping_preference, item_type):
+    _, errors = schemas.PAYMENT_CONTEXT(paypal_context(payment_type, user_action, shipping_preference, item_type))
+    assert errors == []
+
+
+def test_normalizes_and_fills_defaults():
+    payload, errors = schemas.PAYMENT_SESSION({"amount": "4700", "currency": "gbp",
+                                              "billing": {"address": {"country": "gb"}}})
+    assert errors == []
+    assert payload["amount"] == 4700
+    assert payload["currency"] == "GBP"
+    assert payload["billing"]["address"]["country"] == "GB"
+    assert payload["processing_channel_id"] == schemas.DEFAULT_PROCESSING_CHANNEL_ID
+    assert payload["success_url"] == schemas.SUCCESS_URL
+
+
+def test_lists_every_failing_field():
+    _, errors = schemas.PAYMENT_SESSION({"amount": -1, "currency": "pounds"})
+    assert {error["field"] for error in errors} == {"amount", "currency", "billing"}
+
+
+def test_payment_context_missing_fields_is_a_400(client):
+    payload = paypal_context('Regular')
+    del payload["success_url"]
+    response = client.post('/api/payment-contexts', json=payload)
+    assert response.status_code == 400
+    assert response.get_json()["fields"] == [{"field": "success_url", "error": "is required"}]
+
+
+def test_other_routes_answer_bad_payloads_with_422(client):
+    response = client.post('/api/paymentLink', json={"amount": 2000})
+    assert response.status_code == 422
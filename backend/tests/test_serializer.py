@@ -0,0 +1,47 @@
+import json
+
+import pytest
+import requests
+
+import serializer
+
+checkout_response = pytest.importorskip('checkout_sdk.checkout_response')
+api_client = pytest.importorskip('checkout_sdk.api_client')
+
+
+def legacy_make_json_serializable(data):
+    """ app.py's implementation before serializer.py """
+    if isinstance(data, dict):
+        return {key: legacy_make_json_serializable(value) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [legacy_make_json_serializable(item) for item in data]
+    elif hasattr(data, '__dict__'):
+        return legacy_make_json_serializable(vars(data))
+    elif isinstance(data, (str, int, float, bool, type(None))):
+        return data
+    elif hasattr(data, 'href'):
+        return data.href
+    else:
+        return str(data)
+
+
+def sdk_response(body):
+    response = requests.models.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Cko-Request-Id'] = 'req_1'
+    return checkout_response.ResponseWrapper(api_client.map_to_http_metadata(response), body)
+
+
+def test_matches_legacy_output_including_http_metadata():
+    wrapper = sdk_response({
+        "id": "pay_1", "status": "Authorized", "amount": 1000, "approved": True,
+        "source": {"type": "card", "scheme": "Visa", "last4": "4242"},
+        "actions": [{"id": "act_1", "type": "Authorization"}],
+        "_links": {"self": {"href": "https://api.sandbox.checkout.com/payments/pay_1"}},
+    })
+    legacy = legacy_make_json_serializable(vars(wrapper))
+    assert isinstance(legacy["http_metadata"]["headers"]["_store"]["cko-request-id"], str)
+
+    assert serializer.make_json_serializable(wrapper) == legacy
+    assert json.loads(serializer.dumps(wrapper)) == legacy
@@ -0,0 +1,56 @@
+import os, socket, subprocess, sys, time, urllib.error, urllib.request
+
+import pytest
+
+from conftest import BACKEND_DIR
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def https_context_app(environ, start_response):
+    """ WSGI app for the gunicorn run below - what every outbound HTTPS call does first """
+    import urllib3.util.ssl_
+    try:
+        urllib3.util.ssl_.create_urllib3_context()
+        status, body = '200 OK', b'ok'
+    except RecursionError:
+        status, body = '500 Internal Server Error', b'ssl was imported before gevent patched it'
+    start_response(status, [('Content-Type', 'text/plain')])
+    return [body]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_workers_can_make_https_calls(mode):
+    pytest.importorskip('gunicorn')
+    if mode == 'async':
+        pytest.importorskip('gevent')
+    port, upstream = free_port(), free_port()
+    env = dict(os.environ, SERVE_MODE=mode, STARTUP_PREWARM='false',
+               CHECKOUT_API_URL=f'http://127.0.0.1:{upstream}')  # refused - the master's probe fails fast
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         '--workers', '1', '--pythonpath', TESTS_DIR, 'test_serve_mode:https_context_app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=5) as response:
+                    assert response.read() == b'ok'
+                break
+            except urllib.error.HTTPError as e:
+                pytest.fail(e.read().decode())
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise
+                time.sleep(0.1)
+    finally:
+        server.terminate()
+        _, stderr = server.communicate(timeout=10)
+    assert 'Monkey-patching ssl after ssl has already been imported' not in stderr
@@ -0,0 +1,33 @@
+import pytest
+
+import apple_pay, bulk_jobs, clients, startup, webhooks
+
+
+@pytest.fixture
+def offline(client, monkeypatch):
+    """ prewarm() without network: no SDK build, Checkout.com probe or Apple connections """
+    monkeypatch.setattr(clients, 'get_checkout_api', lambda: None)
+    monkeypatch.setattr(startup, 'health_probe', lambda *args, **kwargs: False)
+    monkeypatch.setattr(apple_pay, 'PREWARM', False)
+    monkeypatch.setattr(webhooks, 'WEBHOOK_SECRET', 'secret')
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("profiling must not start background work")
+
+
+def test_profile_startup_leaves_shared_state_alone(offline, monkeypatch):
+    monkeypatch.setattr(webhooks.processor, 'start', fail)
+    monkeypatch.setattr(bulk_jobs, 'cleanup', fail)
+    monkeypatch.setattr(bulk_jobs, 'resume', fail)
+    report = startup.profile_startup()
+    assert 'checkout_sdk' in report["init_ms"]
+
+
+def test_workers_start_background_work(offline, monkeypatch):
+    started = []
+    monkeypatch.setattr(webhooks.processor, 'start', lambda: started.append('webhooks'))
+    monkeypatch.setattr(bulk_jobs, 'cleanup', lambda: started.append('bulk_cleanup'))
+    monkeypatch.setattr(bulk_jobs, 'resume', lambda: started.append('bulk_jobs'))
+    startup.start_background_work()
+    assert started == ['webhooks', 'bulk_cleanup', 'bulk_jobs']
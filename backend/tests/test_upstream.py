@@ -0,0 +1,103 @@
+import socket, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import clients, http_client, upstream
+from resilience import CircuitBreaker, UpstreamUnavailable
+
+pytest.importorskip('checkout_sdk')
+
+
+def refused_url():
+    # A port nothing listens on
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}'
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    fresh = {name: CircuitBreaker(name, failure_threshold=3, reset_timeout=30) for name in (upstream.CHECKOUT, upstream.APPLE)}
+    monkeypatch.setattr(upstream, '_breakers', fresh)
+    monkeypatch.setattr(upstream, 'RETRY_BASE_DELAY', 0)
+    return fresh
+
+
+@pytest.fixture
+def sdk_payments(monkeypatch):
+    """ A real SDK client whose requests go to a refused port """
+    monkeypatch.setattr(clients, 'CHECKOUT_SECRET_KEY', 'sk_sbox_testtesttesttesttesttestte#')
+    monkeypatch.setattr(clients, 'CHECKOUT_PUBLIC_KEY', 'pk_sbox_testtesttesttesttesttestte#')
+    monkeypatch.setitem(http_client.url_rewrites, clients.SANDBOX_API_URL, refused_url())
+    return clients._build_checkout_api().payments
+
+
+def test_sdk_network_errors_open_the_breaker(breakers, sdk_payments):
+    attempts = []
+
+    def get_payment_details(payment_id):
+        attempts.append(payment_id)
+        return sdk_payments.get_payment_details(payment_id)
+
+    with pytest.raises(Exception) as raised:
+        upstream.call(upstream.CHECKOUT, 'get_payment_details', get_payment_details, 'pay_1')
+    # The SDK hides the ConnectionError behind a plain CheckoutException
+    assert not hasattr(raised.value, 'http_metadata')
+    assert upstream.is_upstream_failure(raised.value)
+
+    # Retried, and every attempt counted against the circuit
+    assert len(attempts) == upstream.RETRY_ATTEMPTS == 3
+    assert breakers[upstream.CHECKOUT].state == CircuitBreaker.OPEN
+    with pytest.raises(UpstreamUnavailable):
+        upstream.call(upstream.CHECKOUT, 'get_payment_details', get_payment_details, 'pay_1')
+    assert len(attempts) == 3
+
+
+def test_payments_are_not_retried(breakers, sdk_payments):
+    attempts = []
+
+    def request_payment(payment):
+        attempts.append(payment)
+        return sdk_payments.request_payment(payment)
+
+    with pytest.raises(Exception):
+        upstream.call(upstream.CHECKOUT, 'request_payment', request_payment, {"amount": 100})
+    assert len(attempts) == 1
+    assert breakers[upstream.CHECKOUT].state == CircuitBreaker.CLOSED
+
+
+@pytest.fixture
+def failing_server():
+    """ Answers every POST with a 503 and counts them """
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            hits.append(self.path)
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/', hits
+    server.shutdown()
+
+
+def test_raw_5xx_responses_are_retried_when_the_operation_allows(breakers, failing_server):
+    url, hits = failing_server
+    session = http_client.PooledSession()
+
+    response = upstream.call(upstream.APPLE, 'validate_merchant', session.post, url)
+    assert response.status_code == 503
+    assert len(hits) == 3
+    assert breakers[upstream.APPLE].state == CircuitBreaker.OPEN
+
+    response = upstream.call(upstream.CHECKOUT, 'submit_payment_session', session.post, url)
+    assert response.status_code == 503
+    assert len(hits) == 4
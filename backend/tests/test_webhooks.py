@@ -0,0 +1,100 @@
+import hashlib, hmac, json, uuid
+
+import pytest
+
+import webhooks
+
+SECRET = 'whsec_test'
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_SECRET', SECRET)
+    monkeypatch.setattr(webhooks, 'WEBHOOK_AUTH_KEY', '')
+
+
+def event(payment_id, event_type, created_on, event_id=None):
+    return {"id": event_id or f"evt_{uuid.uuid4().hex}", "type": event_type, "created_on": created_on,
+            "data": {"id": payment_id, "amount": 1000, "currency": "GBP", "reference": "ord-1"}}
+
+
+def signed(body, secret=SECRET):
+    raw = json.dumps(body).encode()
+    return raw, {"Cko-Signature": hmac.new(secret.encode(), raw, hashlib.sha256).hexdigest()}
+
+
+@pytest.fixture
+def processor():
+    return webhooks.WebhookProcessor(webhooks.PaymentStateView(), workers=1, queue_size=100, store_path='')
+
+
+def test_signature_is_checked(processor):
+    raw, headers = signed(event('pay_1', 'payment_approved', '2025-01-01T10:00:00Z'))
+    assert processor.receive(raw, headers)[0] == 200
+
+    raw, headers = signed(event('pay_1', 'payment_approved', '2025-01-01T10:00:00Z'), secret='wrong')
+    assert processor.receive(raw, headers)[0] == 401
+    assert processor.receive(raw, {})[0] == 401
+    # Body changed after signing
+    assert processor.receive(raw.replace(b'1000', b'9999'), signed(json.loads(raw))[1])[0] == 401
+
+
+def test_refused_until_a_secret_is_configured(processor, monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_SECRET', '')
+    raw, headers = signed(event('pay_1', 'payment_approved', '2025-01-01T10:00:00Z'), secret='')
+    assert processor.receive(raw, headers)[0] == 503
+
+
+def test_duplicates_are_acknowledged_but_not_queued_again(processor):
+    raw, headers = signed(event('pay_1', 'payment_captured', '2025-01-01T10:00:00Z', event_id='evt_dup'))
+    assert processor.receive(raw, headers) == (200, {"received": True})
+    assert processor.receive(raw, headers) == (200, {"received": True, "duplicate": True})
+    processor.queue.join()
+    assert processor.view.get('pay_1')["status"] == "Captured"
+
+
+def test_duplicates_are_recognised_across_restarts(tmp_path):
+    raw, headers = signed(event('pay_1', 'payment_captured', '2025-01-01T10:00:00Z', event_id='evt_durable'))
+    store_path = str(tmp_path / 'webhooks.sqlite3')
+    first = webhooks.WebhookProcessor(webhooks.PaymentStateView(), workers=1, store_path=store_path)
+    assert first.receive(raw, headers) == (200, {"received": True})
+    first.queue.join()
+
+    restarted = webhooks.WebhookProcessor(webhooks.PaymentStateView(), workers=1, store_path=store_path)
+    assert restarted.receive(raw, headers)[1].get("duplicate")
+
+
+def test_late_events_never_move_a_payment_back():
+    view = webhooks.PaymentStateView()
+    changes = []
+    view.subscribe(lambda payment_id, state, previous: changes.append(state["status"]))
+
+    assert view.apply(event('pay_1', 'payment_captured', '2025-01-01T10:00:05Z'))
+    assert not view.apply(event('pay_1', 'payment_approved', '2025-01-01T10:00:00Z'))
+    # Same timestamp - later in the lifecycle wins
+    assert view.apply(event('pay_1', 'payment_refunded', '2025-01-01T10:00:05Z'))
+    assert not view.apply(event('pay_1', 'payment_captured', '2025-01-01T10:00:05Z'))
+    assert view.get('pay_1')["status"] == "Refunded"
+    assert changes == ["Captured", "Refunded"]
+
+
+def test_webhook_status_is_served_without_calling_upstream(client, monkeypatch):
+    import app
+    from cache import payment_details_cache
+
+    def fetch(payment_id):
+        raise AssertionError("upstream should not be called")
+
+    payment_id = f"pay_{uuid.uuid4().hex}"
+    payment_details_cache.put(payment_id, {"id": payment_id, "status": "Authorized", "amount": 1000})
+    monkeypatch.setattr(app, 'fetch_payment_details', fetch)
+
+    raw, headers = signed(event(payment_id, 'payment_captured', '2025-01-01T10:00:00Z'))
+    response = client.post('/api/webhooks/checkout', data=raw, headers=headers)
+    assert response.status_code == 200
+    webhooks.processor.queue.join()
+
+    details = client.get(f'/api/payment-details/{payment_id}').get_json()
+    assert details["status"] == "Captured"
+    assert details["amount"] == 1000
+    assert client.get(f'/api/payment-status/{payment_id}').get_json()["status"] == "Captured"
@@ -0,0 +1,133 @@
+"""
+Single entry point for calls to Checkout.com and Apple.
+
+Routes wrap every SDK call and raw HTTP request in upstream.call(), which gives
+each upstream:
+- latency/outcome metrics per operation
+- a bulkhead capping concurrent calls, so one slow API can't hold every worker
+- a circuit breaker that fails fast with UpstreamUnavailable (served as a 503)
+  while the upstream is failing
+- jittered retries, for the idempotent operations listed in RETRYABLE_OPERATIONS only
+"""
+import os, time
+
+import requests
+
+import http_client, metrics, profiling
+from resilience import Bulkhead, CircuitBreaker, UpstreamUnavailable, retry
+
+CHECKOUT = 'checkout'
+APPLE = 'apple'
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', 30))
+BULKHEAD_MAX_WAIT = float(os.environ.get('BULKHEAD_MAX_WAIT', 0.5))
+RETRY_ATTEMPTS = int(os.environ.get('UPSTREAM_RETRY_ATTEMPTS', 3))
+RETRY_BASE_DELAY = float(os.environ.get('UPSTREAM_RETRY_BASE_DELAY', 0.1))
+RETRY_MAX_DELAY = float(os.environ.get('UPSTREAM_RETRY_MAX_DELAY', 1.0))
+
+# Safe to repeat - they don't move money or create anything the customer sees twice
+RETRYABLE_OPERATIONS = {'get_payment_details', 'request_wallet_token', 'validate_merchant'}
+
+_breakers = {
+    name: CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+    for name in (CHECKOUT, APPLE)
+}
+_bulkheads = {
+    CHECKOUT: Bulkhead(CHECKOUT, int(os.environ.get('CHECKOUT_MAX_CONCURRENT', 50)), BULKHEAD_MAX_WAIT),
+    APPLE: Bulkhead(APPLE, int(os.environ.get('APPLE_MAX_CONCURRENT', 10)), BULKHEAD_MAX_WAIT),
+}
+
+
+class ServerErrorResponse(Exception):
+    """ A raw 5xx response, raised only so a retryable operation is retried - call() hands the response back """
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def _network_error(exc):
+    # The SDK re-raises network errors as a plain CheckoutException, "from" the requests error
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return True
+        seen.add(id(exc))
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def is_upstream_failure(exc):
+    """ True for errors that say the upstream itself is unhealthy - network trouble or a 5xx """
+    if _network_error(exc):
+        return True
+    response = getattr(exc, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is None:
+        # Checkout SDK exceptions carry the status in http_metadata
+        status_code = getattr(getattr(exc, 'http_metadata', None), 'status_code', None)
+    return status_code is not None and status_code >= 500
+
+
+def call(upstream, operation, fn, *args, **kwargs):
+    """ Run fn(*args, **kwargs) as `operation` against `upstream` """
+    breaker = _breakers[upstream]
+    bulkhead = _bulkheads[upstream]
+
+    def attempt():
+        with bulkhead:
+            breaker.before_call()
+            metrics.UPSTREAM_IN_FLIGHT.inc(upstream, operation)
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if is_upstream_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            else:
+                # Raw requests calls hand back the response and raise_for_status() later
+                if isinstance(result, requests.Response) and result.status_code >= 500:
+                    breaker.record_failure()
+                    if attempts > 1:
+                        raise ServerErrorResponse(result)
+                else:
+                    breaker.record_success()
+                outcome = 'ok'
+                return result
+            finally:
+                metrics.UPSTREAM_LATENCY.observe(upstream, operation, value=time.perf_counter() - start)
+                metrics.UPSTREAM_CALLS.inc(upstream, operation, outcome)
+                metrics.UPSTREAM_IN_FLIGHT.dec(upstream, operation)
+
+    attempts = RETRY_ATTEMPTS if operation in RETRYABLE_OPERATIONS else 1
+
+    def should_retry(exc):
+        # No point retrying once a pipeline step's deadline has passed - nobody is waiting for the answer
+        left = http_client.remaining()
+        return is_upstream_failure(exc) and (left is None or left > 0)
+
+    try:
+        with profiling.phase(f'upstream.{operation}'):
+            return retry(attempt, attempts, should_retry, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+    except ServerErrorResponse as e:
+        # Out of retries - the caller gets the last 5xx response, as it would without retries
+        return e.response
+    except UpstreamUnavailable as e:
+        metrics.UPSTREAM_REJECTIONS.inc(upstream, operation, e.reason)
+        raise
+
+
+def status():
+    return {
+        name: {
+            "circuit": _breakers[name].state,
+            "in_flight": _bulkheads[name].in_use,
+            "max_concurrent": _bulkheads[name].max_concurrent,
+        }
+        for name in _breakers
+    }
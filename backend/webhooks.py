@@ -0,0 +1,266 @@
+"""
+Checkout.com webhook ingestion.
+
+The receiving route only checks the signature, drops duplicates and puts the
+event on an in-process queue, so Checkout.com gets its 200 without waiting on
+anything. A small pool of worker threads applies events to `payment_states`, a
+local view of the latest known status per payment. Listeners registered with
+payment_states.subscribe() hear about every status change (cached payment
+details get the new status patched in, without another call to Checkout.com).
+
+The view lives in the process that received the event. Under gunicorn with
+several workers, only that worker sees the change straight away; the others
+pick it up when their cached copy expires.
+
+Events carry their own timestamp, so a late or repeated event never moves a
+payment back to an older status. With WEBHOOK_STORE_PATH set, accepted events
+are also written to a SQLite spool and replayed after a restart if they had not
+been processed yet.
+"""
+import hashlib, hmac, json, logging, os, queue, sqlite3, threading, time
+from datetime import datetime
+
+import metrics
+from cache import LRUCache
+from logging_config import fields
+
+log = logging.getLogger('app.webhooks')
+
+# Signature key from the webhook's settings in the Checkout.com dashboard
+WEBHOOK_SECRET = os.environ.get('CHECKOUT_WEBHOOK_SECRET', '')
+# Optional - the Authorization header value configured for the webhook
+WEBHOOK_AUTH_KEY = os.environ.get('CHECKOUT_WEBHOOK_AUTH_KEY', '')
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 10000))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 2))
+WEBHOOK_STORE_PATH = os.environ.get('WEBHOOK_STORE_PATH', '')
+WEBHOOK_STATE_SIZE = int(os.environ.get('WEBHOOK_STATE_SIZE', 50000))
+WEBHOOK_STATE_TTL = float(os.environ.get('WEBHOOK_STATE_TTL', 86400))
+# Processed events are kept in the spool this long, so redeliveries are still recognised
+WEBHOOK_STORE_RETENTION = float(os.environ.get('WEBHOOK_STORE_RETENTION', 7 * 86400))
+
+# Event type -> payment status. Events not listed (e.g. capture_declined) don't change the status.
+EVENT_STATUSES = {
+    "payment_pending": "Pending",
+    "payment_approved": "Authorized",
+    "payment_captured": "Captured",
+    "payment_paid": "Paid",
+    "payment_declined": "Declined",
+    "payment_expired": "Expired",
+    "payment_canceled": "Canceled",
+    "payment_voided": "Voided",
+    "payment_refunded": "Refunded",
+}
+# Tie-breaker for events with the same timestamp - later in the lifecycle wins
+STATUS_ORDER = {"Pending": 0, "Authorized": 1, "Captured": 2, "Paid": 2, "Declined": 2,
+                "Expired": 2, "Canceled": 2, "Voided": 2, "Refunded": 3}
+
+WEBHOOK_EVENTS = metrics.Counter('webhook_events_total', 'Webhook events, by outcome', ('type', 'outcome'))
+
+
+class InvalidWebhook(Exception):
+    pass
+
+
+def _timestamp(value):
+    """ Checkout.com ISO 8601 timestamp -> epoch seconds (0 when missing or unparseable) """
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def verify_signature(raw_body, headers):
+    """ Raise InvalidWebhook unless the body was signed with WEBHOOK_SECRET """
+    if WEBHOOK_AUTH_KEY and not hmac.compare_digest(headers.get('Authorization', ''), WEBHOOK_AUTH_KEY):
+        raise InvalidWebhook("Authorization header does not match")
+    expected = hmac.new(WEBHOOK_SECRET.encode(), raw_body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(headers.get('Cko-Signature', '').lower(), expected):
+        raise InvalidWebhook("Signature does not match")
+
+
+class PaymentStateView:
+    """ Latest known status per payment, built from webhook events """
+
+    def __init__(self, maxsize=WEBHOOK_STATE_SIZE, ttl=WEBHOOK_STATE_TTL):
+        self.states = LRUCache(maxsize)
+        self.ttl = ttl
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        """ listener(payment_id, state, previous_state) is called after every status change """
+        self._listeners.append(listener)
+        return listener
+
+    def get(self, payment_id):
+        return self.states.get(payment_id)
+
+    def apply(self, event):
+        """ Returns True when the event changed the payment's status """
+        status = EVENT_STATUSES.get(event.get("type"))
+        data = event.get("data") or {}
+        payment_id = data.get("id")
+        if status is None or not payment_id:
+            return False
+
+        state = {
+            "payment_id": payment_id,
+            "status": status,
+            "event_id": event.get("id"),
+            "event_type": event.get("type"),
+            "updated_on": event.get("created_on"),
+            "amount": data.get("amount"),
+            "currency": data.get("currency"),
+            "reference": data.get("reference"),
+            "response_code": data.get("response_code"),
+        }
+        with self._lock:
+            previous = self.states.get(payment_id)
+            if previous is not None and self._order(state) <= self._order(previous):
+                return False  # out of date, or nothing new
+            self.states.set(payment_id, state, self.ttl)
+
+        for listener in self._listeners:
+            try:
+                listener(payment_id, state, previous)
+            except Exception:
+                log.exception("Payment state listener failed", extra=fields(payment_id=payment_id))
+        return True
+
+    @staticmethod
+    def _order(state):
+        return _timestamp(state["updated_on"]), STATUS_ORDER.get(state["status"], 0)
+
+
+class EventSpool:
+    """ SQLite record of accepted events - remembers event ids and what is left to process """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS webhook_events ("
+                          "id TEXT PRIMARY KEY, body TEXT NOT NULL, received_at REAL NOT NULL, processed_at REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS webhook_events_pending ON webhook_events (processed_at)")
+        self._lock = threading.Lock()
+
+    def add(self, event_id, body):
+        """ False when the event was already accepted """
+        with self._lock:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO webhook_events (id, body, received_at) VALUES (?, ?, ?)",
+                                       (event_id, body, time.time()))
+        return cursor.rowcount == 1
+
+    def remove(self, event_id):
+        with self._lock:
+            self.conn.execute("DELETE FROM webhook_events WHERE id = ?", (event_id,))
+
+    def mark_processed(self, event_id):
+        with self._lock:
+            self.conn.execute("UPDATE webhook_events SET processed_at = ? WHERE id = ?", (time.time(), event_id))
+
+    def pending(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT body FROM webhook_events WHERE processed_at IS NULL "
+                                     "ORDER BY received_at").fetchall()
+        return [row[0] for row in rows]
+
+    def prune(self, older_than):
+        with self._lock:
+            self.conn.execute("DELETE FROM webhook_events WHERE processed_at < ?", (older_than,))
+
+
+class WebhookProcessor:
+    def __init__(self, view, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, store_path=WEBHOOK_STORE_PATH):
+        self.view = view
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.store_path = store_path
+        self.spool = None
+        self.seen = LRUCache(maxsize=queue_size * 2)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Start the worker threads (once per process) and replay anything left in the spool """
+        with self._lock:
+            if self._threads:
+                return
+            if self.store_path:
+                self.spool = EventSpool(self.store_path)
+                self.spool.prune(time.time() - WEBHOOK_STORE_RETENTION)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'webhook-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self.spool is not None:
+                threading.Thread(target=self._replay, name='webhook-replay', daemon=True).start()
+
+    def _replay(self):
+        replayed = self.spool.pending()
+        if replayed:
+            log.info("Replaying unprocessed webhook events", extra=fields(count=len(replayed)))
+        for body in replayed:
+            event = json.loads(body)
+            self.seen.set(event["id"], True)
+            self.queue.put(event)
+
+    def receive(self, raw_body, headers):
+        """ Verify and queue one delivery. Returns (http_status, body). """
+        if not WEBHOOK_SECRET:
+            return 503, {"error": "Webhooks are not configured"}
+        self.start()
+        try:
+            verify_signature(raw_body, headers)
+            event = json.loads(raw_body)
+            event_id, event_type = event["id"], event["type"]
+        except InvalidWebhook as e:
+            WEBHOOK_EVENTS.inc('unknown', 'rejected')
+            log.warning("Webhook rejected", extra=fields(error=str(e)))
+            return 401, {"error": "Invalid webhook signature"}
+        except (ValueError, KeyError, TypeError):
+            WEBHOOK_EVENTS.inc('unknown', 'malformed')
+            return 400, {"error": "Malformed webhook event"}
+
+        if self.seen.get(event_id) or (self.spool is not None and not self.spool.add(event_id, raw_body.decode())):
+            WEBHOOK_EVENTS.inc(event_type, 'duplicate')
+            return 200, {"received": True, "duplicate": True}
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Not acknowledged, so Checkout.com delivers it again later
+            if self.spool is not None:
+                self.spool.remove(event_id)
+            WEBHOOK_EVENTS.inc(event_type, 'queue_full')
+            return 503, {"error": "Webhook queue is full"}
+        self.seen.set(event_id, True)
+        WEBHOOK_EVENTS.inc(event_type, 'accepted')
+        return 200, {"received": True}
+
+    def _work(self):
+        while True:
+            event = self.queue.get()
+            try:
+                changed = self.view.apply(event)
+                WEBHOOK_EVENTS.inc(event.get("type"), 'applied' if changed else 'ignored')
+                if self.spool is not None:
+                    self.spool.mark_processed(event["id"])
+            except Exception:
+                # Left unprocessed in the spool - replayed on the next start
+                WEBHOOK_EVENTS.inc(event.get("type"), 'failed')
+                log.exception("Webhook event processing failed", extra=fields(event_id=event.get("id")))
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "workers": len(self._threads),
+            "payments_tracked": len(self.view.states),
+            "durable": self.spool is not None,
+        }
+
+
+payment_states = PaymentStateView()
+processor = WebhookProcessor(payment_states)